@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Reportes diarios de carga a partir del historial de telemetría
+
+Trabaja sobre los segmentos crudos (1s) de HistoryStore con NumPy: cada
+columna del mmap se lee como un arreglo float32 y todos los cálculos
+(tiempo por etapa, Ah de entrada/salida, horas de absorción, excursiones
+de temperatura, SOC) son pasadas vectorizadas, sin bucles por fila. Un mes
+a 1 Hz (~2,6M filas) se procesa en una fracción de segundo.
+
+Uso:
+    python analytics.py --history-dir history --days 30
+    python analytics.py --start 2025-08-01 --end 2025-08-31 --json
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # los reportes son opcionales; el resto del backend no usa NumPy
+    np = None
+
+from history_store import CHARGE_STATES, HistoryStore
+
+REPORT_FIELDS = (
+    "chargeState",
+    "panelToBatteryCurrent",
+    "batteryToLoadCurrent",
+    "temperature",
+    "estimatedSOC",
+)
+
+# Una muestra representa el tiempo hasta la siguiente, con este máximo (s);
+# los huecos más largos (backend caído, ESP32 desconectado) no se cuentan
+DEFAULT_MAX_GAP = 10.0
+DEFAULT_TEMP_THRESHOLD = 40.0
+
+_BULK = CHARGE_STATES.index("BULK_CHARGE")
+_ABSORPTION = CHARGE_STATES.index("ABSORPTION_CHARGE")
+
+
+class AnalyticsUnavailable(RuntimeError):
+    """NumPy no está instalado"""
+
+
+def load_samples(store, start, end):
+    """
+    Devuelve (timestamps, {campo: arreglo}) con las filas de 1s que tienen
+    chargeState entre `start` y `end`, ordenadas por tiempo.
+    """
+    if np is None:
+        raise AnalyticsUnavailable("Los reportes requieren NumPy (pip install numpy)")
+    indexes = {field: store.fields.index(field) for field in REPORT_FIELDS}
+    timestamps, columns = [], {field: [] for field in REPORT_FIELDS}
+    # Se ejecuta en un hilo: mapeos propios, no los segmentos del escritor
+    for segment, first, last in store.read_segments("1s", start, end):
+        matrix = np.frombuffer(segment.values, dtype=np.float32).reshape(segment.columns, segment.rows)
+        states = matrix[indexes["chargeState"], first:last + 1]
+        rows = np.flatnonzero(~np.isnan(states))
+        timestamps.append(segment.start + (first + rows) * segment.step)
+        for field, index in indexes.items():
+            columns[field].append(matrix[index, first:last + 1][rows])
+        del matrix, states  # no retener vistas del mmap
+    if not timestamps:
+        return np.empty(0, dtype=np.int64), {field: np.empty(0, dtype=np.float32) for field in REPORT_FIELDS}
+    return (
+        np.concatenate(timestamps).astype(np.int64),
+        {field: np.concatenate(parts) for field, parts in columns.items()},
+    )
+
+
+def day_boundaries(start, end):
+    """Inicios de los días locales que cubren [start, end] y el fin del último"""
+    day = datetime.fromtimestamp(start).replace(hour=0, minute=0, second=0, microsecond=0)
+    bounds = []
+    while day.timestamp() <= end:
+        bounds.append(day)
+        day = (day + timedelta(days=1, hours=2)).replace(hour=0)  # robusto a cambios de hora
+    bounds.append(day)
+    return bounds
+
+
+def _round(value, digits=3):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def summarize(timestamps, columns, temp_threshold=DEFAULT_TEMP_THRESHOLD,
+              expected_absorption_hours=None, max_gap=DEFAULT_MAX_GAP):
+    """Indicadores de un tramo de muestras (normalmente un día)"""
+    n = len(timestamps)
+    if n == 0:
+        return {"samples": 0}
+
+    dt = np.diff(timestamps, append=timestamps[-1] + 1).astype(np.float64)
+    np.minimum(dt, max_gap, out=dt)
+
+    states = columns["chargeState"].astype(np.int64)
+    state_seconds = np.bincount(states, weights=dt, minlength=len(CHARGE_STATES))
+
+    # Corrientes en mA -> Ah; NaN (sin lectura) no suma
+    ah_in = np.nansum(columns["panelToBatteryCurrent"] * dt) / 3.6e6
+    ah_out = np.nansum(columns["batteryToLoadCurrent"] * dt) / 3.6e6
+
+    temperature = columns["temperature"]
+    above = temperature > temp_threshold
+    excursions = int(np.count_nonzero(above[1:] & ~above[:-1]) + above[0])
+
+    soc = columns["estimatedSOC"]
+    soc_mask = ~np.isnan(soc)
+    soc_valid = soc[soc_mask]
+    bulk_starts = int(np.count_nonzero((states[1:] == _BULK) & (states[:-1] != _BULK)))
+
+    absorption_hours = state_seconds[_ABSORPTION] / 3600
+    return {
+        "samples": n,
+        "coverage_hours": _round(dt.sum() / 3600),
+        "time_in_state_hours": {
+            state: _round(seconds / 3600) for state, seconds in zip(CHARGE_STATES, state_seconds)
+        },
+        "ah_in": _round(ah_in),
+        "ah_out": _round(ah_out),
+        "ah_net": _round(ah_in - ah_out),
+        "bulk_starts": bulk_starts,
+        "absorption": {
+            "hours": _round(absorption_hours),
+            "expected_hours": expected_absorption_hours,
+            "ratio": _round(absorption_hours / expected_absorption_hours)
+            if expected_absorption_hours else None,
+        },
+        "temperature": {
+            "max": _round(np.nanmax(temperature)) if np.any(~np.isnan(temperature)) else None,
+            "threshold": temp_threshold,
+            "hours_above": _round(dt[above].sum() / 3600),
+            "excursions": excursions,
+        },
+        "soc": {
+            "min": _round(soc_valid.min()) if soc_valid.size else None,
+            "max": _round(soc_valid.max()) if soc_valid.size else None,
+            "avg": _round(np.average(soc_valid, weights=dt[soc_mask])) if soc_valid.size else None,
+            "end": _round(soc_valid[-1]) if soc_valid.size else None,
+        },
+    }
+
+
+def daily_report(store, start, end, temp_threshold=DEFAULT_TEMP_THRESHOLD,
+                 expected_absorption_hours=None, max_gap=DEFAULT_MAX_GAP):
+    """Reporte por día local entre `start` y `end` (epoch) más el total del rango"""
+    started = time.perf_counter()
+    timestamps, columns = load_samples(store, start, end)
+    bounds = day_boundaries(start, end)
+    cuts = np.searchsorted(timestamps, [b.timestamp() for b in bounds])
+    options = {"temp_threshold": temp_threshold,
+               "expected_absorption_hours": expected_absorption_hours, "max_gap": max_gap}
+
+    days = []
+    for day, first, last in zip(bounds, cuts[:-1], cuts[1:]):
+        if first == last:
+            continue
+        day_columns = {field: values[first:last] for field, values in columns.items()}
+        days.append({"date": day.date().isoformat(),
+                     **summarize(timestamps[first:last], day_columns, **options)})
+
+    return {
+        "start": start,
+        "end": end,
+        "days": days,
+        "total": summarize(timestamps, columns, **options),
+        "rows_processed": int(len(timestamps)),
+        "processing_time": f"{time.perf_counter() - started:.3f}s",
+    }
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reportes diarios de carga desde el historial")
+    parser.add_argument("--history-dir", default="history")
+    parser.add_argument("--days", type=int, default=7, help="días hacia atrás (sin --start)")
+    parser.add_argument("--start", help="fecha/hora ISO de inicio")
+    parser.add_argument("--end", help="fecha/hora ISO de fin (por defecto, ahora)")
+    parser.add_argument("--temp-threshold", type=float, default=DEFAULT_TEMP_THRESHOLD)
+    parser.add_argument("--absorption-hours", type=float, default=None,
+                        help="horas de absorción esperadas (calculatedAbsorptionHours)")
+    parser.add_argument("--json", action="store_true", help="salida JSON")
+    args = parser.parse_args(argv)
+
+    end = _parse_date(args.end) if args.end else time.time()
+    start = _parse_date(args.start) if args.start else end - args.days * 86400
+    store = HistoryStore(args.history_dir)
+    try:
+        report = daily_report(store, start, end, args.temp_threshold, args.absorption_hours)
+    except AnalyticsUnavailable as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0
+
+    print(f"📊 {report['rows_processed']} muestras procesadas en {report['processing_time']}")
+    for day in report["days"]:
+        states = day["time_in_state_hours"]
+        print(
+            f"{day['date']}  Ah in {day['ah_in']:>8}  out {day['ah_out']:>8}  "
+            f"BULK {states['BULK_CHARGE']}h  ABS {states['ABSORPTION_CHARGE']}h  "
+            f"FLOAT {states['FLOAT_CHARGE']}h  Tmax {day['temperature']['max']}  "
+            f"SOC {day['soc']['min']}-{day['soc']['max']}%"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga y latencia de la API
+
+Reproduce una mezcla realista de tráfico:
+- N clientes haciendo polling de GET /data/
+- escrituras ocasionales de POST /config/parameter
+- aplicaciones de configuraciones guardadas
+- lecturas de GET /schedule
+
+y reporta p50/p95/p99, throughput y la espera en la cola serie. Los
+resultados se guardan en JSON para comparar entre commits.
+
+Los rechazos de validación (4xx) se cuentan aparte de los errores (5xx o
+fallos de conexión). Con `--url` la espera en la cola serie se estima a
+partir de los histogramas de /metrics, leídos antes y después de la carga.
+
+Uso:
+    # API en proceso contra el simulador del ESP32 (no requiere hardware)
+    python benchmark.py --duration 30 --pollers 20 --output bench.json
+
+    # API externa ya corriendo (con ESP32 real o simulado)
+    python benchmark.py --url http://localhost:8000 --duration 60
+
+    # Comparar contra un resultado anterior
+    python benchmark.py --compare bench_base.json --output bench_new.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+BENCH_CONFIGS = {
+    "Bench Litio 200Ah": {
+        "batteryCapacity": 200.0, "isLithium": True, "thresholdPercentage": 3.0,
+        "maxAllowedCurrent": 15000.0, "bulkVoltage": 14.6, "absorptionVoltage": 14.6,
+        "floatVoltage": 13.8, "useFuenteDC": False, "fuenteDC_Amps": 0.0, "factorDivider": 1,
+    },
+    "Bench GEL 100Ah": {
+        "batteryCapacity": 100.0, "isLithium": False, "thresholdPercentage": 2.5,
+        "maxAllowedCurrent": 5000.0, "bulkVoltage": 14.4, "absorptionVoltage": 14.4,
+        "floatVoltage": 13.6, "useFuenteDC": True, "fuenteDC_Amps": 10.0, "factorDivider": 2,
+    },
+}
+
+# Regresión si el p95 empeora más que este porcentaje
+REGRESSION_THRESHOLD = 20.0
+
+# Valores de flotación válidos para ambas químicas de BENCH_CONFIGS
+# (LiFePO4 13.6-14.0 V, GEL/AGM 13.2-13.7 V): el applier las alterna
+WRITE_FLOAT_VOLTAGES = (13.6, 13.7)
+
+SERIAL_HISTOGRAMS = {
+    "queue_wait": "charger_serial_queue_wait_seconds",
+    "round_trip": "charger_serial_round_trip_seconds",
+}
+METRIC_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+METRIC_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def bucket_percentile(buckets, pct):
+    """
+    Percentil estimado de un histograma acumulado [(límite, conteo)...],
+    interpolando dentro del bucket como histogram_quantile de Prometheus
+    """
+    total = buckets[-1][1]
+    rank = pct / 100 * total
+    lower, below = 0.0, 0
+    for bound, cumulative in buckets:
+        if cumulative >= rank and cumulative > below:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * (rank - below) / (cumulative - below)
+        lower, below = bound, cumulative
+    return lower
+
+
+def summarize_buckets(buckets, total_seconds, scale=1000.0):
+    """Como `summarize`, pero a partir de un histograma de /metrics"""
+    count = int(buckets[-1][1]) if buckets else 0
+    if not count:
+        return {"count": 0}
+    return {
+        "count": count,
+        "p50_ms": round(bucket_percentile(buckets, 50) * scale, 3),
+        "p95_ms": round(bucket_percentile(buckets, 95) * scale, 3),
+        "p99_ms": round(bucket_percentile(buckets, 99) * scale, 3),
+        "mean_ms": round(total_seconds / count * scale, 3),
+        "estimated": True,
+    }
+
+
+def parse_metrics(text):
+    """Muestras de un texto de Prometheus: [(nombre, {etiquetas}, valor)]"""
+    samples = []
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line.strip())
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        samples.append((name, dict(METRIC_LABEL.findall(labels or "")), float(value)))
+    return samples
+
+
+def serial_counts(samples):
+    """
+    Conteos serie agregados por comando (todos los dispositivos):
+    {(histograma, comando): {"buckets": {le: n}, "sum": s}} y fallos totales
+    """
+    series = defaultdict(lambda: {"buckets": defaultdict(float), "sum": 0.0})
+    failures = 0.0
+    for name, labels, value in samples:
+        if name == "charger_serial_commands_total":
+            if labels.get("outcome") != "ok":
+                failures += value
+            continue
+        for key, metric in SERIAL_HISTOGRAMS.items():
+            command = labels.get("command")
+            if name == metric + "_bucket":
+                series[key, command]["buckets"][float(labels["le"])] += value
+            elif name == metric + "_sum":
+                series[key, command]["sum"] += value
+    return series, failures
+
+
+def summarize(values, scale=1000.0):
+    """Resumen en milisegundos de una lista de duraciones en segundos"""
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * scale, 3),
+        "p95_ms": round(percentile(ordered, 95) * scale, 3),
+        "p99_ms": round(percentile(ordered, 99) * scale, 3),
+        "max_ms": round(ordered[-1] * scale, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * scale, 3),
+    }
+
+
+class Recorder:
+    """Acumula latencias por operación"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.serial_wait = defaultdict(list)
+        self.serial_rtt = defaultdict(list)
+        self.serial_failures = 0
+        # Con --url: diferencia de los histogramas de /metrics durante la carga
+        self.serial_scraped = None
+
+    def record(self, operation, elapsed, status):
+        """`status` es el código HTTP, o None si la petición no obtuvo respuesta"""
+        self.latencies[operation].append(elapsed)
+        if status is None or status >= 500:
+            self.errors[operation] += 1
+        elif status >= 400:
+            self.rejected[operation] += 1
+
+    def observe_serial(self, command, wait, rtt, outcome):
+        self.serial_wait[command].append(wait)
+        self.serial_rtt[command].append(rtt)
+        if outcome != "ok":
+            self.serial_failures += 1
+
+    def scraped_serial(self, before, after):
+        """Guarda lo que la API observó en el puerto serie entre dos lecturas de /metrics"""
+        before_series, before_failures = serial_counts(before)
+        after_series, after_failures = serial_counts(after)
+        self.serial_scraped = {}
+        for key, series in after_series.items():
+            previous = before_series.get(key, {"buckets": {}, "sum": 0.0})
+            buckets = [(le, count - previous["buckets"].get(le, 0.0))
+                       for le, count in sorted(series["buckets"].items())]
+            if buckets and buckets[-1][1]:
+                self.serial_scraped[key] = (buckets, series["sum"] - previous["sum"])
+        self.serial_failures = int(after_failures - before_failures)
+
+    def serial_report(self):
+        """Espera en la cola serie: observada en proceso o estimada desde /metrics"""
+        if self.serial_wait:
+            all_waits = [w for values in self.serial_wait.values() for w in values]
+            return {
+                "commands": len(all_waits),
+                "failures": self.serial_failures,
+                "queue_wait": summarize(all_waits),
+                "by_command": {
+                    command: {
+                        "queue_wait": summarize(self.serial_wait[command]),
+                        "round_trip": summarize(self.serial_rtt[command]),
+                    }
+                    for command in sorted(self.serial_wait)
+                },
+            }
+        if not self.serial_scraped:
+            return None
+        # Todos los comandos comparten los límites de bucket: se suman
+        merged, total = defaultdict(float), 0.0
+        by_command = defaultdict(dict)
+        for (key, command), (buckets, seconds) in sorted(self.serial_scraped.items()):
+            by_command[command][key] = summarize_buckets(buckets, seconds)
+            if key == "queue_wait":
+                for le, count in buckets:
+                    merged[le] += count
+                total += seconds
+        queue_wait = summarize_buckets(sorted(merged.items()), total)
+        return {
+            "commands": queue_wait["count"],
+            "failures": self.serial_failures,
+            "queue_wait": queue_wait,
+            "by_command": dict(by_command),
+            "source": "metrics",
+        }
+
+    def report(self, duration):
+        operations = {}
+        total = 0
+        for operation, values in sorted(self.latencies.items()):
+            total += len(values)
+            operations[operation] = {
+                **summarize(values),
+                "errors": self.errors[operation],
+                "rejected": self.rejected[operation],
+                "throughput_rps": round(len(values) / duration, 3),
+            }
+        report = {
+            "duration_s": round(duration, 3),
+            "total_requests": total,
+            "throughput_rps": round(total / duration, 3),
+            "operations": operations,
+        }
+        serial = self.serial_report()
+        if serial:
+            report["serial"] = serial
+        return report
+
+
+async def timed(recorder, operation, coroutine):
+    started = time.perf_counter()
+    try:
+        status = (await coroutine).status_code
+    except httpx.HTTPError:
+        status = None
+    recorder.record(operation, time.perf_counter() - started, status)
+
+
+async def pause(delay, stop_at):
+    """Duerme `delay` sin pasar de `stop_at`; False si ya no queda tiempo de carga"""
+    await asyncio.sleep(max(0.0, min(delay, stop_at - time.monotonic())))
+    return time.monotonic() < stop_at
+
+
+async def poller(client, recorder, interval, stop_at):
+    delay = random.uniform(0, interval)
+    while await pause(delay, stop_at):
+        await timed(recorder, "GET /data/", client.get("/data/"))
+        delay = interval
+
+
+async def writer(client, recorder, interval, stop_at):
+    n = 0
+    while await pause(random.expovariate(1 / interval), stop_at):
+        n += 1
+        payload = {"parameter": "floatVoltage", "value": WRITE_FLOAT_VOLTAGES[n % 2]}
+        await timed(recorder, "POST /config/parameter", client.post("/config/parameter", json=payload))
+
+
+async def applier(client, recorder, interval, stop_at):
+    names = list(BENCH_CONFIGS)
+    n = 0
+    while await pause(random.expovariate(1 / interval), stop_at):
+        n += 1
+        name = names[n % len(names)]
+        await timed(recorder, "POST apply", client.post(f"/config/custom/configurations/{name}/apply"))
+
+
+async def schedule_reader(client, recorder, interval, stop_at):
+    while await pause(random.expovariate(1 / interval), stop_at):
+        await timed(recorder, "GET /schedule", client.get("/schedule"))
+
+
+async def scrape_metrics(client):
+    """Muestras de /metrics de la API externa; None si no las expone"""
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+    return parse_metrics(response.text)
+
+
+async def run_load(base_url, args, recorder):
+    limits = httpx.Limits(max_connections=args.pollers + 8, max_keepalive_connections=args.pollers + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await client.post("/config/custom/configurations/bulk", json={"configurations": BENCH_CONFIGS})
+        scrape = args.url is not None
+        before = await scrape_metrics(client) if scrape else None
+
+        started = time.monotonic()
+        stop_at = started + args.duration
+        workers = [poller(client, recorder, args.poll_interval, stop_at) for _ in range(args.pollers)]
+        if args.write_interval > 0:
+            workers.append(writer(client, recorder, args.write_interval, stop_at))
+        if args.apply_interval > 0:
+            workers.append(applier(client, recorder, args.apply_interval, stop_at))
+        if args.schedule_interval > 0:
+            workers.append(schedule_reader(client, recorder, args.schedule_interval, stop_at))
+        await asyncio.gather(*workers)
+        duration = time.monotonic() - started
+        if before is not None:
+            after = await scrape_metrics(client)
+            if after is not None:
+                recorder.scraped_serial(before, after)
+
+        await client.post("/config/custom/configurations/bulk/delete",
+                          json={"names": list(BENCH_CONFIGS)})
+    return duration
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_in_process(args, recorder):
+    """Levanta la API con el simulador en este mismo proceso y la carga por HTTP"""
+    workdir = tempfile.mkdtemp(prefix="esp32-bench-")
+    os.environ.update({
+        "ESP32_SIMULATOR": "true",
+        "CONFIG_DB": os.path.join(workdir, "configuraciones.db"),
+        "CONFIG_FILE": os.path.join(workdir, "configuraciones.json"),
+        "SCHEDULE_FILE": os.path.join(workdir, "schedule.json"),
+        "HISTORY_DIR": os.path.join(workdir, "history"),
+        "STATE_DIR": os.path.join(workdir, "state"),
+    })
+    import uvicorn
+
+    import main
+    from esp32_controller import ESP32Controller
+    from esp32_simulator import ESP32Simulator, SimulatedTransport
+
+    simulator = ESP32Simulator(latency=args.sim_latency, jitter=args.sim_jitter)
+    main.state.controller = ESP32Controller(
+        main.ESP32_PORT, main.ESP32_BAUDRATE, transport=SimulatedTransport(simulator)
+    )
+    main.state.controller.observers.append(recorder.observe_serial)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    await main.state.controller.wait_connected(5)
+    try:
+        return await run_load(f"http://127.0.0.1:{port}", args, recorder)
+    finally:
+        server.should_exit = True
+        await server_task
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current):
+    """Compara p95 por operación; devuelve las regresiones encontradas"""
+    regressions = []
+    print("\n📊 Comparación contra", baseline.get("git_commit") or "línea base")
+    for operation, stats in current["results"]["operations"].items():
+        before = baseline.get("results", {}).get("operations", {}).get(operation)
+        if not before or not before.get("p95_ms") or not stats.get("p95_ms"):
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        flag = "❌" if change > REGRESSION_THRESHOLD else "✅"
+        print(f"   {flag} {operation}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms ({change:+.1f}%)")
+        if change > REGRESSION_THRESHOLD:
+            regressions.append(operation)
+    return regressions
+
+
+def print_report(report):
+    print("\n" + "=" * 60)
+    print(" RESULTADOS DEL BENCHMARK")
+    print("=" * 60)
+    print(f"Duración: {report['duration_s']}s  |  Peticiones: {report['total_requests']}  |  "
+          f"Throughput: {report['throughput_rps']} req/s")
+    for operation, stats in report["operations"].items():
+        print(f"   {operation:<24} n={stats['count']:<6} err={stats['errors']:<4} rej={stats['rejected']:<4} "
+              f"p50={stats.get('p50_ms')}ms p95={stats.get('p95_ms')}ms p99={stats.get('p99_ms')}ms")
+    serial = report.get("serial")
+    if serial:
+        wait = serial["queue_wait"]
+        source = " (estimada desde /metrics)" if serial.get("source") == "metrics" else ""
+        print(f"Serie: {serial['commands']} comandos, {serial['failures']} fallos, espera en cola{source} "
+              f"p50={wait['p50_ms']}ms p95={wait['p95_ms']}ms p99={wait['p99_ms']}ms")
+    else:
+        print("Serie: sin datos (la API externa no expone /metrics)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga de la API del cargador")
+    parser.add_argument("--url", help="API externa; sin esto se usa la API en proceso con simulador")
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos de carga")
+    parser.add_argument("--pollers", type=int, default=20, help="clientes haciendo polling de /data/")
+    parser.add_argument("--poll-interval", type=float, default=3.0)
+    parser.add_argument("--write-interval", type=float, default=5.0, help="media entre escrituras (0 = sin)")
+    parser.add_argument("--apply-interval", type=float, default=15.0, help="media entre applies (0 = sin)")
+    parser.add_argument("--schedule-interval", type=float, default=10.0, help="media entre lecturas de /schedule")
+    parser.add_argument("--timeout", type=float, default=35.0, help="timeout por petición (s)")
+    parser.add_argument("--sim-latency", type=float, default=0.03, help="latencia del simulador (s)")
+    parser.add_argument("--sim-jitter", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="archivo JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    # Una línea por petición distorsiona la medición
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    recorder = Recorder()
+
+    print(f"🏁 Benchmark: {args.pollers} pollers, {args.duration}s, "
+          f"{'API ' + args.url if args.url else 'API en proceso con simulador'}")
+    if args.url:
+        duration = asyncio.run(run_load(args.url, args, recorder))
+    else:
+        duration = asyncio.run(run_in_process(args, recorder))
+
+    report = recorder.report(duration)
+    result = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "config": vars(args),
+        "results": report,
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\n💾 Resultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), result)
+        if regressions:
+            print(f"\n❌ Regresiones de p95 > {REGRESSION_THRESHOLD}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
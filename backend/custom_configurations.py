@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Almacenamiento de configuraciones personalizadas del cargador
+
+Las configuraciones se guardan en SQLite (modo WAL), una fila por
+configuración, con índices por nombre, tipo de batería y capacidad. Cada
+guardado o borrado toca solo su registro; los listados se paginan por
+cursor y las búsquedas se resuelven en el servidor.
+
+Para sincronizar entre sitios cada registro lleva un hash de su contenido y
+un número de revisión creciente; los borrados dejan una marca con su
+revisión. `changes(since)` devuelve solo lo modificado después de una
+revisión y `import_records()` no reescribe registros idénticos.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+logger = logging.getLogger("custom_configurations")
+
+DEFAULT_DB_FILE = "configuraciones.db"
+# Archivo JSON de versiones anteriores; se migra una sola vez
+LEGACY_CONFIG_FILE = "configuraciones.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configurations (
+    name TEXT PRIMARY KEY,
+    name_lower TEXT NOT NULL,
+    is_lithium INTEGER,
+    battery_capacity REAL,
+    data TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_configurations_name_lower
+    ON configurations (name_lower, name);
+CREATE INDEX IF NOT EXISTS idx_configurations_lithium_capacity
+    ON configurations (is_lithium, battery_capacity);
+CREATE INDEX IF NOT EXISTS idx_configurations_capacity
+    ON configurations (battery_capacity);
+CREATE TABLE IF NOT EXISTS deleted_configurations (
+    name TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    deleted_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_revision (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO sync_revision (id, value) VALUES (1, 0);
+"""
+
+# Campos de metadatos que no forman parte del hash de contenido
+METADATA_FIELDS = ("createdAt", "updatedAt")
+
+# Filas por consulta al recorrer cambios
+CHANGES_BATCH = 200
+
+
+def content_hash(config):
+    """Hash del contenido (sin fechas): iguales en dos sitios dan el mismo hash"""
+    content = {k: v for k, v in config.items() if k not in METADATA_FIELDS}
+    body = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(body.encode(), digest_size=12).hexdigest()
+
+
+class ConfigurationNotFound(KeyError):
+    """La configuración solicitada no existe"""
+
+
+class InvalidCursor(ValueError):
+    """El cursor de paginación no es válido"""
+
+
+def encode_cursor(name_lower, name):
+    raw = json.dumps([name_lower, name], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        name_lower, name = json.loads(base64.urlsafe_b64decode(padded))
+        return str(name_lower), str(name)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor) from None
+
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class CustomConfigurationManager:
+    """Repositorio de configuraciones con nombre sobre SQLite"""
+
+    def __init__(self, path=DEFAULT_DB_FILE, legacy_path=LEGACY_CONFIG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._migrate_sync_columns()
+        if legacy_path:
+            self._migrate_legacy(legacy_path)
+
+    def _migrate_legacy(self, legacy_path):
+        if not os.path.exists(legacy_path) or self.count() > 0:
+            return
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                configurations = json.load(f)
+        except ValueError:
+            logger.warning("No se pudo leer %s para migrarlo", legacy_path)
+            return
+        imported, _ = self.import_configurations(configurations, overwrite=True)
+        logger.info("Migradas %d configuraciones desde %s", len(imported), legacy_path)
+
+    def _migrate_sync_columns(self):
+        """Bases anteriores: añade hash y revisión y numera los registros existentes"""
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(configurations)")}
+        if "content_hash" not in columns:
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._db.execute("ALTER TABLE configurations ADD COLUMN content_hash TEXT")
+                    self._db.execute(
+                        "ALTER TABLE configurations ADD COLUMN revision INTEGER NOT NULL DEFAULT 0"
+                    )
+                    rows = self._db.execute(
+                        "SELECT name, data FROM configurations ORDER BY updated_at, name"
+                    ).fetchall()
+                    for row in rows:
+                        self._db.execute(
+                            "UPDATE configurations SET content_hash = ?, revision = ? WHERE name = ?",
+                            (content_hash(json.loads(row["data"])), self._next_revision(), row["name"]),
+                        )
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_configurations_revision ON configurations (revision)"
+        )
+
+    def close(self):
+        self._db.close()
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _filters(search=None, prefix=None, is_lithium=None, min_capacity=None, max_capacity=None):
+        clauses, params = [], []
+        if search:
+            clauses.append("name_lower LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(search.lower())}%")
+        if prefix:
+            # Rango sobre el índice: [prefijo, prefijo + U+10FFFF)
+            clauses.append("name_lower >= ? AND name_lower < ?")
+            params.extend([prefix.lower(), prefix.lower() + "\U0010ffff"])
+        if is_lithium is not None:
+            clauses.append("is_lithium = ?")
+            params.append(int(is_lithium))
+        if min_capacity is not None:
+            clauses.append("battery_capacity >= ?")
+            params.append(min_capacity)
+        if max_capacity is not None:
+            clauses.append("battery_capacity <= ?")
+            params.append(max_capacity)
+        return clauses, params
+
+    def page(self, limit=None, cursor=None, **filters):
+        """
+        Devuelve (configuraciones, total, siguiente_cursor) ordenadas por nombre.
+
+        Sin `limit` devuelve todas las que cumplen los filtros.
+        """
+        clauses, params = self._filters(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        total = self._db.execute(
+            f"SELECT COUNT(*) FROM configurations {where}", params
+        ).fetchone()[0]
+
+        page_clauses, page_params = list(clauses), list(params)
+        if cursor:
+            page_clauses.append("(name_lower, name) > (?, ?)")
+            page_params.extend(decode_cursor(cursor))
+        page_where = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ""
+        sql = f"SELECT name, name_lower, data FROM configurations {page_where} ORDER BY name_lower, name"
+        if limit is not None:
+            sql += " LIMIT ?"
+            page_params.append(limit + 1)
+        rows = self._db.execute(sql, page_params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["name_lower"], rows[-1]["name"])
+        configurations = {row["name"]: json.loads(row["data"]) for row in rows}
+        return configurations, total, next_cursor
+
+    def list(self, search=None):
+        configurations, _, _ = self.page(search=search)
+        return configurations
+
+    def get(self, name):
+        row = self._db.execute(
+            "SELECT data FROM configurations WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise ConfigurationNotFound(name)
+        return json.loads(row["data"])
+
+    def count(self):
+        return self._db.execute("SELECT COUNT(*) FROM configurations").fetchone()[0]
+
+    def revision(self):
+        """Última revisión asignada; sirve como cursor `since` de la próxima sincronización"""
+        return self._db.execute("SELECT value FROM sync_revision WHERE id = 1").fetchone()[0]
+
+    def changes(self, since=None, until=None):
+        """
+        Genera los registros con revisión en (since, until], en orden de
+        revisión, consultando por lotes. Con `since` incluye también los
+        borrados; cada elemento es un dict con "type" ("configuration" o
+        "deleted"), "name" y "revision".
+        """
+        until = self.revision() if until is None else until
+        last = since or 0
+        while True:
+            rows = self._db.execute(
+                "SELECT name, data, content_hash, revision FROM configurations"
+                " WHERE revision > ? AND revision <= ? ORDER BY revision LIMIT ?",
+                (last, until, CHANGES_BATCH),
+            ).fetchall()
+            for row in rows:
+                yield {
+                    "type": "configuration",
+                    "name": row["name"],
+                    "revision": row["revision"],
+                    "hash": row["content_hash"],
+                    "configuration": json.loads(row["data"]),
+                }
+            if len(rows) < CHANGES_BATCH:
+                break
+            last = rows[-1]["revision"]
+        if since is None:
+            return
+        for row in self._db.execute(
+            "SELECT name, revision, deleted_at FROM deleted_configurations"
+            " WHERE revision > ? AND revision <= ? ORDER BY revision",
+            (since, until),
+        ).fetchall():
+            yield {"type": "deleted", "name": row["name"], "revision": row["revision"],
+                   "deleted_at": row["deleted_at"]}
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def _next_revision(self):
+        # Llamar dentro de self._lock (sin RETURNING: SQLite < 3.35 en las placas)
+        self._db.execute("UPDATE sync_revision SET value = value + 1 WHERE id = 1")
+        return self._db.execute("SELECT value FROM sync_revision WHERE id = 1").fetchone()[0]
+
+    def _tombstone(self, names):
+        now = datetime.now().isoformat()
+        for name in names:
+            self._db.execute(
+                "INSERT OR REPLACE INTO deleted_configurations (name, revision, deleted_at) VALUES (?, ?, ?)",
+                (name, self._next_revision(), now),
+            )
+
+    def _upsert(self, name, config, keep_created=True):
+        now = datetime.now().isoformat()
+        created_at = config.get("createdAt") or now
+        record = {**config, "createdAt": created_at, "updatedAt": config.get("updatedAt") or now}
+        if keep_created:
+            row = self._db.execute(
+                "SELECT created_at FROM configurations WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None and not config.get("createdAt"):
+                record["createdAt"] = row["created_at"]
+        self._db.execute(
+            """
+            INSERT INTO configurations
+                (name, name_lower, is_lithium, battery_capacity, data, created_at, updated_at,
+                 content_hash, revision)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                is_lithium = excluded.is_lithium,
+                battery_capacity = excluded.battery_capacity,
+                data = excluded.data,
+                created_at = excluded.created_at,
+                updated_at = excluded.updated_at,
+                content_hash = excluded.content_hash,
+                revision = excluded.revision
+            """,
+            (
+                name,
+                name.lower(),
+                None if record.get("isLithium") is None else int(bool(record["isLithium"])),
+                record.get("batteryCapacity"),
+                json.dumps(record, ensure_ascii=False),
+                record["createdAt"],
+                record["updatedAt"],
+                content_hash(record),
+                self._next_revision(),
+            ),
+        )
+        self._db.execute("DELETE FROM deleted_configurations WHERE name = ?", (name,))
+        return record["updatedAt"]
+
+    def save(self, name, config):
+        """Crea o reemplaza una configuración; devuelve la fecha de guardado"""
+        config = {**config, "updatedAt": None}
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                saved_at = self._upsert(name, config)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return saved_at
+
+    def delete(self, name):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._db.execute("DELETE FROM configurations WHERE name = ?", (name,))
+                if cursor.rowcount:
+                    self._tombstone([name])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if cursor.rowcount == 0:
+            raise ConfigurationNotFound(name)
+
+    def import_configurations(self, configurations, overwrite=False):
+        """Importa un dict {nombre: config} en una transacción; devuelve (importadas, omitidas)"""
+        imported, skipped = [], []
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for name, config in configurations.items():
+                    exists = self._db.execute(
+                        "SELECT 1 FROM configurations WHERE name = ?", (name,)
+                    ).fetchone()
+                    if exists and not overwrite:
+                        skipped.append(name)
+                        continue
+                    self._upsert(name, config, keep_created=False)
+                    imported.append(name)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return imported, skipped
+
+    def import_records(self, records, overwrite=False):
+        """
+        Importa [(nombre, config)] en una transacción sin reescribir los
+        registros cuyo contenido ya es idéntico. `None` como config es un
+        borrado (solo con `overwrite`). Devuelve {"imported", "unchanged",
+        "skipped", "deleted"} con listas de nombres.
+        """
+        result = {"imported": [], "unchanged": [], "skipped": [], "deleted": []}
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for name, config in records:
+                    row = self._db.execute(
+                        "SELECT content_hash FROM configurations WHERE name = ?", (name,)
+                    ).fetchone()
+                    if config is None:
+                        if row is not None and overwrite:
+                            self._db.execute("DELETE FROM configurations WHERE name = ?", (name,))
+                            self._tombstone([name])
+                            result["deleted"].append(name)
+                        else:
+                            result["skipped" if row is not None else "unchanged"].append(name)
+                    elif row is not None and row["content_hash"] == content_hash(config):
+                        result["unchanged"].append(name)
+                    elif row is not None and not overwrite:
+                        result["skipped"].append(name)
+                    else:
+                        self._upsert(name, config, keep_created=False)
+                        result["imported"].append(name)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return result
+
+    def delete_many(self, names=None, keywords=None):
+        """
+        Elimina en una transacción las configuraciones indicadas por nombre o
+        cuyo nombre contenga alguna de las palabras clave; devuelve las borradas.
+        """
+        clauses, params = [], []
+        if names:
+            clauses.append(f"name IN ({', '.join('?' * len(names))})")
+            params.extend(names)
+        for keyword in keywords or []:
+            clauses.append("name_lower LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(keyword.lower())}%")
+        if not clauses:
+            return []
+        where = " OR ".join(clauses)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = [row[0] for row in self._db.execute(
+                    f"SELECT name FROM configurations WHERE {where} ORDER BY name_lower, name", params
+                )]
+                self._db.execute(f"DELETE FROM configurations WHERE {where}", params)
+                self._tombstone(deleted)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return deleted
+
+    # ------------------------------------------------------------------
+    # Información
+    # ------------------------------------------------------------------
+
+    def info(self):
+        file_info = {"exists": os.path.exists(self.path), "path": self.path}
+        if file_info["exists"]:
+            stat = os.stat(self.path)
+            file_info.update({
+                "size_bytes": stat.st_size,
+                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                "created": datetime.fromtimestamp(stat.st_ctime).isoformat(),
+            })
+        total, lithium = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(is_lithium), 0) FROM configurations"
+        ).fetchone()
+        names = [row[0] for row in self._db.execute(
+            "SELECT name FROM configurations ORDER BY name_lower, name"
+        )]
+        return {
+            "file_info": file_info,
+            "statistics": {
+                "total_configurations": total,
+                "configuration_names": names,
+                "lithium_configs": lithium,
+                "gel_configs": total - lithium,
+            },
+            "system_status": "operational",
+        }
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Muestreo compartido del estado del ESP32
+
+Una tarea de fondo lee el ESP32 y publica una instantánea compartida. Las
+lecturas de fondo son rápidas (solo los campos que cambian segundo a
+segundo); una lectura completa se pide con `full=True`. Todos los lectores de `/data/` reciben esa instantánea mientras
+no supere el presupuesto de antigüedad; si hace falta una lectura nueva,
+los lectores concurrentes comparten la misma lectura en vuelo.
+
+El ritmo lo decide el `scheduler` (ver esp32_controller.SamplingScheduler):
+`stream_interval` mientras haya suscriptores de streaming, `interval` de día
+y un intervalo más largo de noche o sin sensor de panel. Cada nueva
+instantánea despierta a los suscriptores. Mientras el muestreo está en
+reposo, la antigüedad aceptada por defecto se alarga al mismo intervalo, así
+que el sondeo de los clientes no anula el ahorro del puerto serie.
+
+Si el ESP32 no responde, la última instantánea se marca obsoleta
+(`stale: true`, `connected: false`) y los lectores que lo aceptan la reciben
+en lugar de un 503. Lo mismo ocurre con la instantánea persistida que se
+restaura al arrancar, hasta la primera lectura real.
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import math
+import time
+from datetime import datetime
+
+from esp32_controller import ESP32Error, SamplingScheduler
+from response_cache import EncodedBody
+
+logger = logging.getLogger("data_sampler")
+
+# Campos que añade el backend; no forman parte del ETag, que por eso es
+# débil (W/): dos respuestas con el mismo ETag pueden diferir en last_update
+META_FIELDS = ("connected", "stale", "last_update")
+
+
+class DataSampler:
+    """Instantánea compartida de `/data/` con lecturas coalescidas"""
+
+    def __init__(self, read_func, interval=2.0, max_age=3.0, stream_interval=0.5, scheduler=None):
+        # read_func(full) devuelve el estado; full=False permite la trama rápida
+        self.read_func = read_func
+        self.interval = interval
+        self.max_age = max_age
+        self.stream_interval = stream_interval
+        self.scheduler = scheduler or SamplingScheduler(interval, stream_interval, interval)
+        self.delay = interval
+
+        self.snapshot = None
+        self.etag = None
+        self.updated_at = 0.0
+        self.version = 0
+        self.subscribers = 0
+        self._updated = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._encoded = None
+
+        self.reads = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self._failed_at = -math.inf
+        self._inflight = {}
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="data-sampler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except ESP32Error as e:
+                logger.debug("Muestreo fallido: %s", e)
+                self.mark_stale()
+            except Exception as e:
+                logger.warning("Error inesperado en el muestreo: %s", e)
+            self.delay = self.scheduler.next_delay(self.snapshot, self.subscribers)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def subscribe(self):
+        """Registra un cliente de streaming; si el muestreo estaba en reposo, despierta"""
+        self.subscribers += 1
+        if self.delay > self.stream_interval:
+            self._wake.set()
+
+    def unsubscribe(self):
+        self.subscribers -= 1
+
+    @property
+    def age(self):
+        if self.snapshot is None:
+            return None
+        return time.monotonic() - self.updated_at
+
+    @property
+    def stale(self):
+        return bool(self.snapshot and self.snapshot["stale"])
+
+    def etag_for(self, data):
+        """ETag de la respuesta; una copia obsoleta no valida la caché de una fresca"""
+        if self.etag is None or not data.get("stale"):
+            return self.etag
+        return self.etag[:-1] + '-stale"'
+
+    @property
+    def default_max_age(self):
+        """Antigüedad aceptada sin `max_age`: nunca menor que el intervalo actual"""
+        return max(self.max_age, self.delay)
+
+    def encoded(self):
+        """Instantánea actual en bytes JSON; se codifica una vez por versión"""
+        if self._encoded is None or self._encoded[0] != self.version:
+            self._encoded = (self.version, EncodedBody(self.snapshot, self.etag_for(self.snapshot)))
+        return self._encoded[1]
+
+    async def refresh(self, full=False):
+        """
+        Lee el ESP32; si ya hay una lectura en vuelo del mismo tipo, espera
+        esa misma (una completa no se conforma con una rápida en vuelo)
+        """
+        if full not in self._inflight:
+            inflight = self._inflight[full] = asyncio.ensure_future(self._read(full))
+            inflight.add_done_callback(functools.partial(self._clear_inflight, full))
+        return await asyncio.shield(self._inflight[full])
+
+    def _clear_inflight(self, full, future):
+        del self._inflight[full]
+        if not future.cancelled() and future.exception() is not None:
+            self._failed_at = time.monotonic()
+
+    async def _read(self, full):
+        data = await self.read_func(full)
+        self.reads += 1
+        self._publish(data)
+        return self.snapshot
+
+    async def get(self, max_age=None, allow_stale=False, full=False):
+        """
+        Devuelve la instantánea si es suficientemente reciente o lee una nueva.
+        Con `allow_stale`, si la lectura falla se devuelve la última conocida
+        marcada como obsoleta (si la hay) en lugar de propagar el error.
+        `full` fuerza una lectura completa (campos lentos incluidos).
+        """
+        max_age = self.default_max_age if max_age is None else max_age
+        age = self.age
+        if not full and age is not None and age <= max_age and not self.stale:
+            self.hits += 1
+            return self.snapshot
+        # Tras un fallo reciente no se reintenta por cada petición: el
+        # muestreador de fondo ya reintenta a su ritmo
+        if allow_stale and self.stale and time.monotonic() - self._failed_at < self.interval:
+            self.stale_hits += 1
+            return self.snapshot
+        try:
+            return await self.refresh(full)
+        except ESP32Error:
+            if not allow_stale or self.snapshot is None:
+                raise
+            self.mark_stale()
+            self.stale_hits += 1
+            return self.snapshot
+
+    def mark_stale(self):
+        """Marca la instantánea actual como obsoleta (ESP32 sin responder)"""
+        if self.snapshot is None or self.snapshot["stale"]:
+            return
+        self._set_snapshot({**self.snapshot, "connected": False, "stale": True})
+
+    def restore(self, snapshot):
+        """
+        Carga una instantánea persistida por una ejecución anterior. Se sirve
+        como obsoleta y nunca cuenta como reciente para `max_age`.
+        """
+        if self.snapshot is not None:
+            return
+        device_fields = {k: v for k, v in snapshot.items() if k not in META_FIELDS}
+        self.etag = self._etag(device_fields)
+        self.updated_at = -math.inf
+        self._set_snapshot({**device_fields, "connected": False, "stale": True,
+                            "last_update": snapshot.get("last_update")})
+
+    async def wait_for_update(self, version, timeout=None):
+        """Espera una instantánea más nueva que `version`; False si vence el timeout"""
+        while self.version <= version:
+            try:
+                await asyncio.wait_for(self._updated.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def update_fields(self, fields):
+        """Refleja en la instantánea valores escritos con éxito en el ESP32"""
+        if self.snapshot is None:
+            return
+        self._publish({**self.snapshot, **fields}, keep_timestamp=True)
+
+    @staticmethod
+    def _etag(device_fields):
+        body = json.dumps(device_fields, sort_keys=True, separators=(",", ":")).encode()
+        return 'W/"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+
+    def _publish(self, data, keep_timestamp=False):
+        device_fields = {k: v for k, v in data.items() if k not in META_FIELDS}
+        self.etag = self._etag(device_fields)
+        if keep_timestamp and self.snapshot is not None:
+            last_update = self.snapshot["last_update"]
+        else:
+            last_update = datetime.now().isoformat()
+            self.updated_at = time.monotonic()
+        self._set_snapshot({**device_fields, "connected": True, "stale": False, "last_update": last_update})
+
+    def _set_snapshot(self, snapshot):
+        self.snapshot = snapshot
+        self.version += 1
+        # Despierta a los suscriptores actuales y prepara el evento siguiente
+        self._updated.set()
+        self._updated = asyncio.Event()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Cargadores gestionados por el proceso
+
+Cada `Device` agrupa lo que antes era global en main.py para un único ESP32:
+su controlador serie (con sus propias tareas de E/S), su muestreador
+compartido y su historial. Un mismo backend puede atender varios cargadores
+configurándolos en ESP32_DEVICES:
+
+    ESP32_DEVICES="norte=/dev/ttyUSB0,sur=/dev/ttyUSB1"
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from data_sampler import DataSampler
+from esp32_controller import ESP32NotConnected, SamplingScheduler
+from history_store import HistoryStore
+from state_cache import StateCache, changed_parameters, parameter_checksums
+
+logger = logging.getLogger("devices")
+
+DEFAULT_DEVICE_ID = "default"
+
+# Campos de /data/ que resume el endpoint de flota
+SUMMARY_FIELDS = (
+    "chargeState",
+    "estimatedSOC",
+    "voltageBatterySensor2",
+    "panelToBatteryCurrent",
+    "batteryToLoadCurrent",
+    "netCurrent",
+    "temperature",
+    "last_update",
+)
+
+
+def parse_devices(spec, default_port):
+    """
+    Interpreta "id=puerto,id=puerto" y devuelve {id: puerto} en ese orden.
+    Sin especificación hay un único dispositivo DEFAULT_DEVICE_ID.
+    """
+    if not spec or not spec.strip():
+        return {DEFAULT_DEVICE_ID: default_port}
+    devices = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        device_id, separator, port = item.partition("=")
+        device_id, port = device_id.strip(), port.strip()
+        if not separator or not device_id or not port:
+            raise ValueError(f"Dispositivo inválido en ESP32_DEVICES: '{item}' (usa id=puerto)")
+        if device_id in devices:
+            raise ValueError(f"Dispositivo duplicado en ESP32_DEVICES: '{device_id}'")
+        devices[device_id] = port
+    return devices
+
+
+class Device:
+    """Un cargador: controlador serie, muestreador e historial propios"""
+
+    def __init__(self, device_id, port, sample_interval=2.0, max_age=3.0,
+                 stream_interval=0.5, history_dir=None, history_retention=None,
+                 state_path=None, state_save_interval=60.0, idle_interval=10.0):
+        self.id = device_id
+        self.port = port
+        self.controller = None
+        self.sampler = DataSampler(
+            self.read_data, sample_interval, max_age, stream_interval,
+            SamplingScheduler(sample_interval, stream_interval, idle_interval),
+        )
+        self.history_dir = history_dir
+        self.history_retention = history_retention
+        self._history = None
+        self.history_task = None
+        self.warmup_task = None
+        # Último estado conocido en disco (arranque en caliente)
+        self.state_cache = StateCache(state_path) if state_path else None
+        self.state_save_interval = state_save_interval
+        self.state_task = None
+        self._saved_checksums = None
+        self._saved_at = 0.0
+        # Resultado de comparar el estado persistido con la primera lectura
+        self.resync = None
+
+    @property
+    def history(self):
+        """Historial; se abre en el primer uso (None si está deshabilitado)"""
+        if self._history is None and self.history_dir:
+            self._history = HistoryStore(self.history_dir, self.history_retention)
+        return self._history
+
+    @property
+    def connected(self):
+        return bool(self.controller and self.controller.connected)
+
+    async def read_data(self, full=False):
+        """Lectura directa del ESP32; la usa el muestreador compartido"""
+        if self.controller is None:
+            raise ESP32NotConnected("Controlador no inicializado")
+        if full:
+            return await self.controller.get_data()
+        return await self.controller.get_fast_data()
+
+    async def start(self):
+        """No espera al ESP32: la conexión y la primera lectura siguen en segundo plano"""
+        if self.state_cache is not None:
+            self._restore_state()
+            self.state_task = asyncio.create_task(self._state_loop(), name=f"state-{self.id}")
+        await self.controller.start()
+        await self.sampler.start()
+        self.warmup_task = asyncio.create_task(self._warmup(), name=f"warmup-{self.id}")
+        if self.history_dir:
+            self.history_task = asyncio.create_task(self._history_loop(), name=f"history-{self.id}")
+
+    async def stop(self):
+        for task in (self.warmup_task, self.history_task, self.state_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.warmup_task = self.history_task = self.state_task = None
+        if self.state_cache is not None and self.sampler.snapshot and not self.sampler.stale:
+            self._save_state()
+        if self._history is not None:
+            self._history.close()
+            self._history = None
+        await self.sampler.stop()
+        if self.controller is not None:
+            await self.controller.stop()
+
+    async def _warmup(self):
+        """
+        Primera lectura en cuanto conecta el ESP32 (negocia también el
+        formato de trama), sin esperar al siguiente ciclo del muestreador
+        """
+        await self.controller.wait_connected()
+        try:
+            await self.sampler.refresh()
+        except Exception as e:
+            logger.debug("Primera lectura de %s fallida: %s", self.id, e)
+
+    async def _history_loop(self):
+        """Guarda en el historial cada instantánea nueva del muestreador"""
+        version = self.sampler.version
+        while True:
+            await self.sampler.wait_for_update(version)
+            version = self.sampler.version
+            if self.sampler.stale:
+                continue
+            try:
+                # Crear un segmento escribe varios MB en la SD: fuera del event loop
+                await asyncio.to_thread(self.history.append, self.sampler.snapshot)
+            except Exception as e:
+                logger.warning("Error guardando historial de %s: %s", self.id, e)
+
+    def _restore_state(self):
+        saved = self.state_cache.load()
+        if saved is None:
+            return
+        self.sampler.restore(saved["snapshot"])
+        # Los campos que la trama binaria no transporta ya se conocen: la
+        # primera lectura puede ser directamente una trama
+        self.controller.restore_text_fields(saved["snapshot"])
+        # Con la suma de configuración del firmware, la primera lectura solo
+        # es completa si la configuración cambió mientras no estábamos
+        if saved.get("config_checksum") is not None:
+            self.controller.restore_baseline(saved["snapshot"], saved["config_checksum"])
+        self._saved_checksums = saved.get("checksums") or {}
+        logger.info("Estado de %s restaurado (guardado %s); obsoleto hasta la primera lectura",
+                    self.id, saved.get("saved_at"))
+
+    def _save_state(self):
+        snapshot = self.sampler.snapshot
+        checksums = parameter_checksums(snapshot)
+        self.state_cache.save(snapshot, checksums, datetime.now().isoformat(),
+                              self.controller.config_checksum if self.controller else None)
+        self._saved_checksums = checksums
+        self._saved_at = time.monotonic()
+
+    async def _state_loop(self):
+        """
+        Persiste el estado: enseguida si cambió algún parámetro configurable
+        y, si no, como mucho cada `state_save_interval` segundos
+        """
+        version = self.sampler.version
+        while True:
+            await self.sampler.wait_for_update(version)
+            version = self.sampler.version
+            if self.sampler.stale:
+                continue
+            checksums = parameter_checksums(self.sampler.snapshot)
+            if self.resync is None and self._saved_checksums is not None:
+                changed = changed_parameters(self._saved_checksums, checksums)
+                self.resync = {
+                    "changed_parameters": changed,
+                    # False si la suma del firmware coincidió y bastó la trama rápida
+                    "full_read": self.controller.full_reads > 0,
+                    "checked_at": datetime.now().isoformat(),
+                }
+                if changed:
+                    logger.info("Parámetros de %s cambiados desde el último arranque: %s",
+                                self.id, ", ".join(changed))
+            if (checksums != self._saved_checksums
+                    or time.monotonic() - self._saved_at >= self.state_save_interval):
+                try:
+                    await asyncio.to_thread(self._save_state)
+                except OSError as e:
+                    logger.warning("No se pudo guardar el estado de %s: %s", self.id, e)
+
+    def describe(self):
+        return {
+            "device_id": self.id,
+            "port": self.port,
+            "connected": self.connected,
+            "frame_version": self.controller.frame_version if self.controller else None,
+            "history": bool(self.history_dir),
+            "stale": self.sampler.stale,
+            "sampling_interval": self.sampler.delay,
+            "resync": self.resync,
+        }
+
+    async def summary(self, max_age=None):
+        """Resumen para la flota; nunca lanza, informa el error en el resultado"""
+        result = {"device_id": self.id, "connected": self.connected}
+        try:
+            data = await self.sampler.get(max_age, allow_stale=True)
+        except Exception as e:
+            result["error"] = str(e) or type(e).__name__
+            return result
+        result.update({field: data.get(field) for field in SUMMARY_FIELDS})
+        return result
@@ -0,0 +1,871 @@
+#!/usr/bin/env python3
+"""
+Controlador de comunicación serie con el ESP32 del cargador solar
+
+Una única tarea asyncio es dueña del UART: los llamadores encolan comandos
+y reciben la respuesta a través de un future. Varios comandos pueden estar
+en vuelo al mismo tiempo (pipelining) y el event loop nunca se bloquea
+esperando al puerto serie.
+
+Protocolo de texto (una línea por mensaje, terminada en '\\n'):
+    CMD:GET_DATA                 -> DATA:{...json...}
+    CMD:SET_<param>:<valor>      -> OK:<param> updated to <valor> | ERROR:<motivo>
+    CMD:SET_MULTI:{...json...}   -> MULTI:{"<param>": "OK:...", ...} | ERROR:<motivo>
+    CMD:GET_FRAME:<versión>      -> FRAME:<base64> | ERROR:<motivo>
+Cualquier otra línea que envíe el ESP32 (logs, trazas) se ignora.
+
+`SamplingScheduler` decide el ritmo del muestreo de fondo: rápido con el
+panel produciendo, más lento de noche o sin sensor de panel.
+
+`RecordingTransport` graba cada línea enviada y recibida con su instante en
+un registro binario compacto; `ReplayTransport` reproduce esa grabación a
+la velocidad original o acelerada, sin cargador conectado.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import struct
+import time
+
+from telemetry_frame import (
+    FAST_FRAME_VERSION, FRAME_VERSION, LAYOUTS, FrameError, UnsupportedFrameVersion, decode_line,
+)
+
+try:
+    import serial
+except ImportError:  # pyserial es opcional para poder usar transportes simulados
+    serial = None
+
+logger = logging.getLogger("esp32_controller")
+
+DEFAULT_PORT = "/dev/ttyUSB0"
+DEFAULT_BAUDRATE = 115200
+
+# ESP32_PORT=auto: se busca el primer puente USB-UART conocido al conectar
+AUTO_PORT = "auto"
+# CP210x, CH340, FTDI y USB nativo de Espressif
+ESP32_USB_VIDS = (0x10C4, 0x1A86, 0x0403, 0x303A)
+
+# Primer reintento de conexión; se duplica hasta `reconnect_delay`
+INITIAL_RECONNECT_DELAY = 0.25
+
+# Prefijos que identifican una línea como respuesta a un comando
+REPLY_PREFIXES = ("DATA:", "OK:", "ERROR:", "MULTI:", "FRAME:")
+
+# Parámetros configurables del firmware y su tipo
+CONFIGURABLE_PARAMETERS = {
+    "batteryCapacity": float,
+    "isLithium": bool,
+    "thresholdPercentage": float,
+    "maxAllowedCurrent": float,
+    "bulkVoltage": float,
+    "absorptionVoltage": float,
+    "floatVoltage": float,
+    "useFuenteDC": bool,
+    "fuenteDC_Amps": float,
+    "factorDivider": int,
+}
+
+
+class ESP32Error(Exception):
+    """Error de comunicación con el ESP32"""
+
+
+class ESP32NotConnected(ESP32Error):
+    """El puerto serie no está abierto"""
+
+
+class ESP32Timeout(ESP32Error):
+    """El ESP32 no respondió a tiempo"""
+
+
+class Transport:
+    """Interfaz mínima de transporte: líneas de bytes de entrada y salida"""
+
+    async def open(self):
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def write(self, data: bytes):
+        raise NotImplementedError
+
+    async def readline(self) -> bytes:
+        """Devuelve una línea completa, o b'' si no llegó nada a tiempo"""
+        raise NotImplementedError
+
+
+class SerialTransport(Transport):
+    """Transporte sobre pyserial; las llamadas bloqueantes van a un hilo"""
+
+    def __init__(self, port=DEFAULT_PORT, baudrate=DEFAULT_BAUDRATE, read_timeout=0.2):
+        self.port = port
+        self.baudrate = baudrate
+        self.read_timeout = read_timeout
+        self._serial = None
+
+    async def open(self):
+        if serial is None:
+            raise ESP32Error("pyserial no está instalado")
+        port = self.port
+        if port == AUTO_PORT:
+            port = await asyncio.to_thread(find_esp32_port)
+            if port is None:
+                raise ESP32NotConnected("No se encontró ningún puerto USB-UART")
+        self._serial = await asyncio.to_thread(
+            serial.Serial, port, self.baudrate, timeout=self.read_timeout
+        )
+
+    async def close(self):
+        if self._serial is not None:
+            await asyncio.to_thread(self._serial.close)
+            self._serial = None
+
+    async def write(self, data: bytes):
+        if self._serial is None:
+            raise ESP32NotConnected("Puerto serie cerrado")
+        await asyncio.to_thread(self._serial.write, data)
+
+    async def readline(self) -> bytes:
+        if self._serial is None:
+            raise ESP32NotConnected("Puerto serie cerrado")
+        return await asyncio.to_thread(self._serial.readline)
+
+
+# Registro binario de tráfico serie: cabecera RECORD_MAGIC y, por cada
+# línea, RECORD_HEADER = (tipo, µs desde el registro anterior, longitud)
+# seguido de la línea sin '\n'. OPEN/CLOSE marcan cada conexión.
+RECORD_MAGIC = b"ESP32REC\x01"
+RECORD_HEADER = struct.Struct("<BIH")
+RECORD_TX, RECORD_RX, RECORD_OPEN, RECORD_CLOSE = range(4)
+
+
+def read_recording(path):
+    """Sesiones grabadas: una lista de (segundos, tipo, línea) por conexión"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(RECORD_MAGIC):
+        raise ESP32Error(f"{path} no es una grabación serie")
+    sessions, records = [], None
+    offset, elapsed = len(RECORD_MAGIC), 0
+    while offset + RECORD_HEADER.size <= len(data):
+        kind, delta, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        line = data[offset:offset + length]
+        offset += length
+        elapsed += delta
+        if kind == RECORD_OPEN:
+            records = []
+            sessions.append(records)
+        elif records is not None and kind in (RECORD_TX, RECORD_RX):
+            records.append((elapsed / 1e6, kind, line))
+    return sessions
+
+
+class RecordingTransport(Transport):
+    """
+    Envuelve otro transporte y graba todo el tráfico en `path`.
+
+    Pensado para dejarlo activo en producción: cada línea son 7 bytes de
+    cabecera más la propia línea, escritos en un búfer en memoria que se
+    vuelca al disco al llenarse y al cerrar. Al superar `max_bytes` el
+    archivo pasa a `<path>.1` y se empieza otro.
+    """
+
+    def __init__(self, inner, path, max_bytes=64 * 1024 * 1024):
+        self.inner = inner
+        self.path = path
+        self.max_bytes = max_bytes
+        self.records = 0
+        self._file = None
+        self._size = 0
+        self._last = None
+
+    async def open(self):
+        await self.inner.open()
+        if self._file is None:
+            self._open_file()
+        self._record(RECORD_OPEN)
+
+    async def close(self):
+        try:
+            await self.inner.close()
+        finally:
+            if self._file is not None:
+                self._record(RECORD_CLOSE)
+                # Cada reconexión vuelve a abrir el archivo (en modo append)
+                self._file.close()
+                self._file = None
+
+    async def write(self, data: bytes):
+        await self.inner.write(data)
+        for line in data.splitlines():
+            self._record(RECORD_TX, line)
+
+    async def readline(self) -> bytes:
+        line = await self.inner.readline()
+        if line:
+            self._record(RECORD_RX, line.rstrip(b"\r\n"))
+        return line
+
+    def _open_file(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=64 * 1024)
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(RECORD_MAGIC)
+            self._size = len(RECORD_MAGIC)
+        self._last = None
+
+    def _record(self, kind, line=b""):
+        now = time.monotonic()
+        # El primer registro de cada archivo no tiene anterior: delta 0
+        delta = 0 if self._last is None else min(int((now - self._last) * 1e6), 0xFFFFFFFF)
+        self._last = now
+        line = line[:0xFFFF]
+        self._file.write(RECORD_HEADER.pack(kind, delta, len(line)))
+        self._file.write(line)
+        self._size += RECORD_HEADER.size + len(line)
+        self.records += 1
+        if self._size >= self.max_bytes and kind != RECORD_CLOSE:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        os.replace(self.path, f"{self.path}.1")
+        self._open_file()
+        # La conexión sigue abierta: el archivo nuevo empieza una sesión
+        self._record(RECORD_OPEN)
+
+
+class ReplayTransport(Transport):
+    """
+    Reproduce una grabación de `RecordingTransport` como si fuera el ESP32.
+
+    Cada respuesta grabada se entrega con el mismo retraso (dividido por
+    `speed`) respecto al último comando enviado antes que ella, medido desde
+    que el controlador escribe ese comando ahora. Así se reproducen las
+    latencias y los timeouts del campo, también con comandos en pipeline.
+    Cada `open()` reproduce la siguiente conexión grabada; los comandos que
+    no coinciden con los grabados se cuentan en `mismatches`.
+    """
+
+    def __init__(self, path, speed=1.0, read_timeout=0.2):
+        self.path = path
+        self.speed = speed
+        self.read_timeout = read_timeout
+        self.sessions = read_recording(path)
+        self.session = -1
+        self.mismatches = 0
+        self._records = []
+        self._position = 0
+        self._anchor = None
+        self._outbox = collections.deque()
+        self._arrived = asyncio.Event()
+
+    async def open(self):
+        if self.session + 1 >= len(self.sessions):
+            raise ESP32NotConnected("Fin de la grabación")
+        self.session += 1
+        self._records = self.sessions[self.session]
+        self._position = 0
+        self._outbox.clear()
+        # Las líneas previas al primer comando (arranque, logs) cuentan desde open
+        self._anchor = (0.0, time.monotonic())
+        self._schedule_replies()
+
+    async def close(self):
+        self._outbox.clear()
+
+    async def write(self, data: bytes):
+        now = time.monotonic()
+        for line in data.splitlines():
+            if self._position < len(self._records) and self._records[self._position][1] == RECORD_TX:
+                recorded_at, _, expected = self._records[self._position]
+                self._position += 1
+                if line != expected:
+                    self.mismatches += 1
+                self._anchor = (recorded_at, now)
+                self._schedule_replies()
+            else:
+                self.mismatches += 1
+
+    def _schedule_replies(self):
+        """Encola las respuestas grabadas hasta el siguiente comando"""
+        recorded_anchor, actual_anchor = self._anchor
+        previous = self._outbox[-1][0] if self._outbox else 0.0
+        while self._position < len(self._records) and self._records[self._position][1] == RECORD_RX:
+            recorded_at, _, line = self._records[self._position]
+            self._position += 1
+            due = max(previous, actual_anchor + (recorded_at - recorded_anchor) / self.speed)
+            self._outbox.append((due, line + b"\n"))
+            previous = due
+        self._arrived.set()
+
+    async def readline(self) -> bytes:
+        deadline = time.monotonic() + self.read_timeout
+        while True:
+            now = time.monotonic()
+            if self._outbox and self._outbox[0][0] <= now:
+                return self._outbox.popleft()[1]
+            if now >= deadline:
+                if not self._outbox and self._position >= len(self._records) \
+                        and self.session + 1 < len(self.sessions):
+                    # Conexión grabada terminada: se reproduce la siguiente
+                    raise ESP32NotConnected("Fin de la conexión grabada")
+                return b""
+            wait = deadline - now
+            if self._outbox:
+                wait = min(wait, self._outbox[0][0] - now)
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+def find_esp32_port():
+    """Primer puerto serie con un puente USB-UART de los que usan los ESP32"""
+    from serial.tools import list_ports
+
+    ports = sorted(list_ports.comports(), key=lambda p: p.device)
+    for port in ports:
+        if port.vid in ESP32_USB_VIDS:
+            return port.device
+    return None
+
+
+def format_value(value):
+    """Convierte un valor Python al formato que espera el firmware"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class _PendingCommand:
+    """Comando escrito en el UART que espera su respuesta"""
+
+    __slots__ = ("command", "future", "deadline", "queued_at", "sent_at")
+
+    def __init__(self, command, future, deadline, queued_at):
+        self.command = command
+        self.future = future
+        self.deadline = deadline
+        self.queued_at = queued_at
+        self.sent_at = time.monotonic()
+
+    @property
+    def name(self):
+        """Nombre corto del comando para estadísticas (sin el valor)"""
+        return self.command[len("CMD:"):].split(":", 1)[0]
+
+    def accepts(self, line):
+        """Indica si la línea recibida es la respuesta a este comando"""
+        if line.startswith("ERROR:"):
+            return True
+        if self.command == "CMD:GET_DATA":
+            return line.startswith("DATA:")
+        if self.command.startswith("CMD:GET_FRAME:"):
+            return line.startswith("FRAME:")
+        if self.command.startswith("CMD:SET_MULTI:"):
+            return line.startswith("MULTI:")
+        if self.command.startswith("CMD:SET_"):
+            param = self.command[len("CMD:SET_"):].split(":", 1)[0]
+            return line.startswith(f"OK:{param} ")
+        return line.startswith(REPLY_PREFIXES)
+
+
+class ESP32Controller:
+    """
+    Motor de E/S serie con un único escritor y pipelining de comandos.
+
+    - `send_command()` encola el comando y espera su respuesta.
+    - La tarea escritora es la única que escribe en el UART y limita el número
+      de comandos en vuelo a `max_in_flight` (tamaño del buffer del ESP32).
+    - La tarea lectora es la única que lee; asocia cada respuesta al comando
+      pendiente más antiguo que la acepte, en orden FIFO.
+    - `get_data()` negocia tramas binarias (CMD:GET_FRAME) tras una primera
+      lectura de texto; si el firmware no las soporta sigue en texto.
+    - `get_fast_data()` lee solo los campos de alta frecuencia y reutiliza
+      el resto de la última lectura completa mientras `configChecksum` no
+      cambie (y como mucho `full_refresh_interval` segundos).
+    """
+
+    def __init__(self, port=DEFAULT_PORT, baudrate=DEFAULT_BAUDRATE, transport=None,
+                 max_in_flight=4, command_timeout=5.0, reconnect_delay=2.0,
+                 binary_frames=True, text_refresh_interval=60.0, fast_frames=True,
+                 full_refresh_interval=600.0, record_path=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.transport = transport or SerialTransport(port, baudrate)
+        # Grabación opcional de todo el tráfico (ver RecordingTransport)
+        if record_path:
+            self.transport = RecordingTransport(self.transport, record_path)
+        self.max_in_flight = max_in_flight
+        self.command_timeout = command_timeout
+        self.reconnect_delay = reconnect_delay
+
+        self.connected = False
+        self.last_error = None
+        # Momento (time.monotonic) de la primera conexión, para medir el arranque
+        self.first_connected_at = None
+        # Se desactiva si el firmware no entiende CMD:SET_MULTI
+        self.supports_multi_set = True
+        # Tramas binarias: preferencia, versión negociada (None = texto) y
+        # cada cuánto releer en texto los campos que no van en la trama
+        self.binary_frames = binary_frames
+        self.frame_version = None
+        self.text_refresh_interval = text_refresh_interval
+        self._frames_supported = None
+        self._text_fields = None
+        self._restored_text_fields = None
+        self._text_read_at = 0.0
+        # Trama rápida: se completa con la última lectura completa (_baseline)
+        # mientras la suma de configuración del firmware no cambie
+        self.fast_frames = fast_frames
+        self.full_refresh_interval = full_refresh_interval
+        self._fast_supported = None
+        self._baseline = None
+        self._baseline_at = 0.0
+        self._config_checksum = None
+        self._restored_baseline = None
+        self.fast_reads = 0
+        self.full_reads = 0
+        # Callbacks observer(nombre, espera_en_cola, ida_y_vuelta, resultado)
+        # con resultado "ok", "error", "timeout" o "disconnected"
+        self.observers = []
+
+        self._queue = None
+        self._pending = collections.deque()
+        self._window = None
+        self._tasks = []
+        self._running = False
+        self._connected_event = None
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """Arranca la tarea supervisora que abre el puerto y lanza E/S"""
+        if self._running:
+            return
+        self._running = True
+        self._queue = asyncio.Queue()
+        self._window = asyncio.Semaphore(self.max_in_flight)
+        self._connected_event = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._supervisor(), name="esp32-supervisor")]
+
+    async def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._fail_pending(ESP32NotConnected("Controlador detenido"))
+        await self._close_transport()
+
+    async def wait_connected(self, timeout=None):
+        await asyncio.wait_for(self._connected_event.wait(), timeout)
+
+    async def _supervisor(self):
+        """Abre el transporte y mantiene vivas las tareas de E/S, reconectando"""
+        # Tras un reinicio el adaptador USB tarda en aparecer: primeros
+        # reintentos rápidos y luego cada `reconnect_delay`
+        delay = min(INITIAL_RECONNECT_DELAY, self.reconnect_delay)
+        while self._running:
+            try:
+                await self.transport.open()
+            except Exception as e:
+                self._set_disconnected(e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_delay)
+                continue
+
+            logger.info("ESP32 conectado en %s", self.port)
+            delay = min(INITIAL_RECONNECT_DELAY, self.reconnect_delay)
+            if self.first_connected_at is None:
+                self.first_connected_at = time.monotonic()
+            # El firmware pudo cambiar: volver a negociar el formato de lectura
+            self._reset_frames()
+            self.connected = True
+            self.last_error = None
+            self._connected_event.set()
+
+            io_tasks = [
+                asyncio.create_task(self._writer_loop(), name="esp32-writer"),
+                asyncio.create_task(self._reader_loop(), name="esp32-reader"),
+            ]
+            try:
+                done, _ = await asyncio.wait(io_tasks, return_when=asyncio.FIRST_EXCEPTION)
+            finally:
+                # También al detener el controlador (supervisor cancelado)
+                for task in io_tasks:
+                    task.cancel()
+                await asyncio.gather(*io_tasks, return_exceptions=True)
+
+            error = next((t.exception() for t in done if not t.cancelled() and t.exception()), None)
+            self._set_disconnected(error or ESP32NotConnected("E/S finalizada"))
+            await self._close_transport()
+            if self._running:
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _set_disconnected(self, error):
+        if self.connected:
+            logger.warning("ESP32 desconectado: %s", error)
+        self.connected = False
+        self.last_error = str(error)
+        if self._connected_event is not None:
+            self._connected_event.clear()
+        self._fail_pending(ESP32NotConnected(f"ESP32 desconectado: {error}"))
+
+    async def _close_transport(self):
+        try:
+            await self.transport.close()
+        except Exception as e:
+            logger.debug("Error cerrando transporte: %s", e)
+
+    def _fail_pending(self, error):
+        while self._pending:
+            pending = self._pending.popleft()
+            if not pending.future.done():
+                pending.future.set_exception(error)
+            if self._window is not None:
+                self._window.release()
+            self._observe(pending, "disconnected")
+
+    # ------------------------------------------------------------------
+    # Tareas de E/S
+    # ------------------------------------------------------------------
+
+    async def _writer_loop(self):
+        while True:
+            command, future, timeout, queued_at = await self._queue.get()
+            if future.done():  # el llamador ya abandonó la espera
+                continue
+            accepted = False
+            try:
+                await self._window.acquire()
+                self._pending.append(
+                    _PendingCommand(command, future, time.monotonic() + timeout, queued_at)
+                )
+                accepted = True
+            finally:
+                # Cancelado (desconexión o stop) esperando ventana: el comando
+                # ya salió de la cola y nadie más resolvería su future
+                if not accepted and not future.done():
+                    future.set_exception(ESP32NotConnected("Escritura interrumpida: ESP32 desconectado"))
+            await self.transport.write((command + "\n").encode())
+
+    async def _reader_loop(self):
+        while True:
+            raw = await self.transport.readline()
+            self._expire_pending()
+            if not raw:
+                continue
+            line = raw.decode(errors="replace").strip()
+            if not line.startswith(REPLY_PREFIXES):
+                logger.debug("ESP32 log: %s", line)
+                continue
+            self._dispatch_reply(line)
+
+    def _dispatch_reply(self, line):
+        for index, pending in enumerate(self._pending):
+            if pending.accepts(line):
+                del self._pending[index]
+                self._window.release()
+                if not pending.future.done():
+                    pending.future.set_result(line)
+                self._observe(pending, "error" if line.startswith("ERROR:") else "ok")
+                return
+        logger.debug("Respuesta sin comando pendiente: %s", line)
+
+    def _expire_pending(self):
+        """Libera los comandos cuya respuesta nunca llegó"""
+        now = time.monotonic()
+        # Los timeouts son por comando: uno vencido puede estar detrás de uno vivo
+        expired = [pending for pending in self._pending if pending.deadline < now]
+        if not expired:
+            return
+        self._pending = collections.deque(pending for pending in self._pending if pending.deadline >= now)
+        for pending in expired:
+            self._window.release()
+            if not pending.future.done():
+                pending.future.set_exception(
+                    ESP32Timeout(f"Sin respuesta del ESP32 para {pending.command}")
+                )
+            self._observe(pending, "timeout")
+
+    def _observe(self, pending, outcome):
+        if not self.observers:
+            return
+        now = time.monotonic()
+        for observer in self.observers:
+            observer(pending.name, pending.sent_at - pending.queued_at, now - pending.sent_at, outcome)
+
+    @property
+    def queue_depth(self):
+        """Comandos esperando turno para escribirse"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def in_flight(self):
+        """Comandos escritos que esperan respuesta"""
+        return len(self._pending)
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    async def send_command(self, command, timeout=None):
+        """Encola un comando y devuelve la línea de respuesta del ESP32"""
+        if not self.connected:
+            raise ESP32NotConnected(self.last_error or "ESP32 no conectado")
+        timeout = timeout or self.command_timeout
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((command, future, timeout, time.monotonic()))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise ESP32Timeout(f"Sin respuesta del ESP32 para {command}") from None
+
+    async def get_data(self):
+        """Lee el estado completo del cargador (trama binaria si se negoció)"""
+        data = None
+        if self._use_frames():
+            try:
+                data = await self._get_frame_data()
+            except FrameError as e:
+                logger.warning("Trama binaria descartada (%s), leyendo en texto", e)
+        if data is None:
+            data = await self._get_text_data()
+        self.full_reads += 1
+        self._baseline = dict(data)
+        self._baseline_at = time.monotonic()
+        return data
+
+    async def get_fast_data(self):
+        """
+        Lectura de alta frecuencia: solo corrientes, voltajes, PWM, etapa y
+        contadores. Los campos lentos (voltajes de carga, LVD/LVR, versión,
+        notas) salen de la última lectura completa, que se repite cuando la
+        suma de configuración cambia, al cumplirse `full_refresh_interval` o
+        si el firmware no soporta la trama rápida.
+        """
+        if not (self.fast_frames and self.binary_frames and self._fast_supported is not False):
+            return await self.get_data()
+        reply = await self.send_command(f"CMD:GET_FRAME:{FAST_FRAME_VERSION}")
+        if reply.startswith("ERROR:"):
+            logger.info("Firmware sin trama rápida (%s), lecturas completas", reply)
+            self._fast_supported = False
+            return await self.get_data()
+        try:
+            fast = decode_line(reply)
+        except FrameError as e:
+            if isinstance(e, UnsupportedFrameVersion):
+                self._fast_supported = False
+            logger.warning("Trama rápida descartada (%s), lectura completa", e)
+            return await self.get_data()
+        self._fast_supported = True
+
+        checksum = fast.pop("configChecksum")
+        if (checksum != self._config_checksum or self._baseline is None
+                or time.monotonic() - self._baseline_at >= self.full_refresh_interval):
+            if self._config_checksum is not None and checksum != self._config_checksum:
+                logger.info("Cambió la configuración del ESP32, lectura completa")
+            data = await self.get_data()
+            # La suma es anterior a la lectura completa: si algo cambió entre
+            # medias, la próxima trama rápida vuelve a detectarlo
+            self._config_checksum = checksum
+            return data
+        self.fast_reads += 1
+        self._baseline.update(fast)
+        return dict(self._baseline)
+
+    def _reset_frames(self):
+        self.frame_version = None
+        self._frames_supported = None
+        self._fast_supported = None
+        self._baseline = None
+        self._config_checksum = None
+        self._text_fields = self._restored_text_fields
+        if self._restored_text_fields is not None:
+            self._text_read_at = time.monotonic()
+            self._restored_text_fields = None
+        if self._restored_baseline is not None:
+            self._baseline, self._config_checksum = self._restored_baseline
+            self._baseline_at = time.monotonic()
+            self._restored_baseline = None
+
+    @property
+    def config_checksum(self):
+        """Suma de configuración del firmware con que se leyó la última lectura completa"""
+        return self._config_checksum
+
+    def restore_text_fields(self, data):
+        """
+        Campos fuera de la trama binaria conocidos de una ejecución anterior
+        (firmware_version, notas). Con ellos la primera lectura tras conectar
+        es una trama; el texto completo se relee a los `text_refresh_interval`.
+        """
+        framed = LAYOUTS[FRAME_VERSION].fields
+        self._restored_text_fields = {
+            k: v for k, v in data.items() if k not in framed and k not in ("connected", "stale", "last_update")
+        }
+
+    def restore_baseline(self, data, config_checksum):
+        """
+        Lectura completa de una ejecución anterior y la suma de configuración
+        con que se leyó. Si la primera trama rápida tras conectar trae la misma
+        suma, se completa con ella sin lectura completa; si no, se relee todo
+        (el protocolo no permite leer un parámetro suelto).
+        """
+        self._restored_baseline = (
+            {k: v for k, v in data.items() if k not in ("connected", "stale", "last_update")},
+            config_checksum,
+        )
+
+    def _use_frames(self):
+        return (
+            self.binary_frames
+            and self._frames_supported is not False
+            and self._text_fields is not None
+            and time.monotonic() - self._text_read_at < self.text_refresh_interval
+        )
+
+    async def _get_text_data(self):
+        reply = await self.send_command("CMD:GET_DATA")
+        if reply.startswith("ERROR:"):
+            raise ESP32Error(reply[len("ERROR:"):])
+        try:
+            data = json.loads(reply[len("DATA:"):])
+        except ValueError as e:
+            raise ESP32Error(f"Respuesta DATA inválida: {e}") from None
+
+        previous = self._text_fields
+        if previous is not None and previous.get("firmware_version") != data.get("firmware_version"):
+            logger.info("Cambió la versión de firmware, se renegocian las tramas")
+            self.frame_version = None
+            self._frames_supported = None
+            self._fast_supported = None
+        # Solo se conservan los campos que la trama no transporta
+        framed = LAYOUTS[FRAME_VERSION].fields
+        self._text_fields = {k: v for k, v in data.items() if k not in framed}
+        self._text_read_at = time.monotonic()
+        return data
+
+    async def _get_frame_data(self):
+        reply = await self.send_command(f"CMD:GET_FRAME:{FRAME_VERSION}")
+        if reply.startswith("ERROR:"):
+            logger.info("Firmware sin tramas binarias (%s), usando texto", reply)
+            self._frames_supported = False
+            return await self._get_text_data()
+        try:
+            data = decode_line(reply)
+        except UnsupportedFrameVersion:
+            self._frames_supported = False
+            raise
+        if not self._frames_supported:
+            logger.info("Tramas binarias v%d negociadas con el ESP32", FRAME_VERSION)
+        self._frames_supported = True
+        self.frame_version = FRAME_VERSION
+        data.update(self._text_fields)
+        return data
+
+    async def set_parameter(self, parameter, value):
+        """Configura un parámetro; devuelve (éxito, respuesta del ESP32)"""
+        reply = await self.send_command(f"CMD:SET_{parameter}:{format_value(value)}")
+        return reply.startswith("OK:"), reply
+
+    async def set_parameters(self, parameters):
+        """
+        Envía varios parámetros en pipeline: todos se escriben sin esperar
+        a la respuesta del anterior. Devuelve {param: (éxito, respuesta)}.
+        """
+        names = list(parameters)
+        results = await asyncio.gather(
+            *(self.set_parameter(name, parameters[name]) for name in names),
+            return_exceptions=True,
+        )
+        return {
+            name: (False, str(result)) if isinstance(result, Exception) else result
+            for name, result in zip(names, results)
+        }
+
+    async def set_parameters_batch(self, parameters):
+        """
+        Envía varios parámetros en una sola transacción CMD:SET_MULTI.
+        Si el firmware no la soporta, recurre a `set_parameters()`.
+        Devuelve {param: (éxito, respuesta)} con el mismo formato.
+        """
+        if not parameters:
+            return {}
+        if not self.supports_multi_set:
+            return await self.set_parameters(parameters)
+
+        payload = json.dumps(parameters, separators=(",", ":"))
+        timeout = self.command_timeout * 2
+        try:
+            reply = await self.send_command(f"CMD:SET_MULTI:{payload}", timeout=timeout)
+        except ESP32Timeout as e:
+            return {name: (False, str(e)) for name in parameters}
+
+        if reply.startswith("ERROR:"):
+            logger.info("Firmware sin soporte de SET_MULTI (%s), usando pipeline", reply)
+            self.supports_multi_set = False
+            return await self.set_parameters(parameters)
+
+        try:
+            responses = json.loads(reply[len("MULTI:"):])
+        except ValueError as e:
+            return {name: (False, f"Respuesta MULTI inválida: {e}") for name in parameters}
+        results = {}
+        for name in parameters:
+            response = responses.get(name) or "Sin respuesta del ESP32"
+            results[name] = (response.startswith("OK:"), response)
+        return results
+
+
+class SamplingScheduler:
+    """
+    Intervalo del muestreo de fondo según el estado del cargador.
+
+    Con suscriptores de streaming se usa `stream_interval`; de noche (el panel
+    por debajo de la batería y sin corriente de carga) o sin sensor de panel
+    nada cambia deprisa y se usa `idle_interval`; si no, `interval`.
+    """
+
+    # Margen de voltaje y corriente (mA) por debajo de los que el panel no carga
+    NIGHT_VOLTAGE_MARGIN = 0.5
+    NIGHT_CURRENT = 50.0
+
+    def __init__(self, interval=2.0, stream_interval=0.5, idle_interval=10.0):
+        self.interval = interval
+        self.stream_interval = stream_interval
+        self.idle_interval = max(idle_interval, interval)
+
+    def is_idle(self, snapshot):
+        if not snapshot or snapshot.get("stale"):
+            return False
+        if snapshot.get("panelSensorAvailable") is False:
+            return True
+        panel = snapshot.get("voltagePanel")
+        battery = snapshot.get("voltageBatterySensor2")
+        current = snapshot.get("panelToBatteryCurrent")
+        if panel is None or battery is None or current is None:
+            return False
+        return panel < battery + self.NIGHT_VOLTAGE_MARGIN and abs(current) < self.NIGHT_CURRENT
+
+    def next_delay(self, snapshot, subscribers=0):
+        if subscribers:
+            return self.stream_interval
+        if self.is_idle(snapshot):
+            return self.idle_interval
+        return self.interval
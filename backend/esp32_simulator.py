@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Simulador del ESP32 del cargador solar
+
+Habla el mismo protocolo de texto que el firmware (ver esp32_controller) y
+modela las etapas de carga BULK -> ABSORPTION -> FLOAT, la latencia de
+procesamiento con jitter, el tiempo de transmisión según el baudrate y la
+inyección de fallos (respuestas perdidas, errores, basura, picos de latencia).
+
+Se puede usar de dos formas:
+- En proceso: `SimulatedTransport` se pasa a `ESP32Controller(transport=...)`.
+- Por pseudo-terminal: `PtySimulator` crea un par pty y el backend se conecta
+  al lado esclavo con pyserial como si fuera un puerto USB real:
+
+      python esp32_simulator.py            # imprime la ruta /dev/pts/N
+      ESP32_PORT=/dev/pts/N python main.py
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import time
+import zlib
+from datetime import datetime
+
+from esp32_controller import CONFIGURABLE_PARAMETERS, Transport
+from telemetry_frame import FAST_FRAME_VERSION, LAYOUTS, SLOW_FIELDS, encode_line
+
+logger = logging.getLogger("esp32_simulator")
+
+CHARGE_STATES = ("BULK_CHARGE", "ABSORPTION_CHARGE", "FLOAT_CHARGE", "ERROR")
+
+
+def default_state():
+    """Estado inicial con los mismos campos que documenta /data/"""
+    return {
+        "panelToBatteryCurrent": 0.0,
+        "batteryToLoadCurrent": 3000.0,
+        "voltagePanel": 18.5,
+        "voltageBatterySensor2": 12.45,
+        "currentPWM": 0,
+        "temperature": 25.0,
+        "chargeState": "BULK_CHARGE",
+        "bulkVoltage": 14.4,
+        "absorptionVoltage": 14.4,
+        "floatVoltage": 13.6,
+        "LVD": 11.5,
+        "LVR": 12.0,
+        "batteryCapacity": 100.0,
+        "thresholdPercentage": 2.5,
+        "maxAllowedCurrent": 10000.0,
+        "isLithium": False,
+        "maxBatteryVoltageAllowed": 15.0,
+        "absorptionCurrentThreshold_mA": 2500.0,
+        "currentLimitIntoFloatStage": 1000.0,
+        "calculatedAbsorptionHours": 2.5,
+        "currentBulkHours": 0.0,
+        "accumulatedAh": 0.0,
+        "estimatedSOC": 60.0,
+        "netCurrent": 0.0,
+        "factorDivider": 1,
+        "useFuenteDC": False,
+        "fuenteDC_Amps": 0.0,
+        "maxBulkHours": 6.0,
+        "panelSensorAvailable": True,
+        "maxAbsorptionHours": 4.0,
+        "chargedBatteryRestVoltage": 13.8,
+        "reEnterBulkVoltage": 12.8,
+        "pwmFrequency": 1000,
+        "tempThreshold": 40,
+        "temporaryLoadOff": False,
+        "loadOffRemainingSeconds": 0,
+        "loadOffDuration": 0,
+        "loadControlState": True,
+        "ledSolarState": True,
+        "notaPersonalizada": "Simulador ESP32",
+        "firmware_version": "v2.1.0-sim",
+        "uptime": 0,
+    }
+
+
+def config_checksum(state):
+    """Suma de los campos lentos y los textos, como la calcula el firmware"""
+    slow = {name: state.get(name) for name in SLOW_FIELDS}
+    slow["firmware_version"] = state.get("firmware_version")
+    slow["notaPersonalizada"] = state.get("notaPersonalizada")
+    return zlib.crc32(json.dumps(slow, sort_keys=True).encode())
+
+
+class ChargerModel:
+    """Modelo físico simplificado del cargador; avanza con el tiempo real"""
+
+    def __init__(self, sun=None, load_current=3000.0, seed=None, clock=time.monotonic):
+        self.state = default_state()
+        # sun: factor de irradiancia fijo 0..1; None usa la hora del día
+        self.sun = sun
+        self.load_current = load_current
+        self.random = random.Random(seed)
+        self.clock = clock
+        self._started = clock()
+        self._last = self._started
+        self._stage_started = self._started
+
+    def sun_factor(self):
+        if self.sun is not None:
+            return self.sun
+        now = datetime.now()
+        hour = now.hour + now.minute / 60
+        return max(0.0, math.sin(math.pi * (hour - 6) / 12))
+
+    def advance(self):
+        now = self.clock()
+        dt = now - self._last
+        self._last = now
+        if dt > 0:
+            self._step(dt, now)
+        return self.state
+
+    def _step(self, dt, now):
+        s = self.state
+        noise = self.random.gauss
+        sun = self.sun_factor() if s["panelSensorAvailable"] else 0.0
+        capacity = max(float(s["batteryCapacity"]), 1.0)
+        max_current = float(s["maxAllowedCurrent"])
+        soc = s["estimatedSOC"]
+
+        # Corriente de carga según la etapa
+        available = sun * max_current
+        if s["useFuenteDC"]:
+            available = max(available, float(s["fuenteDC_Amps"]) * 1000)
+        stage = s["chargeState"]
+        if stage == "BULK_CHARGE":
+            charge = available
+        elif stage == "ABSORPTION_CHARGE":
+            charge = min(available, max_current * max(0.05, (100 - soc) / 20))
+        else:
+            charge = min(available, float(s["currentLimitIntoFloatStage"]))
+        charge = max(0.0, charge + noise(0, max_current * 0.01))
+
+        if s["temporaryLoadOff"]:
+            s["loadOffRemainingSeconds"] = max(0, s["loadOffRemainingSeconds"] - dt)
+            if s["loadOffRemainingSeconds"] <= 0:
+                s["temporaryLoadOff"] = False
+                s["loadControlState"] = True
+                s["loadOffDuration"] = 0
+        load = self.load_current + noise(0, 50) if s["loadControlState"] else 0.0
+        load = max(0.0, load)
+
+        net = charge - load
+        amp_hours = net / 1000 * dt / 3600
+        s["accumulatedAh"] = round(s["accumulatedAh"] + amp_hours, 4)
+        soc = min(100.0, max(0.0, soc + amp_hours / capacity * 100))
+
+        rest_voltage = (12.8 + 0.6 * soc / 100) if s["isLithium"] else (11.8 + 1.0 * soc / 100)
+        voltage = rest_voltage + 0.8 * charge / max(max_current, 1.0)
+        if stage == "ABSORPTION_CHARGE":
+            voltage = min(voltage, float(s["absorptionVoltage"]))
+        elif stage == "FLOAT_CHARGE":
+            voltage = min(voltage, float(s["floatVoltage"]))
+
+        # Transiciones de etapa
+        stage_hours = (now - self._stage_started) / 3600
+        if stage == "BULK_CHARGE" and voltage >= float(s["bulkVoltage"]):
+            self._set_stage("ABSORPTION_CHARGE", now)
+        elif stage == "ABSORPTION_CHARGE" and (
+                (charge < float(s["absorptionCurrentThreshold_mA"]) and soc > 95)
+                or stage_hours >= float(s["calculatedAbsorptionHours"])):
+            self._set_stage("FLOAT_CHARGE", now)
+        elif stage == "FLOAT_CHARGE" and voltage < float(s["reEnterBulkVoltage"]):
+            self._set_stage("BULK_CHARGE", now)
+        if s["chargeState"] == "BULK_CHARGE":
+            s["currentBulkHours"] = round(s["currentBulkHours"] + dt / 3600, 4)
+
+        s.update({
+            "panelToBatteryCurrent": round(charge, 1),
+            "batteryToLoadCurrent": round(load, 1),
+            "netCurrent": round(net, 1),
+            "estimatedSOC": round(soc, 2),
+            "voltageBatterySensor2": round(voltage, 3),
+            "voltagePanel": round(12.0 + 9.0 * sun + noise(0, 0.05), 2) if sun > 0 else 0.0,
+            "currentPWM": int(min(255, 255 * charge / max(max_current, 1.0))),
+            "temperature": round(22.0 + 10.0 * sun + noise(0, 0.2), 2),
+            "ledSolarState": sun > 0.05,
+            "uptime": int((now - self._started) * 1000),
+        })
+
+    def _set_stage(self, stage, now):
+        self.state["chargeState"] = stage
+        self._stage_started = now
+        if stage == "BULK_CHARGE":
+            self.state["currentBulkHours"] = 0.0
+
+    def set_parameter(self, name, raw_value):
+        expected = CONFIGURABLE_PARAMETERS[name]
+        if expected is bool:
+            if raw_value.lower() not in ("true", "false", "1", "0"):
+                raise ValueError(raw_value)
+            value = raw_value.lower() in ("true", "1")
+        elif expected is int:
+            value = int(float(raw_value))
+        else:
+            value = float(raw_value)
+        self.state[name] = value
+        return value
+
+    def toggle_load(self, seconds):
+        s = self.state
+        s["temporaryLoadOff"] = True
+        s["loadControlState"] = False
+        s["loadOffDuration"] = seconds
+        s["loadOffRemainingSeconds"] = seconds
+
+
+class Faults:
+    """Probabilidades de fallo por comando (0..1)"""
+
+    def __init__(self, drop=0.0, error=0.0, garbage=0.0, spike=0.0, spike_seconds=2.0):
+        self.drop = drop
+        self.error = error
+        self.garbage = garbage
+        self.spike = spike
+        self.spike_seconds = spike_seconds
+
+
+class ESP32Simulator:
+    """
+    Procesa comandos de uno en uno, como el loop del firmware, y emite las
+    respuestas tras la latencia simulada.
+
+    `latency`/`jitter` modelan el procesamiento; si se pasa `latency_profile`
+    (lista de latencias medidas en campo, en segundos) se muestrea de ahí.
+    """
+
+    def __init__(self, model=None, latency=0.02, jitter=0.005, latency_profile=None,
+                 baudrate=115200, faults=None, supports_multi_set=True,
+                 supports_binary_frames=True, seed=None):
+        self.model = model or ChargerModel(seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_profile = list(latency_profile or [])
+        self.baudrate = baudrate
+        self.faults = faults or Faults()
+        self.supports_multi_set = supports_multi_set
+        self.supports_binary_frames = supports_binary_frames
+        self.random = random.Random(seed)
+        self.commands_processed = 0
+
+    def transfer_time(self, n_bytes):
+        """Tiempo en el cable a 8N1 (10 bits por byte)"""
+        return n_bytes * 10 / self.baudrate if self.baudrate else 0.0
+
+    def processing_time(self):
+        if self.latency_profile:
+            return self.random.choice(self.latency_profile)
+        return max(0.0, self.random.gauss(self.latency, self.jitter))
+
+    def handle(self, line):
+        """Devuelve la línea de respuesta para un comando (sin aplicar fallos)"""
+        self.commands_processed += 1
+        if line == "CMD:GET_DATA":
+            data = self.model.advance()
+            return "DATA:" + json.dumps(data, separators=(",", ":"))
+        if line.startswith("CMD:GET_FRAME:"):
+            if not self.supports_binary_frames:
+                return "ERROR:Unknown command GET_FRAME"
+            try:
+                version = int(line[len("CMD:GET_FRAME:"):])
+            except ValueError:
+                return "ERROR:Invalid frame version"
+            if version not in LAYOUTS:
+                return f"ERROR:Unsupported frame version {version}"
+            data = self.model.advance()
+            if version == FAST_FRAME_VERSION:
+                data = {**data, "configChecksum": config_checksum(data)}
+            return encode_line(data, version)
+        if line.startswith("CMD:SET_MULTI:"):
+            if not self.supports_multi_set:
+                return "ERROR:Unknown command SET_MULTI"
+            try:
+                parameters = json.loads(line[len("CMD:SET_MULTI:"):])
+            except ValueError:
+                return "ERROR:Invalid JSON"
+            return "MULTI:" + json.dumps(
+                {name: self._set(name, json.dumps(value)) for name, value in parameters.items()},
+                separators=(",", ":"),
+            )
+        if line.startswith("CMD:SET_"):
+            name, _, raw_value = line[len("CMD:SET_"):].partition(":")
+            return self._set(name, raw_value)
+        if line.startswith("CMD:TOGGLE_LOAD:"):
+            try:
+                seconds = int(line[len("CMD:TOGGLE_LOAD:"):])
+            except ValueError:
+                return "ERROR:Invalid duration"
+            self.model.advance()
+            self.model.toggle_load(seconds)
+            return f"OK:Load off for {seconds} seconds"
+        return f"ERROR:Unknown command {line}"
+
+    def _set(self, name, raw_value):
+        if name not in CONFIGURABLE_PARAMETERS:
+            return f"ERROR:Unknown parameter {name}"
+        try:
+            value = self.model.set_parameter(name, raw_value)
+        except ValueError:
+            return f"ERROR:Invalid value for {name}"
+        return f"OK:{name} updated to {value}"
+
+    async def serve(self, commands, emit):
+        """Consume líneas de `commands` y llama a `emit(bytes)` con cada salida"""
+        while True:
+            line = await commands.get()
+            reply = self.handle(line)
+            delay = self.processing_time() + self.transfer_time(len(line) + len(reply) + 2)
+
+            roll = self.random.random
+            if self.faults.spike and roll() < self.faults.spike:
+                delay += self.faults.spike_seconds
+            await asyncio.sleep(delay)
+
+            if self.faults.drop and roll() < self.faults.drop:
+                continue
+            if self.faults.garbage and roll() < self.faults.garbage:
+                emit(b"\x00\xff#garbage\n")
+                reply = reply[: len(reply) // 2]
+            elif self.faults.error and roll() < self.faults.error:
+                reply = "ERROR:Simulated fault"
+            emit((reply + "\n").encode())
+
+
+class SimulatedTransport(Transport):
+    """Transporte en proceso conectado directamente a un ESP32Simulator"""
+
+    def __init__(self, simulator=None, read_timeout=0.2):
+        self.simulator = simulator or ESP32Simulator()
+        self.read_timeout = read_timeout
+        self._commands = None
+        self._output = None
+        self._task = None
+        self._buffer = b""
+
+    async def open(self):
+        self._commands = asyncio.Queue()
+        self._output = asyncio.Queue()
+        self._buffer = b""
+        self._task = asyncio.create_task(
+            self.simulator.serve(self._commands, self._output.put_nowait), name="esp32-simulator"
+        )
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        while b"\n" in self._buffer:
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            self._commands.put_nowait(line.decode(errors="replace").strip())
+
+    async def readline(self) -> bytes:
+        try:
+            return await asyncio.wait_for(self._output.get(), self.read_timeout)
+        except asyncio.TimeoutError:
+            return b""
+
+
+class PtySimulator:
+    """Expone un ESP32Simulator en un pseudo-terminal (puerto serie virtual)"""
+
+    def __init__(self, simulator=None):
+        self.simulator = simulator or ESP32Simulator()
+        self.master_fd = None
+        self.slave_fd = None
+        self.port = None
+        self._commands = None
+        self._task = None
+        self._buffer = b""
+
+    async def start(self):
+        import tty
+
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+
+        loop = asyncio.get_running_loop()
+        self._commands = asyncio.Queue()
+        loop.add_reader(self.master_fd, self._on_readable)
+        self._task = asyncio.create_task(self.simulator.serve(self._commands, self._emit))
+        return self.port
+
+    def _on_readable(self):
+        try:
+            chunk = os.read(self.master_fd, 4096)
+        except (BlockingIOError, OSError):
+            return
+        self._buffer += chunk
+        while b"\n" in self._buffer:
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            self._commands.put_nowait(line.decode(errors="replace").strip())
+
+    def _emit(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.master_fd, view)
+            except BlockingIOError:
+                time.sleep(0.001)
+                continue
+            view = view[written:]
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self.master_fd is not None:
+            asyncio.get_running_loop().remove_reader(self.master_fd)
+            os.close(self.master_fd)
+            os.close(self.slave_fd)
+            self.master_fd = self.slave_fd = None
+
+
+async def _run_pty(args):
+    simulator = ESP32Simulator(
+        model=ChargerModel(sun=args.sun, seed=args.seed),
+        latency=args.latency,
+        jitter=args.jitter,
+        baudrate=args.baudrate,
+        faults=Faults(drop=args.drop, error=args.error, garbage=args.garbage, spike=args.spike),
+        supports_binary_frames=not args.text_only,
+        seed=args.seed,
+    )
+    pty = PtySimulator(simulator)
+    port = await pty.start()
+    print(f"✅ Simulador ESP32 escuchando en {port}")
+    print(f"   Inicia el backend con: ESP32_PORT={port} python main.py")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pty.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulador del ESP32 en un puerto serie virtual")
+    parser.add_argument("--latency", type=float, default=0.02, help="latencia media (s)")
+    parser.add_argument("--jitter", type=float, default=0.005, help="desviación de la latencia (s)")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--sun", type=float, default=None, help="irradiancia fija 0..1")
+    parser.add_argument("--drop", type=float, default=0.0, help="probabilidad de perder la respuesta")
+    parser.add_argument("--error", type=float, default=0.0, help="probabilidad de responder ERROR")
+    parser.add_argument("--garbage", type=float, default=0.0, help="probabilidad de respuesta corrupta")
+    parser.add_argument("--spike", type=float, default=0.0, help="probabilidad de pico de latencia")
+    parser.add_argument("--text-only", action="store_true", help="firmware sin tramas binarias")
+    parser.add_argument("--seed", type=int, default=None)
+    try:
+        asyncio.run(_run_pty(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
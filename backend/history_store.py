@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Historial de telemetría en disco con agregados automáticos
+
+Los datos se guardan en segmentos de tamaño fijo mapeados en memoria (mmap),
+uno por resolución y período:
+
+    <dir>/v1/1s/<inicio>.seg     un día por archivo, una fila por segundo
+    <dir>/v1/1min/<inicio>.seg   30 días por archivo, min/max/avg/n por minuto
+    <dir>/v1/1h/<inicio>.seg     un año por archivo, min/max/avg/n por hora
+
+Cada segmento es columnar (float32, una columna contigua por campo) y la fila
+de un instante se calcula directamente a partir del timestamp, así que
+escribir y consultar no requieren índices. Los agregados se actualizan en el
+mismo lugar con cada muestra y el kernel agrupa las escrituras por página,
+lo que evita reescribir archivos completos en la tarjeta SD.
+
+Las consultas abren sus propios mapeos de solo lectura y extraen columnas
+enteras de una vez (con NumPy si está instalado), así que pueden correr en
+otro hilo mientras el escritor añade muestras.
+"""
+
+import functools
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+logger = logging.getLogger("history_store")
+
+SCHEMA_VERSION = "v1"
+
+# Campos numéricos guardados; chargeState se guarda como código
+HISTORY_FIELDS = (
+    "panelToBatteryCurrent",
+    "batteryToLoadCurrent",
+    "voltagePanel",
+    "voltageBatterySensor2",
+    "currentPWM",
+    "temperature",
+    "netCurrent",
+    "accumulatedAh",
+    "estimatedSOC",
+    "chargeState",
+)
+
+CHARGE_STATES = ("BULK_CHARGE", "ABSORPTION_CHARGE", "FLOAT_CHARGE", "ERROR")
+
+# nombre -> (segundos por fila, filas por segmento, es agregado)
+RESOLUTIONS = {
+    "1s": (1, 86400, False),
+    "1min": (60, 30 * 24 * 60, True),
+    "1h": (3600, 366 * 24, True),
+}
+
+DEFAULT_RETENTION_DAYS = {"1s": 35, "1min": 400, "1h": 3650}
+
+# Columnas de un campo agregado: mínimo, máximo, promedio y número de muestras
+ROLLUP_COLUMNS = 4
+_MIN, _MAX, _AVG, _COUNT = range(ROLLUP_COLUMNS)
+
+_FLOAT = struct.Struct("<f")
+_NAN = float("nan")
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """NumPy, importado en la primera consulta y no al arrancar; None si no está instalado"""
+    try:
+        import numpy
+    except ImportError:  # sin NumPy las consultas convierten columnas enteras con tolist()
+        return None
+    return numpy
+
+
+def encode_value(field, value):
+    """Convierte un valor de /data/ al float que se guarda (NaN si falta)"""
+    if value is None:
+        return _NAN
+    if field == "chargeState":
+        try:
+            return float(CHARGE_STATES.index(value))
+        except ValueError:
+            return _NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+class Segment:
+    """Archivo de filas fijas mapeado en memoria, organizado por columnas"""
+
+    def __init__(self, path, start, step, rows, columns, rollup, readonly=False):
+        self.path = path
+        self.start = start
+        self.step = step
+        self.rows = rows
+        self.columns = columns
+        self.rollup = rollup
+        self.end = start + step * rows
+
+        size = rows * columns * _FLOAT.size
+        if readonly:
+            # Mapeo propio de un lector: no depende de los del escritor
+            self._file = open(path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        else:
+            if not os.path.exists(path):
+                self._create(path, size)
+            self._file = open(path, "r+b")
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        self.values = memoryview(self._mmap).cast("f")
+
+    def _create(self, path, size):
+        # Los segmentos crudos empiezan en NaN; los agregados en n=0
+        fill = array("f", [0.0 if self.rollup else _NAN]) * (self.rows)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for _ in range(self.columns):
+                fill.tofile(f)
+        os.replace(tmp_path, path)
+
+    def row(self, timestamp):
+        return int((timestamp - self.start) // self.step)
+
+    def offset(self, column, row):
+        return column * self.rows + row
+
+    def write_raw(self, row, values):
+        for column, value in enumerate(values):
+            self.values[self.offset(column, row)] = value
+
+    def update_rollup(self, row, values):
+        for field_index, value in enumerate(values):
+            if math.isnan(value):
+                continue
+            base = field_index * ROLLUP_COLUMNS
+            count_at = self.offset(base + _COUNT, row)
+            count = self.values[count_at]
+            min_at = self.offset(base + _MIN, row)
+            max_at = self.offset(base + _MAX, row)
+            avg_at = self.offset(base + _AVG, row)
+            if count == 0:
+                self.values[min_at] = self.values[max_at] = self.values[avg_at] = value
+            else:
+                if value < self.values[min_at]:
+                    self.values[min_at] = value
+                if value > self.values[max_at]:
+                    self.values[max_at] = value
+                self.values[avg_at] += (value - self.values[avg_at]) / (count + 1)
+            self.values[count_at] = count + 1
+
+    def column(self, column, first_row, last_row):
+        """Vista sin copia de una columna entre dos filas (inclusive)"""
+        base = column * self.rows
+        return self.values[base + first_row:base + last_row + 1]
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self.values.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class HistoryStore:
+    """Historial append-only con agregados a 1s, 1min y 1h"""
+
+    def __init__(self, directory="history", retention_days=None):
+        self.directory = os.path.join(directory, SCHEMA_VERSION)
+        self.retention_days = {**DEFAULT_RETENTION_DAYS, **(retention_days or {})}
+        self.fields = HISTORY_FIELDS
+        self._segments = {}
+        # append corre en un hilo (crear un segmento escribe varios MB) y
+        # close puede llegar mientras tanto al detener el dispositivo
+        self._lock = threading.Lock()
+        for resolution in RESOLUTIONS:
+            os.makedirs(os.path.join(self.directory, resolution), exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Segmentos
+    # ------------------------------------------------------------------
+
+    def _segment(self, resolution, timestamp):
+        step, rows, rollup = RESOLUTIONS[resolution]
+        span = step * rows
+        start = int(timestamp // span) * span
+        key = (resolution, start)
+        segment = self._segments.get(key)
+        if segment is not None:
+            return segment
+
+        path = os.path.join(self.directory, resolution, f"{start}.seg")
+        columns = len(self.fields) * (ROLLUP_COLUMNS if rollup else 1)
+        segment = Segment(path, start, step, rows, columns, rollup)
+        self._segments[key] = segment
+        self._rotate(resolution, start)
+        return segment
+
+    def _rotate(self, resolution, current_start):
+        """Cierra segmentos viejos de la resolución y aplica la retención"""
+        for key in [k for k in self._segments if k[0] == resolution and k[1] < current_start]:
+            self._segments.pop(key).close()
+        self.apply_retention(resolution)
+
+    def apply_retention(self, resolution, now=None):
+        now = time.time() if now is None else now
+        step, rows, _ = RESOLUTIONS[resolution]
+        cutoff = now - self.retention_days[resolution] * 86400
+        folder = os.path.join(self.directory, resolution)
+        for name in os.listdir(folder):
+            if not name.endswith(".seg"):
+                continue
+            start = int(name[:-len(".seg")])
+            if start + step * rows < cutoff:
+                segment = self._segments.pop((resolution, start), None)
+                if segment is not None:
+                    segment.close()
+                os.remove(os.path.join(folder, name))
+                logger.info("Segmento de historial eliminado por retención: %s/%s", resolution, name)
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def append(self, data, timestamp=None):
+        """
+        Guarda una muestra de /data/ y actualiza los agregados. Puede crear
+        un segmento nuevo (escritura de varios MB): llamar fuera del event loop.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        values = [encode_value(field, data.get(field)) for field in self.fields]
+        with self._lock:
+            for resolution, (_, _, rollup) in RESOLUTIONS.items():
+                segment = self._segment(resolution, timestamp)
+                row = segment.row(timestamp)
+                if rollup:
+                    segment.update_rollup(row, values)
+                else:
+                    segment.write_raw(row, values)
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def pick_resolution(self, start, end, max_points):
+        """La resolución más fina que no supera `max_points` filas"""
+        for resolution, (step, _, _) in RESOLUTIONS.items():
+            if (end - start) / step <= max_points:
+                return resolution
+        return list(RESOLUTIONS)[-1]
+
+    def query(self, fields, start, end, resolution=None, max_points=1000):
+        """
+        Devuelve las filas con datos entre `start` y `end` (epoch, segundos).
+
+        Para 1s cada campo trae `value`; para los agregados `min`, `max` y `avg`.
+        Los campos sin dato en una fila se devuelven como None.
+        """
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ValueError(f"Campos sin historial: {', '.join(unknown)}")
+        if end < start:
+            raise ValueError("El fin del rango es anterior al inicio")
+        resolution = resolution or self.pick_resolution(start, end, max_points)
+        rollup = RESOLUTIONS[resolution][2]
+        indexes = [self.fields.index(field) for field in fields]
+        stats = ("min", "max", "avg") if rollup else ("value",)
+
+        timestamps = []
+        series = {field: {stat: [] for stat in stats} for field in fields}
+        collect = self._collect_numpy if _numpy() is not None else self._collect
+        for segment, first, last in self.read_segments(resolution, start, end):
+            collect(segment, indexes, fields, first, last, rollup, timestamps, series)
+
+        return {
+            "resolution": resolution,
+            "start": start,
+            "end": end,
+            "timestamps": timestamps,
+            "series": series,
+        }
+
+    def read_segments(self, resolution, start, end):
+        """
+        Segmentos existentes que cubren [start, end] con su primera y última
+        fila, con mapeos de solo lectura abiertos para el lector y cerrados al
+        avanzar. Es seguro desde otro hilo: no toca los segmentos del
+        escritor, que puede cerrarlos al rotar o por retención.
+        """
+        step, rows, rollup = RESOLUTIONS[resolution]
+        columns = len(self.fields) * (ROLLUP_COLUMNS if rollup else 1)
+        for segment_start in self._segment_starts(resolution, start, end):
+            path = os.path.join(self.directory, resolution, f"{segment_start}.seg")
+            try:
+                segment = Segment(path, segment_start, step, rows, columns, rollup, readonly=True)
+            except FileNotFoundError:
+                continue  # no existe o la retención lo acaba de borrar
+            try:
+                yield (segment, *self._row_range(segment, start, end))
+            finally:
+                segment.close()
+
+    @staticmethod
+    def _segment_starts(resolution, start, end):
+        step, rows, _ = RESOLUTIONS[resolution]
+        span = step * rows
+        segment_start = int(start // span) * span
+        while segment_start <= end:
+            yield segment_start
+            segment_start += span
+
+    @staticmethod
+    def _row_range(segment, start, end):
+        first = max(segment.row(start), 0) if start > segment.start else 0
+        last = min(segment.row(end), segment.rows - 1) if end < segment.end else segment.rows - 1
+        return first, last
+
+    def _collect(self, segment, indexes, fields, first, last, rollup, timestamps, series):
+        """Sin NumPy: cada columna se convierte a lista de una vez y se filtra"""
+        if rollup:
+            counts = [segment.column(i * ROLLUP_COLUMNS + _COUNT, first, last).tolist() for i in indexes]
+            present = [[count > 0 for count in column] for column in counts]
+        else:
+            values = [segment.column(i, first, last).tolist() for i in indexes]
+            present = [[not math.isnan(value) for value in column] for column in values]
+        rows = [offset for offset, flags in enumerate(zip(*present)) if any(flags)]
+        if not rows:
+            return
+        timestamps.extend(segment.start + (first + offset) * segment.step for offset in rows)
+        for field, i, flags in zip(fields, indexes, present):
+            for stat, column in self._stat_columns(i, rollup).items():
+                values = segment.column(column, first, last).tolist()
+                series[field][stat].extend(
+                    round(values[offset], 4) if flags[offset] else None for offset in rows
+                )
+
+    def _collect_numpy(self, segment, indexes, fields, first, last, rollup, timestamps, series):
+        np = _numpy()
+        matrix = np.frombuffer(segment.values, dtype=np.float32).reshape(segment.columns, segment.rows)
+        block = matrix[:, first:last + 1]
+        if rollup:
+            present = block[[i * ROLLUP_COLUMNS + _COUNT for i in indexes]] > 0
+        else:
+            present = ~np.isnan(block[indexes])
+        rows = np.flatnonzero(present.any(axis=0))
+        if not rows.size:
+            return
+        timestamps.extend((segment.start + (first + rows) * segment.step).tolist())
+        for field, i, flags in zip(fields, indexes, present[:, rows]):
+            for stat, column in self._stat_columns(i, rollup).items():
+                values = np.round(block[column, rows].astype(np.float64), 4).astype(object)
+                values[~flags] = None
+                series[field][stat].extend(values.tolist())
+
+    @staticmethod
+    def _stat_columns(index, rollup):
+        """{estadística: columna del segmento} de un campo"""
+        if not rollup:
+            return {"value": index}
+        base = index * ROLLUP_COLUMNS
+        return {"min": base + _MIN, "max": base + _MAX, "avg": base + _AVG}
+
+    def flush(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.flush()
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
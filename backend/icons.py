@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Favicon e iconos del frontend, generados en lote con NumPy
+
+Dibuja el mismo diseño que public/favicon.svg (disco azul, sol con rayos y
+batería) como figuras evaluadas sobre una rejilla sobremuestreada: cada
+figura es una máscara calculada de una vez para todos los píxeles, y la
+media de cada bloque da el suavizado. Todos los tamaños se generan en una
+fracción de segundo.
+
+Forma parte del pipeline de assets (ver static_assets.py):
+    python backend/icons.py public
+genera favicon.ico (16, 32 y 48 px en una sola imagen) y los PNG de
+icons/ que enlaza index.html.
+"""
+
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # solo hace falta al generar los iconos (build)
+    np = None
+
+ICO_SIZES = (16, 32, 48)
+PNG_ICONS = {
+    "icons/apple-touch-icon.png": 180,
+    "icons/icon-192.png": 192,
+    "icons/icon-512.png": 512,
+}
+
+# Sobremuestreo por eje para el suavizado de bordes (menos en iconos grandes)
+SUPERSAMPLE = 4
+LARGE_SUPERSAMPLE = 2
+
+SUN = (0xFB, 0xBF, 0x24, 255)
+
+
+# Cada figura es (máscara(x, y), caja (x0, y0, x1, y1)); la máscara solo se
+# evalúa dentro de la caja
+
+
+def _circle(cx, cy, r):
+    return (lambda x, y: (x - cx) ** 2 + (y - cy) ** 2 <= r * r), (cx - r, cy - r, cx + r, cy + r)
+
+
+def _rect(x0, y0, w, h):
+    return (lambda x, y: (x >= x0) & (x <= x0 + w) & (y >= y0) & (y <= y0 + h)), (x0, y0, x0 + w, y0 + h)
+
+
+def _segment(x0, y0, x1, y1, width):
+    """Trazo con extremos redondeados: distancia al segmento <= width/2"""
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    half = width / 2
+
+    def mask(x, y):
+        t = np.clip(((x - x0) * dx + (y - y0) * dy) / length2, 0.0, 1.0)
+        return (x - x0 - t * dx) ** 2 + (y - y0 - t * dy) ** 2 <= half * half
+
+    return mask, (min(x0, x1) - half, min(y0, y1) - half, max(x0, x1) + half, max(y0, y1) + half)
+
+
+# Capas de abajo arriba, en coordenadas del viewBox 32x32 del SVG
+LAYERS = (
+    (_circle(16, 16, 15.5), (0x1D, 0x4E, 0xD8, 255)),
+    (_circle(16, 16, 14.5), (0x1E, 0x40, 0xAF, 255)),
+    (_circle(16, 10, 4), SUN),
+    (_segment(16, 2, 16, 6, 1.5), SUN),
+    (_segment(24, 10, 20, 10, 1.5), SUN),
+    (_segment(8, 10, 12, 10, 1.5), SUN),
+    (_segment(22.5, 5.5, 20, 8, 1.5), SUN),
+    (_segment(9.5, 5.5, 12, 8, 1.5), SUN),
+    (_rect(11.5, 17.5, 9, 7), (0x16, 0xA3, 0x4A, 255)),
+    (_rect(12.5, 18.5, 7, 5), (0x22, 0xC5, 0x5E, 255)),
+    (_rect(18, 16, 2, 2), (0x16, 0xA3, 0x4A, 255)),
+    (_segment(16, 14, 16, 17, 2), SUN),
+    (_segment(14, 15, 18, 15, 1), SUN),
+    (_rect(13, 20, 2, 2), (255, 255, 255, 204)),
+    (_rect(15.5, 20, 2, 2), (255, 255, 255, 153)),
+    (_rect(18, 20, 1, 2), (255, 255, 255, 77)),
+)
+
+
+def render_icon(size):
+    """Imagen RGBA (size x size x 4, uint8) del icono"""
+    if np is None:
+        raise RuntimeError("Generar iconos requiere NumPy (pip install numpy)")
+    supersample = SUPERSAMPLE if size <= 64 else LARGE_SUPERSAMPLE
+    samples = size * supersample
+    scale = samples / 32.0
+    # Centros de las submuestras en unidades del viewBox
+    axis = (np.arange(samples, dtype=np.float32) + 0.5) / scale
+    # Composición "over" en alfa premultiplicado
+    color = np.zeros((samples, samples, 3), dtype=np.float32)
+    alpha = np.zeros((samples, samples), dtype=np.float32)
+    for (mask_func, (x0, y0, x1, y1)), (r, g, b, a) in LAYERS:
+        cols = slice(max(0, int(x0 * scale)), min(samples, int(np.ceil(x1 * scale)) + 1))
+        rows = slice(max(0, int(y0 * scale)), min(samples, int(np.ceil(y1 * scale)) + 1))
+        coverage = mask_func(axis[None, cols], axis[rows, None]).astype(np.float32) * (a / 255.0)
+        keep = 1 - coverage
+        paint = coverage[..., None] * np.array([r, g, b], np.float32)
+        color[rows, cols] = color[rows, cols] * keep[..., None] + paint
+        alpha[rows, cols] = alpha[rows, cols] * keep + coverage
+    # Media de cada bloque supersample x supersample
+    blocks = (size, supersample, size, supersample)
+    color = color.reshape(*blocks, 3).mean(axis=(1, 3))
+    alpha = alpha.reshape(blocks).mean(axis=(1, 3))
+    rgb = np.divide(color, alpha[..., None], out=np.zeros_like(color), where=alpha[..., None] > 0)
+    rgba = np.dstack([rgb, alpha * 255.0])
+    return np.clip(np.rint(rgba), 0, 255).astype(np.uint8)
+
+
+def encode_png(rgba):
+    """PNG RGBA de 8 bits (filtro 0 en todas las filas)"""
+    height, width, _ = rgba.shape
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)]).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b""))
+
+
+def encode_ico(images):
+    """ICO con una entrada PNG por tamaño ({tamaño: bytes PNG})"""
+    directory, payload = [], []
+    offset = 6 + 16 * len(images)
+    for size, png in sorted(images.items()):
+        # En el directorio ICO 0 significa 256 px
+        directory.append(struct.pack("<BBBBHHII", size % 256, size % 256, 0, 0, 1, 32, len(png), offset))
+        payload.append(png)
+        offset += len(png)
+    return struct.pack("<HHH", 0, 1, len(images)) + b"".join(directory) + b"".join(payload)
+
+
+def write_icons(public_dir):
+    """Genera favicon.ico y los PNG de PNG_ICONS en `public_dir`; devuelve las rutas"""
+    written = []
+    sizes = sorted(set(ICO_SIZES) | set(PNG_ICONS.values()))
+    pngs = {size: encode_png(render_icon(size)) for size in sizes}
+
+    path = os.path.join(public_dir, "favicon.ico")
+    with open(path, "wb") as f:
+        f.write(encode_ico({size: pngs[size] for size in ICO_SIZES}))
+    written.append(path)
+    for name, size in PNG_ICONS.items():
+        path = os.path.join(public_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(pngs[size])
+        written.append(path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera el favicon y los iconos del frontend")
+    parser.add_argument("public_dir", nargs="?", default="public")
+    args = parser.parse_args(argv)
+    try:
+        written = write_icons(args.public_dir)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    for path in written:
+        print(f"✅ {path} ({os.path.getsize(path)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Cola de trabajos para operaciones largas sobre los cargadores
+
+Un apply, un apagado temporal de la carga o un cambio de horario pueden
+pedirse como trabajo: la API responde 202 con el id y la operación sigue en
+el servidor aunque el cliente se desconecte, así que un timeout del lado del
+navegador ya no deja el estado del ESP32 en duda.
+
+- Cada dispositivo tiene un worker que ejecuta sus trabajos de uno en uno,
+  en orden de llegada, igual que el motor serie ejecuta sus comandos.
+- Un trabajo idéntico (mismo tipo, dispositivo y parámetros) a otro que
+  todavía está en cola o en ejecución no se duplica: se devuelve el existente.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import uuid
+from datetime import datetime
+
+from telemetry_stream import KEEPALIVE_SECONDS, format_event
+
+logger = logging.getLogger("jobs")
+
+# Trabajos terminados que se conservan para consulta
+MAX_FINISHED_JOBS = 200
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+# Clave del worker para trabajos que no son de un dispositivo
+PROCESS_WORKER = None
+
+
+def new_job_id():
+    return uuid.uuid4().hex[:12]
+
+
+def prune_finished(jobs, limit=MAX_FINISHED_JOBS):
+    """Descarta los trabajos terminados más antiguos de `jobs` (OrderedDict por id)"""
+    finished = [job_id for job_id, job in jobs.items() if job.finished]
+    for job_id in finished[:max(0, len(finished) - limit)]:
+        del jobs[job_id]
+
+
+class Job:
+    """Una operación encolada y su resultado"""
+
+    def __init__(self, kind, device_id, params, func):
+        self.id = new_job_id()
+        self.kind = kind
+        self.device_id = device_id
+        self.params = params
+        self.func = func
+        self.key = (kind, device_id, json.dumps(params, sort_keys=True, default=str))
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.coalesced = 0
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def _set(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, version, timeout=None):
+        """Espera un cambio posterior a `version`; False si vence el timeout"""
+        if self.version > version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def wait(self):
+        """Espera a que el trabajo termine"""
+        while not self.finished:
+            await self.wait_for_change(self.version)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "device_id": self.device_id,
+            "params": self.params,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "status_code": self.status_code,
+            "coalesced_requests": self.coalesced,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Encola trabajos y los ejecuta con un worker por dispositivo"""
+
+    def __init__(self):
+        self.jobs = collections.OrderedDict()
+        self._active = {}
+        self._queues = {}
+        self._workers = {}
+
+    def submit(self, kind, device_id, params, func):
+        """
+        Encola `func()` (una corrutina que devuelve un dict) y devuelve
+        (trabajo, coalescido). Si ya hay uno igual pendiente se reutiliza.
+        """
+        job = Job(kind, device_id, params, func)
+        existing = self._active.get(job.key)
+        if existing is not None and not existing.finished:
+            existing.coalesced += 1
+            return existing, True
+
+        self.jobs[job.id] = job
+        self._active[job.key] = job
+        prune_finished(self.jobs)
+        if device_id not in self._queues:
+            self._queues[device_id] = asyncio.Queue()
+            self._workers[device_id] = asyncio.create_task(
+                self._worker(self._queues[device_id]), name=f"jobs-{device_id or 'process'}"
+            )
+        self._queues[device_id].put_nowait(job)
+        return job, False
+
+    async def run(self, kind, device_id, params, func):
+        """Como `submit`, pero espera a que el trabajo termine y lo devuelve"""
+        job, _ = self.submit(kind, device_id, params, func)
+        await job.wait()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, device_id=None, kind=None):
+        return [
+            job for job in reversed(self.jobs.values())
+            if (device_id is None or job.device_id == device_id) and (kind is None or job.kind == kind)
+        ]
+
+    async def shutdown(self):
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for job in self.jobs.values():
+            if not job.finished:
+                job._set(status="cancelled", error="Backend detenido",
+                         finished_at=datetime.now().isoformat())
+        self._queues.clear()
+        self._workers.clear()
+
+    async def _worker(self, queue):
+        while True:
+            job = await queue.get()
+            job._set(status="running", started_at=datetime.now().isoformat())
+            try:
+                result = await job.func()
+            except asyncio.CancelledError:
+                job._set(status="cancelled", finished_at=datetime.now().isoformat())
+                raise
+            except Exception as e:
+                # HTTPException y errores del ESP32 se informan en el trabajo
+                job._set(
+                    status="failed",
+                    error=getattr(e, "detail", None) or str(e) or type(e).__name__,
+                    status_code=getattr(e, "status_code", 500),
+                    finished_at=datetime.now().isoformat(),
+                )
+            else:
+                job._set(
+                    status="succeeded",
+                    result=result,
+                    status_code=200,
+                    finished_at=datetime.now().isoformat(),
+                )
+            finally:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+            logger.info("Trabajo %s (%s) terminado: %s", job.id, job.kind, job.status)
+
+
+async def job_events(job):
+    """Generador SSE: un evento `job` por cada cambio hasta que termina"""
+    version = -1
+    while True:
+        if job.version > version:
+            version = job.version
+            yield format_event("job", job.to_dict(), version)
+            if job.finished:
+                return
+        elif not await job.wait_for_change(version, KEEPALIVE_SECONDS):
+            yield b": keepalive\n\n"
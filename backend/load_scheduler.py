@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Temporizador de eventos de control de la carga
+
+Los apagados programados, las cuentas atrás de TOGGLE_LOAD y el fin de una
+anulación manual son eventos con fecha en un montículo (heapq): la tarea
+duerme hasta el próximo vencimiento o hasta que se programe uno anterior,
+en lugar de despertar cada segundo para comparar horas.
+
+- Cada evento tiene una clave ("<tipo>:<dispositivo>"); programar otra vez
+  la misma clave reemplaza al anterior y cancelar es O(log n): la entrada
+  vieja se marca anulada y se descarta al llegar a la cima del montículo.
+- Los eventos pendientes se guardan en disco (escritura atómica). Un evento
+  vencido sigue guardado hasta que su manejador termina: si el proceso cae
+  a mitad, se vuelve a disparar al arrancar, y si el manejador lanza una
+  excepción se reintenta a los `RETRY_DELAY` segundos. Tras un reinicio,
+  los que vencieron con el backend parado se disparan enseguida y el
+  manejador decide si todavía tienen sentido.
+- Las fechas son de reloj de pared (time.time); la espera se limita a
+  `MAX_SLEEP` para notar ajustes de hora (NTP, cambio de horario).
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("load_scheduler")
+
+FORMAT_VERSION = 1
+
+# Espera máxima entre comprobaciones del reloj de pared (segundos)
+MAX_SLEEP = 60.0
+
+# Reintento de un evento cuyo manejador falló (segundos)
+RETRY_DELAY = 60.0
+
+
+def event_key(kind, device_id):
+    return f"{kind}:{device_id}"
+
+
+class LoadScheduler:
+    """
+    Montículo de eventos con fecha. `handler(event)` es una corrutina que
+    recibe {"key", "kind", "device_id", "due_at", "data"} al vencer.
+    """
+
+    def __init__(self, handler, path=None, clock=time.time):
+        self.handler = handler
+        self.path = path
+        self.clock = clock
+        self.fired = 0
+        self._heap = []
+        self._entries = {}
+        # Eventos vencidos cuyo manejador no ha terminado (siguen en disco)
+        self._firing = {}
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._task = None
+
+    # ------------------------------------------------------------------
+    # Eventos
+    # ------------------------------------------------------------------
+
+    def schedule(self, kind, device_id, due_at, **data):
+        """Programa (o reprograma) el evento `kind` del dispositivo"""
+        key = event_key(kind, device_id)
+        self._discard(key)
+        event = {"key": key, "kind": kind, "device_id": device_id, "due_at": due_at, "data": data}
+        entry = [due_at, next(self._counter), event]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        self._save()
+        # Solo hace falta despertar si el nuevo evento es el primero
+        if self._heap[0] is entry:
+            self._changed.set()
+        return event
+
+    def cancel(self, kind, device_id):
+        """Anula el evento; devuelve True si existía"""
+        if not self._discard(event_key(kind, device_id)):
+            return False
+        self._save()
+        return True
+
+    def get(self, kind, device_id):
+        entry = self._entries.get(event_key(kind, device_id))
+        return entry[2] if entry else None
+
+    def pending(self, device_id=None):
+        """Eventos pendientes en orden de vencimiento"""
+        return [
+            entry[2] for entry in sorted(self._entries.values())
+            if device_id is None or entry[2]["device_id"] == device_id
+        ]
+
+    def next_due(self):
+        self._drop_cancelled()
+        return self._heap[0][0] if self._heap else None
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        return True
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+
+    def load(self):
+        """Recupera los eventos pendientes de la ejecución anterior"""
+        if not self.path:
+            return 0
+        try:
+            with open(self.path, "rb") as f:
+                payload = json.loads(f.read())
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.warning("Eventos de carga ilegibles en %s: %s", self.path, e)
+            return 0
+        if payload.get("format") != FORMAT_VERSION:
+            logger.warning("Eventos de carga con formato desconocido en %s", self.path)
+            return 0
+        for event in payload.get("events", []):
+            entry = [event["due_at"], next(self._counter), event]
+            self._entries[event["key"]] = entry
+            heapq.heappush(self._heap, entry)
+        return len(self._entries)
+
+    def _save(self):
+        if not self.path:
+            return
+        unacknowledged = [event for key, event in self._firing.items() if key not in self._entries]
+        events = sorted(self.pending() + unacknowledged, key=lambda event: event["due_at"])
+        payload = {"format": FORMAT_VERSION, "events": events}
+        directory = os.path.dirname(self.path) or "."
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("No se pudieron guardar los eventos de carga: %s", e)
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="load-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            due_at = self.next_due()
+            timeout = None if due_at is None else min(max(0.0, due_at - self.clock()), MAX_SLEEP)
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._changed.clear()
+                continue
+            await self._fire_due()
+
+    async def _fire_due(self):
+        now = self.clock()
+        due = []
+        while self._heap and (self._heap[0][2] is None or self._heap[0][0] <= now):
+            entry = heapq.heappop(self._heap)
+            if entry[2] is not None:
+                del self._entries[entry[2]["key"]]
+                self._firing[entry[2]["key"]] = entry[2]
+                due.append(entry[2])
+        for event in due:
+            self.fired += 1
+            try:
+                await self.handler(event)
+            except asyncio.CancelledError:
+                raise  # sigue en disco: se dispara otra vez al arrancar
+            except Exception as e:
+                logger.warning("Error en el evento %s, reintento en %.0fs: %s", event["key"], RETRY_DELAY, e)
+                # Salvo que el manejador ya lo haya reprogramado
+                if event["key"] not in self._entries:
+                    self.schedule(event["kind"], event["device_id"], self.clock() + RETRY_DELAY, **event["data"])
+            del self._firing[event["key"]]
+            self._save()
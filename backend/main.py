@@ -0,0 +1,1489 @@
+#!/usr/bin/env python3
+"""
+API REST del cargador solar ESP32 (FastAPI)
+
+Expone los datos del ESP32, la configuración de parámetros, las
+configuraciones personalizadas y la programación de apagado de la carga.
+Toda la comunicación serie pasa por `ESP32Controller`.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+from custom_configurations import (
+    ConfigurationNotFound,
+    CustomConfigurationManager,
+    InvalidCursor,
+    content_hash,
+)
+from devices import Device, parse_devices
+from esp32_controller import (
+    CONFIGURABLE_PARAMETERS,
+    ESP32Controller,
+    ESP32Error,
+    ESP32NotConnected,
+    ESP32Timeout,
+    ReplayTransport,
+)
+from history_store import RESOLUTIONS
+from jobs import JobManager, job_events
+from load_scheduler import LoadScheduler
+from metrics import CONTENT_TYPE, ApiMetrics, MetricsMiddleware
+from response_cache import EncodedCache
+from rollout import RolloutManager
+from static_assets import StaticAssets
+from telemetry_stream import telemetry_events
+from validation import FIELD_LIMITS, ConfigurationInvalid, coerce_parameter, validate, validate_batch
+
+API_VERSION = "1.0.0"
+
+ESP32_PORT = os.getenv("ESP32_PORT", "/dev/ttyUSB0")
+ESP32_BAUDRATE = int(os.getenv("ESP32_BAUDRATE", "115200"))
+# Varios cargadores en un proceso: "id=puerto,id=puerto" (el primero es el
+# dispositivo por defecto de las rutas sin /devices/{id})
+ESP32_DEVICES = os.getenv("ESP32_DEVICES", "")
+# Usa el simulador en proceso en lugar del puerto serie (pruebas sin hardware)
+ESP32_SIMULATOR = os.getenv("ESP32_SIMULATOR", "false").lower() == "true"
+# Graba todo el tráfico serie en <dir>/<dispositivo>.serial (vacío = no graba)
+ESP32_RECORD_DIR = os.getenv("ESP32_RECORD_DIR", "")
+# Reproduce una grabación en lugar del puerto serie (incidencias sin hardware)
+ESP32_REPLAY = os.getenv("ESP32_REPLAY", "")
+ESP32_REPLAY_SPEED = float(os.getenv("ESP32_REPLAY_SPEED", "1"))
+# Lecturas en trama binaria compacta si el firmware la soporta (si no, texto)
+ESP32_BINARY_FRAMES = os.getenv("ESP32_BINARY_FRAMES", "true").lower() == "true"
+CONFIG_DB = os.getenv("CONFIG_DB", "configuraciones.db")
+# Archivo JSON de versiones anteriores, se migra a CONFIG_DB al arrancar
+CONFIG_FILE = os.getenv("CONFIG_FILE", "configuraciones.json")
+SCHEDULE_FILE = os.getenv("SCHEDULE_FILE", "schedule_config.json")
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+
+# Ritmo del muestreo de fondo y antigüedad máxima servida en /data/ (segundos)
+DATA_SAMPLE_INTERVAL = float(os.getenv("DATA_SAMPLE_INTERVAL", "2"))
+DATA_MAX_AGE = float(os.getenv("DATA_MAX_AGE", "3"))
+# Ritmo de muestreo mientras haya clientes en /data/stream y límite por cliente
+DATA_STREAM_INTERVAL = float(os.getenv("DATA_STREAM_INTERVAL", "0.5"))
+# Ritmo de muestreo de noche o sin sensor de panel (nada cambia deprisa)
+DATA_IDLE_INTERVAL = float(os.getenv("DATA_IDLE_INTERVAL", "10"))
+# Lectura completa (campos lentos incluidos) como mínimo cada tantos segundos
+ESP32_FULL_REFRESH_INTERVAL = float(os.getenv("ESP32_FULL_REFRESH_INTERVAL", "600"))
+STREAM_MAX_RATE = float(os.getenv("STREAM_MAX_RATE", "4"))
+# Antigüedad máxima del último estado leído para usarlo al diferenciar un apply
+APPLY_STATE_MAX_AGE = float(os.getenv("APPLY_STATE_MAX_AGE", "30"))
+# Historial de telemetría (segmentos mmap con agregados 1s/1min/1h)
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() == "true"
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+HISTORY_RETENTION_DAYS = {
+    "1s": int(os.getenv("HISTORY_RETENTION_RAW_DAYS", "35")),
+    "1min": int(os.getenv("HISTORY_RETENTION_1MIN_DAYS", "400")),
+    "1h": int(os.getenv("HISTORY_RETENTION_1H_DAYS", "3650")),
+}
+# Último estado conocido por dispositivo (se sirve obsoleto tras reiniciar)
+STATE_DIR = os.getenv("STATE_DIR", "state")
+STATE_SAVE_INTERVAL = float(os.getenv("STATE_SAVE_INTERVAL", "60"))
+# Frontend compilado (npm run build + static_assets.py); vacío = no se sirve
+FRONTEND_DIST = os.getenv("FRONTEND_DIST", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dist"))
+
+# Reintento de un apagado programado si el ESP32 no responde
+SCHEDULE_RETRY_SECONDS = 30.0
+MAX_LOAD_OFF_SECONDS = 12 * 3600
+
+# Sincronización de configuraciones en NDJSON
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+IMPORT_BATCH_SIZE = 500
+MAX_NDJSON_LINE = 1024 * 1024
+
+
+def process_started_at():
+    """Inicio del proceso en reloj monotónico (incluye intérprete e imports)"""
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime (campo 22) en ticks desde el arranque del sistema
+            started = int(f.read().rpartition(")")[2].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.monotonic() - max(0.0, uptime - started)
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+
+
+PROCESS_STARTED = process_started_at()
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("api")
+
+
+class AppState:
+    """Estado compartido del proceso"""
+
+    def __init__(self):
+        ports = parse_devices(ESP32_DEVICES, ESP32_PORT)
+        single = len(ports) == 1 and not ESP32_DEVICES
+        self.devices = {
+            device_id: Device(
+                device_id, port, DATA_SAMPLE_INTERVAL, DATA_MAX_AGE, DATA_STREAM_INTERVAL,
+                # Con un solo cargador el historial queda donde siempre
+                history_dir=(HISTORY_DIR if single else os.path.join(HISTORY_DIR, device_id))
+                if HISTORY_ENABLED else None,
+                history_retention=HISTORY_RETENTION_DAYS,
+                state_path=os.path.join(STATE_DIR, f"{device_id}.json") if STATE_DIR else None,
+                state_save_interval=STATE_SAVE_INTERVAL,
+                idle_interval=DATA_IDLE_INTERVAL,
+            )
+            for device_id, port in ports.items()
+        }
+        self.device = next(iter(self.devices.values()))
+        self.configurations = CustomConfigurationManager(CONFIG_DB, CONFIG_FILE)
+        self.jobs = JobManager()
+        self.rollouts = RolloutManager(self.jobs, self.apply_on_device)
+        # /health y /schedule codificados una vez por cambio
+        self.responses = EncodedCache()
+        self._assets = None
+        # Apagados programados, cuentas atrás y anulaciones manuales
+        self.load_scheduler = LoadScheduler(
+            self.fire_load_event, os.path.join(STATE_DIR, "load_events.json") if STATE_DIR else None
+        )
+        # Tiempos de arranque (segundos desde el inicio del proceso)
+        self.startup = {"import": None, "ready": None}
+
+    # Accesos al dispositivo por defecto (rutas sin /devices/{id})
+    @property
+    def controller(self) -> Optional[ESP32Controller]:
+        return self.device.controller
+
+    @controller.setter
+    def controller(self, controller):
+        self.device.controller = controller
+
+    @property
+    def sampler(self):
+        return self.device.sampler
+
+    @property
+    def history(self):
+        return self.device.history
+
+    @property
+    def assets(self):
+        """Índice del frontend compilado; se carga en la primera petición y tras cada build"""
+        if self._assets is not None and self._assets.outdated:
+            self._assets = None
+        if self._assets is None and FRONTEND_DIST and os.path.isdir(FRONTEND_DIST):
+            self._assets = StaticAssets(FRONTEND_DIST)
+            logger.info("Frontend servido desde %s (%d archivos)", FRONTEND_DIST, len(self._assets.files))
+        return self._assets
+
+    async def apply_on_device(self, device_id, name):
+        return await apply_to_device(self.devices[device_id], name)
+
+    async def fire_load_event(self, event):
+        return await fire_load_event(event)
+
+
+state = AppState()
+metrics = ApiMetrics()
+
+
+def cache_hit_ratio(sampler):
+    total = sampler.hits + sampler.reads
+    return sampler.hits / total if total else math.nan
+
+
+def per_device(func):
+    """Valor de una métrica instantánea para cada dispositivo con controlador"""
+    return lambda: {
+        (device.id,): func(device) for device in state.devices.values() if device.controller
+    }
+
+
+# Valores instantáneos: solo se calculan al consultar /metrics
+metrics.gauge("charger_esp32_connected", "1 si el ESP32 está conectado",
+              per_device(lambda d: d.connected), labelnames=("device",))
+metrics.gauge("charger_serial_queue_depth", "Comandos esperando turno en el puerto serie",
+              per_device(lambda d: d.controller.queue_depth), labelnames=("device",))
+metrics.gauge("charger_serial_in_flight", "Comandos enviados esperando respuesta",
+              per_device(lambda d: d.controller.in_flight), labelnames=("device",))
+metrics.gauge("charger_data_cache_hits_total", "Peticiones de /data/ servidas desde la instantánea",
+              per_device(lambda d: d.sampler.hits), labelnames=("device",), type="counter")
+metrics.gauge("charger_data_stale_responses_total",
+              "Peticiones servidas con el último estado conocido (ESP32 sin responder)",
+              per_device(lambda d: d.sampler.stale_hits), labelnames=("device",), type="counter")
+metrics.gauge("charger_data_device_reads_total", "Lecturas GET_DATA hechas al ESP32",
+              per_device(lambda d: d.sampler.reads), labelnames=("device",), type="counter")
+metrics.gauge("charger_data_cache_hit_ratio", "Proporción de lecturas de /data/ servidas desde caché",
+              per_device(lambda d: cache_hit_ratio(d.sampler)), labelnames=("device",))
+metrics.gauge("charger_data_snapshot_age_seconds", "Antigüedad de la última lectura del ESP32",
+              per_device(lambda d: d.sampler.age), labelnames=("device",))
+metrics.gauge("charger_stream_subscribers", "Clientes conectados a /data/stream",
+              per_device(lambda d: d.sampler.subscribers), labelnames=("device",))
+metrics.gauge("charger_encoded_response_hits_total",
+              "Respuestas de /health y /schedule servidas con bytes ya codificados",
+              lambda: state.responses.hits, type="counter")
+metrics.gauge("charger_load_events_pending", "Eventos de control de carga programados",
+              lambda: len(state.load_scheduler.pending()))
+metrics.gauge("charger_sampling_interval_seconds", "Intervalo actual del muestreo de fondo",
+              per_device(lambda d: d.sampler.delay), labelnames=("device",))
+metrics.gauge("charger_esp32_reads_total", "Lecturas del ESP32 por tipo (fast: solo campos rápidos)",
+              lambda: {
+                  (device_id, kind): getattr(device.controller, f"{kind}_reads")
+                  for device_id, device in state.devices.items() if device.controller is not None
+                  for kind in ("fast", "full")
+              },
+              labelnames=("device", "kind"), type="counter")
+
+
+def startup_phases():
+    return {(phase,): seconds for phase, seconds in state.startup.items() if seconds is not None}
+
+
+def first_connect_seconds(device):
+    connected_at = device.controller.first_connected_at
+    return None if connected_at is None else connected_at - PROCESS_STARTED
+
+
+metrics.gauge("charger_startup_seconds",
+              "Segundos desde el inicio del proceso hasta cada fase (import, ready)",
+              startup_phases, labelnames=("phase",))
+metrics.gauge("charger_esp32_first_connect_seconds",
+              "Segundos desde el inicio del proceso hasta la primera conexión con el ESP32",
+              per_device(first_connect_seconds), labelnames=("device",))
+
+
+def create_controller(port, device_id=None):
+    transport = None
+    if ESP32_REPLAY:
+        transport = ReplayTransport(ESP32_REPLAY, ESP32_REPLAY_SPEED)
+        logger.info("Reproduciendo %s (x%g) para %s", ESP32_REPLAY, ESP32_REPLAY_SPEED, port)
+    elif ESP32_SIMULATOR:
+        from esp32_simulator import SimulatedTransport
+
+        transport = SimulatedTransport()
+        logger.info("Usando el simulador del ESP32 para %s", port)
+    record_path = None
+    if ESP32_RECORD_DIR and not ESP32_REPLAY:
+        record_path = os.path.join(ESP32_RECORD_DIR, f"{device_id or 'default'}.serial")
+    return ESP32Controller(port, ESP32_BAUDRATE, transport=transport, binary_frames=ESP32_BINARY_FRAMES,
+                           full_refresh_interval=ESP32_FULL_REFRESH_INTERVAL, record_path=record_path)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    devices = list(state.devices.values())
+    for device in devices:
+        if device.controller is None:
+            device.controller = create_controller(device.port, device.id)
+        observer = metrics.serial_observer(device.id)
+        if observer not in device.controller.observers:
+            device.controller.observers.append(observer)
+    # Cada dispositivo tiene sus propias tareas de E/S; arrancan en paralelo
+    await asyncio.gather(*(device.start() for device in devices))
+    state.load_scheduler.load()
+    for device in devices:
+        sync_schedule(device)
+    await state.load_scheduler.start()
+    state.startup["ready"] = round(time.monotonic() - PROCESS_STARTED, 3)
+    logger.info("API lista en %.3fs (ESP32 conectando en segundo plano)", state.startup["ready"])
+    try:
+        yield
+    finally:
+        await state.load_scheduler.stop()
+        await state.rollouts.shutdown()
+        await state.jobs.shutdown()
+        await asyncio.gather(*(device.stop() for device in devices))
+
+
+app = FastAPI(
+    title="ESP32 Solar Charger API",
+    version=API_VERSION,
+    lifespan=lifespan,
+)
+
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+# Rutas de un cargador: se publican en la raíz (dispositivo por defecto) y
+# bajo /devices/{device_id} (ver el final del módulo)
+device_router = APIRouter()
+
+
+# ----------------------------------------------------------------------
+# Modelos
+# ----------------------------------------------------------------------
+
+class ParameterRequest(BaseModel):
+    parameter: str
+    value: Any
+
+
+def limited(parameter):
+    """Campo opcional con los rangos absolutos de validation.FIELD_LIMITS"""
+    low, high, low_inclusive = FIELD_LIMITS[parameter]
+    return Field(None, le=high, **({"ge": low} if low_inclusive else {"gt": low}))
+
+
+class CustomConfiguration(BaseModel):
+    """Configuración personalizada; todos los campos son opcionales para validar parciales"""
+
+    model_config = ConfigDict(extra="ignore")
+
+    batteryCapacity: Optional[float] = limited("batteryCapacity")
+    isLithium: Optional[bool] = None
+    thresholdPercentage: Optional[float] = limited("thresholdPercentage")
+    maxAllowedCurrent: Optional[float] = limited("maxAllowedCurrent")
+    bulkVoltage: Optional[float] = limited("bulkVoltage")
+    absorptionVoltage: Optional[float] = limited("absorptionVoltage")
+    floatVoltage: Optional[float] = limited("floatVoltage")
+    useFuenteDC: Optional[bool] = None
+    fuenteDC_Amps: Optional[float] = limited("fuenteDC_Amps")
+    factorDivider: Optional[int] = limited("factorDivider")
+    createdAt: Optional[str] = None
+    updatedAt: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_battery_rules(self):
+        # Ventanas por química y reglas cruzadas (validation.py)
+        validate(self.parameters())
+        return self
+
+    def parameters(self):
+        """Solo los parámetros configurables presentes"""
+        return {
+            name: value for name, value in self.model_dump().items()
+            if name in CONFIGURABLE_PARAMETERS and value is not None
+        }
+
+
+class BulkConfigurationsRequest(BaseModel):
+    configurations: dict[str, CustomConfiguration]
+    overwrite: bool = True
+
+
+class BatchValidationRequest(BaseModel):
+    # Sin tipar por campo: cada configuración se valida con las tablas de reglas
+    configurations: dict[str, Any]
+
+
+class BulkDeleteRequest(BaseModel):
+    names: list[str] = []
+    keywords: list[str] = []
+
+
+class ScheduleRequest(BaseModel):
+    enabled: bool
+    shutdown_time: Optional[str] = Field(None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+    startup_time: Optional[str] = Field(None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+
+
+class ToggleLoadRequest(BaseModel):
+    hours: int = Field(0, ge=0, le=12)
+    minutes: int = Field(0, ge=0, le=59)
+    seconds: int = Field(0, ge=0, le=59)
+
+
+class RolloutRequest(BaseModel):
+    configuration: str = Field(..., min_length=1)
+    # Sin lista se despliega a todos los dispositivos
+    devices: Optional[list[str]] = None
+    canary: list[str] = Field(default_factory=list)
+    concurrency: int = Field(4, ge=1, le=64)
+    retries: int = Field(2, ge=0, le=10)
+    retry_delay: float = Field(1.0, ge=0, le=60)
+
+
+# ----------------------------------------------------------------------
+# Utilidades
+# ----------------------------------------------------------------------
+
+def current_device(request: Request) -> Device:
+    """Dispositivo de la ruta: el de /devices/{device_id} o el por defecto"""
+    device_id = request.path_params.get("device_id")
+    if device_id is None:
+        return state.device
+    device = state.devices.get(device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"Dispositivo '{device_id}' no encontrado")
+    return device
+
+
+def get_controller(device=None):
+    device = device or state.device
+    if not device.connected:
+        raise HTTPException(status_code=503, detail="ESP32 no conectado")
+    return device.controller
+
+
+async def get_esp32_data(max_age=None, device=None, allow_stale=False, full=False):
+    """
+    Estado del ESP32 desde la instantánea compartida. Con `allow_stale`, si
+    el ESP32 no responde se devuelve la última conocida con `stale: true`.
+    `full` fuerza una lectura completa en lugar de la trama rápida.
+    """
+    device = device or state.device
+    try:
+        return await device.sampler.get(max_age, allow_stale, full)
+    except ESP32NotConnected:
+        raise HTTPException(status_code=503, detail="ESP32 no conectado")
+    except ESP32Error as e:
+        raise HTTPException(status_code=500, detail=f"Error de comunicación: {e}")
+
+
+def wants_job(request: Request, run_async: bool):
+    """El cliente pidió la operación como trabajo (?async=true o Prefer: respond-async)"""
+    return run_async or "respond-async" in request.headers.get("prefer", "").lower()
+
+
+def submit_job(kind, device_id, params, func):
+    """Encola la operación y responde 202 con el id del trabajo"""
+    job, coalesced = state.jobs.submit(kind, device_id, params, func)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "coalesced": coalesced,
+            "status_url": f"/jobs/{job.id}",
+            "events_url": f"/jobs/{job.id}/events",
+        },
+        headers={"Location": f"/jobs/{job.id}", "Preference-Applied": "respond-async"},
+    )
+
+
+def same_value(current, target):
+    if current is None:
+        return False
+    if isinstance(target, bool) or isinstance(current, bool):
+        return bool(current) == bool(target)
+    try:
+        return math.isclose(float(current), float(target), rel_tol=1e-6, abs_tol=1e-3)
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_time(value, default):
+    """Acepta epoch en segundos o fecha ISO; devuelve epoch"""
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Fecha inválida: {value}")
+
+
+def validation_error(e):
+    errors = e.errors() if hasattr(e, "errors") else [{"msg": str(e)}]
+    return HTTPException(status_code=422, detail=[
+        {"loc": err.get("loc", []), "msg": err.get("msg", ""), "type": err.get("type", "value_error")}
+        for err in errors
+    ])
+
+
+# ----------------------------------------------------------------------
+# Salud y datos
+# ----------------------------------------------------------------------
+
+@app.get("/health")
+async def health(request: Request):
+    """Se codifica como mucho una vez por segundo o al cambiar una conexión"""
+    connected = tuple(device.connected for device in state.devices.values())
+    key = (int(time.time()), connected, state.startup["ready"])
+
+    def build():
+        return {
+            "status": "healthy",
+            "esp32_connected": state.device.connected,
+            "devices": {device.id: device.connected for device in state.devices.values()},
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "version": API_VERSION,
+            "startup_seconds": state.startup["ready"],
+            "uptime_seconds": round(time.monotonic() - PROCESS_STARTED, 3),
+        }
+
+    return state.responses.get("health", key, build).response(request)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+
+@device_router.get("/data/")
+async def get_data(
+    request: Request,
+    max_age: Optional[float] = Query(None, ge=0),
+    full: bool = Query(False),
+    device: Device = Depends(current_device),
+):
+    """
+    Estado actual del ESP32. Varios clientes comparten la misma lectura;
+    `max_age` permite pedir una instantánea más reciente que DATA_MAX_AGE y
+    `full=true` relee también los campos de configuración en el momento.
+    Si el ESP32 no responde se sirve la última conocida con `stale: true`.
+    """
+    await get_esp32_data(max_age, device, allow_stale=True, full=full)
+    # La misma instantánea se sirve con los mismos bytes hasta la siguiente
+    return device.sampler.encoded().response(request)
+
+
+@device_router.get("/data/stream")
+async def stream_data(max_rate: float = Query(1.0, gt=0), device: Device = Depends(current_device)):
+    """
+    Telemetría por Server-Sent Events: instantánea completa al conectar y
+    luego deltas por campo, como máximo `max_rate` frames por segundo.
+    """
+    return StreamingResponse(
+        telemetry_events(device.sampler, min(max_rate, STREAM_MAX_RATE)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ----------------------------------------------------------------------
+# Historial de telemetría
+# ----------------------------------------------------------------------
+
+@device_router.get("/history")
+async def get_history(
+    fields: str = Query("estimatedSOC,netCurrent,temperature"),
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    resolution: Optional[str] = Query(None),
+    max_points: int = Query(1000, ge=1, le=100000),
+    device: Device = Depends(current_device),
+):
+    """
+    Serie temporal de la telemetría. `start`/`end` en epoch o ISO (por defecto
+    las últimas 24h); sin `resolution` se elige la más fina que no supere
+    `max_points` filas.
+    """
+    if device.history is None:
+        raise HTTPException(status_code=503, detail="Historial deshabilitado")
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Resolución inválida: {resolution}")
+    end_ts = parse_time(end, time.time())
+    start_ts = parse_time(start, end_ts - 86400)
+    try:
+        # La consulta usa sus propios mapeos: puede correr junto al escritor
+        return await asyncio.to_thread(
+            device.history.query,
+            [f.strip() for f in fields.split(",") if f.strip()],
+            start_ts, end_ts, resolution, max_points,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@device_router.get("/history/report")
+async def get_history_report(
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    temp_threshold: Optional[float] = Query(None),
+    absorption_hours: Optional[float] = Query(None, gt=0),
+    device: Device = Depends(current_device),
+):
+    """
+    Reporte diario: horas por etapa de carga, Ah de entrada/salida, horas de
+    absorción frente a las esperadas, excursiones de temperatura y SOC. Por
+    defecto cubre los últimos 7 días y toma `tempThreshold` y
+    `calculatedAbsorptionHours` del último estado del ESP32.
+    """
+    if device.history is None:
+        raise HTTPException(status_code=503, detail="Historial deshabilitado")
+    end_ts = parse_time(end, time.time())
+    start_ts = parse_time(start, end_ts - 7 * 86400)
+    if end_ts < start_ts:
+        raise HTTPException(status_code=400, detail="El fin del rango es anterior al inicio")
+    snapshot = device.sampler.snapshot or {}
+    if temp_threshold is None:
+        temp_threshold = float(snapshot.get("tempThreshold", 40))
+    if absorption_hours is None:
+        absorption_hours = snapshot.get("calculatedAbsorptionHours")
+    # NumPy solo se importa la primera vez que se pide un reporte
+    from analytics import AnalyticsUnavailable, daily_report
+
+    try:
+        # Las pasadas de NumPy liberan el GIL; no bloquear el event loop
+        return await asyncio.to_thread(
+            daily_report, device.history, start_ts, end_ts, temp_threshold, absorption_hours
+        )
+    except AnalyticsUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+# ----------------------------------------------------------------------
+# Configuración de parámetros
+# ----------------------------------------------------------------------
+
+@device_router.post("/config/parameter")
+async def set_parameter(request: ParameterRequest, device: Device = Depends(current_device)):
+    if request.parameter not in CONFIGURABLE_PARAMETERS:
+        raise HTTPException(status_code=400, detail=f"Parámetro desconocido: {request.parameter}")
+    try:
+        value = coerce_parameter(request.parameter, request.value)
+    except ConfigurationInvalid as e:
+        raise validation_error(e)
+
+    # Mismas reglas que el apply: el valor se valida junto al estado actual
+    # (química, floatVoltage < absorptionVoltage, corriente según capacidad)
+    current = await get_esp32_data(APPLY_STATE_MAX_AGE, device)
+    try:
+        validate({request.parameter: value}, current)
+    except ConfigurationInvalid as e:
+        raise validation_error(e)
+
+    controller = get_controller(device)
+    try:
+        success, response = await controller.set_parameter(request.parameter, value)
+    except ESP32Timeout:
+        success, response = False, None
+    except ESP32NotConnected:
+        raise HTTPException(status_code=503, detail="ESP32 no conectado")
+
+    if not success:
+        return JSONResponse(status_code=500, content={
+            "success": False,
+            "error": response or "Sin respuesta del ESP32",
+            "parameter": request.parameter,
+            "value": request.value,
+        })
+    device.sampler.update_fields({request.parameter: value})
+    return {
+        "success": True,
+        "esp32_response": response,
+        "parameter": request.parameter,
+        "value": request.value,
+    }
+
+
+# ----------------------------------------------------------------------
+# Configuraciones personalizadas
+# ----------------------------------------------------------------------
+
+@app.get("/config/custom/configurations")
+async def list_configurations(
+    search: Optional[str] = Query(None),
+    prefix: Optional[str] = Query(None),
+    is_lithium: Optional[bool] = Query(None),
+    min_capacity: Optional[float] = Query(None, ge=0),
+    max_capacity: Optional[float] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+):
+    """
+    Lista las configuraciones ordenadas por nombre. Con `limit` la respuesta
+    se pagina y `next_cursor` indica cómo pedir la página siguiente.
+    """
+    try:
+        configurations, total, next_cursor = state.configurations.page(
+            limit=limit, cursor=cursor, search=search, prefix=prefix,
+            is_lithium=is_lithium, min_capacity=min_capacity, max_capacity=max_capacity,
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    response = {"configurations": configurations, "total_count": total}
+    if limit is not None:
+        response["next_cursor"] = next_cursor
+    return response
+
+
+@app.get("/config/custom/configurations/info")
+async def configurations_info():
+    return state.configurations.info()
+
+
+@app.get("/config/custom/configurations/export")
+async def export_configurations():
+    configurations = state.configurations.list()
+    return {
+        "export_info": {
+            "total_configurations": len(configurations),
+            "exported_at": datetime.now().isoformat(),
+            "version": "1.0",
+            "revision": state.configurations.revision(),
+        },
+        "configurations": configurations,
+    }
+
+
+def ndjson_line(item):
+    return (json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+async def ndjson_lines(chunks):
+    """Líneas no vacías de un cuerpo NDJSON recibido por partes"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_NDJSON_LINE:
+            raise HTTPException(status_code=413, detail="Línea NDJSON demasiado larga")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+@app.get("/config/custom/configurations/export/stream")
+async def export_configurations_stream(since: Optional[int] = Query(None, ge=0)):
+    """
+    Exporta en NDJSON, un registro por línea con su hash de contenido. Con
+    `since` solo van los cambios (y borrados) posteriores a esa revisión; la
+    línea final trae la revisión a usar en la próxima sincronización.
+    """
+    configurations = state.configurations
+    revision = configurations.revision()
+
+    async def lines():
+        yield ndjson_line({
+            "type": "header",
+            "since": since,
+            "revision": revision,
+            "exported_at": datetime.now().isoformat(),
+        })
+        count = 0
+        for record in configurations.changes(since, revision):
+            yield ndjson_line(record)
+            count += 1
+        yield ndjson_line({"type": "end", "count": count, "revision": revision})
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE,
+                             headers={"X-Configurations-Revision": str(revision)})
+
+
+@app.post("/config/custom/configurations/import/stream")
+async def import_configurations_stream(request: Request, overwrite: bool = Query(False)):
+    """
+    Importa NDJSON (el formato de export/stream) a medida que llega. Los
+    registros idénticos a los guardados no se reescriben; los inválidos se
+    informan por línea sin detener la importación. Los borrados solo se
+    aplican con `overwrite`.
+    """
+    result = {"imported": [], "unchanged": [], "skipped": [], "deleted": []}
+    errors, batch = [], []
+    complete = False
+
+    def flush():
+        for key, names in state.configurations.import_records(batch, overwrite).items():
+            result[key].extend(names)
+        batch.clear()
+
+    line_number = 0
+    async for line in ndjson_lines(request.stream()):
+        line_number += 1
+        try:
+            item = json.loads(line)
+            kind = item.get("type", "configuration")
+        except (ValueError, AttributeError):
+            errors.append({"line": line_number, "error": "JSON inválido"})
+            continue
+        if kind == "header":
+            continue
+        if kind == "end":
+            complete = True
+            continue
+        name = item.get("name")
+        if not isinstance(name, str) or not name:
+            errors.append({"line": line_number, "error": "Falta 'name'"})
+            continue
+        if kind == "deleted":
+            batch.append((name, None))
+        elif kind == "configuration":
+            config = item.get("configuration")
+            if not isinstance(config, dict):
+                errors.append({"line": line_number, "name": name, "error": "Falta 'configuration'"})
+                continue
+            if item.get("hash") and item["hash"] != content_hash(config):
+                errors.append({"line": line_number, "name": name, "error": "El hash no coincide con el contenido"})
+                continue
+            try:
+                batch.append((name, CustomConfiguration(**config).model_dump(exclude_none=True)))
+            except (TypeError, ValueError) as e:
+                errors.append({"line": line_number, "name": name, "error": str(e)})
+                continue
+        else:
+            errors.append({"line": line_number, "name": name, "error": f"Tipo desconocido: {kind}"})
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+    return {
+        "status": "success" if not errors else "partial",
+        "complete": complete,
+        "imported": result["imported"],
+        "deleted": result["deleted"],
+        "skipped": result["skipped"],
+        "total_imported": len(result["imported"]),
+        "total_unchanged": len(result["unchanged"]),
+        "errors": errors,
+        "revision": state.configurations.revision(),
+    }
+
+
+@app.post("/config/custom/configurations/import")
+async def import_configurations(payload: dict, overwrite: bool = Query(False)):
+    configurations = payload.get("configurations", payload)
+    if not isinstance(configurations, dict):
+        raise HTTPException(status_code=400, detail="Formato de importación inválido")
+    validated = {}
+    for name, config in configurations.items():
+        try:
+            validated[name] = CustomConfiguration(**config).model_dump(exclude_none=True)
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=422, detail=f"Configuración '{name}' inválida: {e}")
+    imported, skipped = state.configurations.import_configurations(validated, overwrite)
+    return {
+        "status": "success",
+        "imported": imported,
+        "skipped": skipped,
+        "total_imported": len(imported),
+    }
+
+
+@app.post("/config/custom/configurations/bulk")
+async def bulk_save_configurations(request: BulkConfigurationsRequest):
+    """Guarda N configuraciones en una sola transacción (todas o ninguna)"""
+    configurations = {
+        name: config.model_dump(exclude_none=True)
+        for name, config in request.configurations.items()
+    }
+    saved, skipped = state.configurations.import_configurations(configurations, request.overwrite)
+    return {
+        "status": "success",
+        "saved": saved,
+        "skipped": skipped,
+        "total_saved": len(saved),
+        "saved_at": datetime.now().isoformat(),
+    }
+
+
+@app.post("/config/custom/configurations/bulk/delete")
+async def bulk_delete_configurations(request: BulkDeleteRequest):
+    """Elimina por lista de nombres y/o palabras clave en una sola transacción"""
+    if not request.names and not request.keywords:
+        raise HTTPException(status_code=400, detail="Indica 'names' o 'keywords'")
+    deleted = state.configurations.delete_many(request.names, request.keywords)
+    return {
+        "status": "success",
+        "deleted": deleted,
+        "total_deleted": len(deleted),
+    }
+
+
+@app.post("/config/custom/configurations/validate")
+async def validate_configuration(config: CustomConfiguration):
+    return {
+        "valid": True,
+        "message": "Configuración válida",
+        "configuration": config.parameters(),
+    }
+
+
+@app.post("/config/custom/configurations/validate/batch")
+async def validate_configurations(request: BatchValidationRequest):
+    """Valida muchas configuraciones en una sola llamada; nunca responde 422"""
+    started = time.perf_counter()
+    results = validate_batch(request.configurations)
+    invalid = sum(1 for result in results.values() if not result["valid"])
+    return {
+        "total": len(results),
+        "valid": len(results) - invalid,
+        "invalid": invalid,
+        "results": results,
+        "processing_time": f"{time.perf_counter() - started:.4f}s",
+    }
+
+
+@app.get("/config/custom/configurations/{name}")
+@app.get("/config/custom/config/{name}", include_in_schema=False)
+async def get_configuration(name: str):
+    try:
+        return state.configurations.get(name)
+    except ConfigurationNotFound:
+        raise HTTPException(status_code=404, detail=f"Configuración '{name}' no encontrada")
+
+
+@app.post("/config/custom/configurations/{name}")
+@app.post("/config/custom/config/{name}", include_in_schema=False)
+async def save_configuration(name: str, config: CustomConfiguration):
+    saved_at = state.configurations.save(name, config.model_dump(exclude_none=True))
+    return {
+        "message": f"Configuración '{name}' creada exitosamente",
+        "status": "success",
+        "configuration_name": name,
+        "saved_at": saved_at,
+    }
+
+
+@app.delete("/config/custom/configurations/{name}")
+@app.delete("/config/custom/config/{name}", include_in_schema=False)
+async def delete_configuration(name: str):
+    try:
+        state.configurations.delete(name)
+    except ConfigurationNotFound:
+        raise HTTPException(status_code=404, detail=f"Configuración '{name}' no encontrada")
+    return {
+        "message": f"Configuración '{name}' eliminada exitosamente",
+        "status": "success",
+        "configuration_name": name,
+    }
+
+
+@device_router.post("/config/custom/configurations/{name}/apply")
+@device_router.post("/config/custom/config/{name}/apply", include_in_schema=False)
+async def apply_configuration(
+    name: str,
+    request: Request,
+    run_async: bool = Query(False, alias="async"),
+    device: Device = Depends(current_device),
+):
+    """
+    Aplica una configuración guardada en una sola transacción serie.
+
+    Solo se envían los parámetros que difieren del último estado conocido
+    del ESP32; los demás se informan como omitidos. Con `?async=true` (o
+    `Prefer: respond-async`) responde 202 y se ejecuta como trabajo.
+    """
+    if wants_job(request, run_async):
+        try:
+            state.configurations.get(name)
+        except ConfigurationNotFound:
+            raise HTTPException(status_code=404, detail=f"Configuración '{name}' no encontrada")
+        return submit_job("apply", device.id, {"configuration": name},
+                          lambda: apply_to_device(device, name))
+    return await apply_to_device(device, name)
+
+
+async def apply_to_device(device, name):
+    """Apply de una configuración en un cargador; lo usan el endpoint y los rollouts"""
+    started = time.monotonic()
+    try:
+        config = state.configurations.get(name)
+    except ConfigurationNotFound:
+        raise HTTPException(status_code=404, detail=f"Configuración '{name}' no encontrada")
+
+    target = {
+        parameter: coerce_parameter(parameter, config[parameter])
+        for parameter in CONFIGURABLE_PARAMETERS if config.get(parameter) is not None
+    }
+    controller = get_controller(device)
+
+    phase_started = time.monotonic()
+    current = await get_esp32_data(APPLY_STATE_MAX_AGE, device)
+    metrics.apply_phase.observe(time.monotonic() - phase_started, "read_state")
+    try:
+        # Con el estado actual se conoce la química y los campos que el perfil no trae
+        validate(target, current)
+    except ConfigurationInvalid as e:
+        raise validation_error(e)
+    changes = {
+        parameter: value for parameter, value in target.items()
+        if not same_value(current.get(parameter), value)
+    }
+
+    phase_started = time.monotonic()
+    try:
+        results = await controller.set_parameters_batch(changes)
+    except ESP32NotConnected:
+        raise HTTPException(status_code=503, detail="ESP32 no conectado")
+    metrics.apply_phase.observe(time.monotonic() - phase_started, "write")
+
+    esp32_responses = {}
+    for parameter, value in target.items():
+        if parameter in results:
+            success, response = results[parameter]
+            esp32_responses[parameter] = {"success": success, "esp32_response": response}
+        else:
+            esp32_responses[parameter] = {
+                "success": True,
+                "skipped": True,
+                "esp32_response": "Sin cambios: el ESP32 ya tiene este valor",
+            }
+
+    device.sampler.update_fields({
+        parameter: changes[parameter]
+        for parameter, (success, _) in results.items() if success
+    })
+
+    failed = [p for p, r in esp32_responses.items() if not r["success"]]
+    if not failed:
+        status = "success"
+        message = f"Configuración '{name}' aplicada exitosamente al ESP32"
+    elif len(failed) < len(esp32_responses):
+        status = "partial_success"
+        message = f"Configuración '{name}' aplicada parcialmente al ESP32"
+    else:
+        status = "error"
+        message = f"No se pudo aplicar la configuración '{name}' al ESP32"
+
+    return {
+        "message": message,
+        "status": status,
+        "configuration_name": name,
+        "device_id": device.id,
+        "esp32_responses": esp32_responses,
+        "applied_parameters": [p for p, r in esp32_responses.items() if r["success"]],
+        "summary": {
+            "total_parameters": len(esp32_responses),
+            "applied_successfully": len(esp32_responses) - len(failed),
+            "failed": len(failed),
+            "skipped": len(target) - len(changes),
+            "sent": len(changes),
+        },
+        "applied_at": datetime.now().isoformat(),
+        "time_total": f"{time.monotonic() - started:.6f}s",
+    }
+
+
+# ----------------------------------------------------------------------
+# Programación de apagado de la carga
+# ----------------------------------------------------------------------
+
+DEFAULT_SCHEDULE = {"enabled": False, "shutdown_time": "00:00", "startup_time": "06:00"}
+
+
+def schedule_path(device=None):
+    """Archivo del horario; el dispositivo por defecto usa SCHEDULE_FILE como siempre"""
+    if device is None or device is state.device:
+        return SCHEDULE_FILE
+    root, ext = os.path.splitext(SCHEDULE_FILE)
+    return f"{root}.{device.id}{ext or '.json'}"
+
+
+# Horarios leídos: {ruta: (mtime_ns, horario)}; basta un stat para reutilizarlos
+_schedules = {}
+
+
+def load_schedule(device=None):
+    path = schedule_path(device)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return dict(DEFAULT_SCHEDULE)
+    cached = _schedules.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                schedule = {**DEFAULT_SCHEDULE, **json.load(f)}
+            except ValueError:
+                schedule = dict(DEFAULT_SCHEDULE)
+        cached = _schedules[path] = (mtime, schedule)
+    return dict(cached[1])
+
+
+def save_schedule(schedule, device=None):
+    path = schedule_path(device)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(schedule, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def next_occurrence(hhmm, now):
+    hours, minutes = map(int, hhmm.split(":"))
+    candidate = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def schedule_is_active(schedule, now):
+    """La carga debe estar apagada entre shutdown_time y startup_time"""
+    if not schedule["enabled"]:
+        return False
+    current = now.strftime("%H:%M")
+    shutdown, startup = schedule["shutdown_time"], schedule["startup_time"]
+    if shutdown <= startup:
+        return shutdown <= current < startup
+    return current >= shutdown or current < startup
+
+
+def event_time(event):
+    return datetime.fromtimestamp(event["due_at"]).isoformat() if event else None
+
+
+def sync_schedule(device, now=None):
+    """
+    Programa el próximo apagado del dispositivo según su horario. Un evento
+    pendiente con las mismas horas se conserva (aunque haya vencido con el
+    backend parado: se dispara al arrancar); dentro de la ventana y sin
+    evento, el apagado se programa para ya.
+    """
+    scheduler = state.load_scheduler
+    schedule = load_schedule(device)
+    if not schedule["enabled"]:
+        scheduler.cancel("shutdown", device.id)
+        return None
+    times = {"shutdown_time": schedule["shutdown_time"], "startup_time": schedule["startup_time"]}
+    pending = scheduler.get("shutdown", device.id)
+    if pending is not None and pending["data"] == times:
+        return pending
+    now = now or datetime.now()
+    due = now if schedule_is_active(schedule, now) else next_occurrence(schedule["shutdown_time"], now)
+    return scheduler.schedule("shutdown", device.id, due.timestamp(), **times)
+
+
+async def fire_load_event(event):
+    """Manejador del temporizador de carga"""
+    device = state.devices.get(event["device_id"])
+    if device is None:
+        return
+    if event["kind"] == "shutdown":
+        await scheduled_shutdown(device)
+    elif event["kind"] == "load_on":
+        # Terminó la cuenta atrás de TOGGLE_LOAD: refleja la carga encendida
+        try:
+            await device.sampler.refresh()
+        except ESP32Error as e:
+            logger.debug("Lectura tras encender la carga de %s fallida: %s", device.id, e)
+    # "override" solo vence: al desaparecer el evento el horario vuelve a mandar
+
+
+async def scheduled_shutdown(device):
+    """Apaga la carga hasta startup_time y programa el apagado del día siguiente"""
+    scheduler = state.load_scheduler
+    schedule = load_schedule(device)
+    if not schedule["enabled"]:
+        return
+    times = {"shutdown_time": schedule["shutdown_time"], "startup_time": schedule["startup_time"]}
+    now = datetime.now()
+    if schedule_is_active(schedule, now) and scheduler.get("override", device.id) is None:
+        remaining = int((next_occurrence(schedule["startup_time"], now) - now).total_seconds())
+        # TOGGLE_LOAD admite hasta MAX_LOAD_OFF_SECONDS: una ventana más larga
+        # se cubre con varios comandos seguidos
+        off_seconds = min(remaining, MAX_LOAD_OFF_SECONDS)
+        try:
+            result = await toggle_load_on(device, off_seconds, manual=False)
+        except HTTPException as e:
+            result = {"success": False, "esp32_response": e.detail}
+        if not result["success"]:
+            logger.warning("Apagado programado de %s fallido (%s), reintento en %.0fs",
+                           device.id, result["esp32_response"], SCHEDULE_RETRY_SECONDS)
+            scheduler.schedule("shutdown", device.id, now.timestamp() + SCHEDULE_RETRY_SECONDS, **times)
+            return
+        logger.info("Carga de %s apagada por horario durante %ds", device.id, off_seconds)
+        if off_seconds < remaining:
+            scheduler.schedule("shutdown", device.id, now.timestamp() + off_seconds, **times)
+            return
+    scheduler.schedule("shutdown", device.id, next_occurrence(schedule["shutdown_time"], now).timestamp(), **times)
+
+
+@device_router.get("/schedule")
+async def get_schedule(request: Request, device: Device = Depends(current_device)):
+    schedule = load_schedule(device)
+    now = datetime.now()
+    override = state.load_scheduler.get("override", device.id)
+    load_on = state.load_scheduler.get("load_on", device.id)
+    # Las próximas horas solo cambian de minuto en minuto
+    key = (tuple(schedule.items()), now.strftime("%Y-%m-%dT%H:%M"),
+           override and override["due_at"], load_on and load_on["due_at"])
+
+    def build():
+        return {
+            **schedule,
+            "next_shutdown": next_occurrence(schedule["shutdown_time"], now).isoformat(),
+            "next_startup": next_occurrence(schedule["startup_time"], now).isoformat(),
+            "is_active": schedule_is_active(schedule, now),
+            "manual_override_active": override is not None,
+            "override_until": event_time(override),
+            "load_off_until": event_time(load_on),
+        }
+
+    return state.responses.get(f"schedule:{device.id}", key, build).response(request)
+
+
+@device_router.post("/schedule/set")
+async def set_schedule(
+    request: ScheduleRequest,
+    http_request: Request,
+    run_async: bool = Query(False, alias="async"),
+    device: Device = Depends(current_device),
+):
+    if wants_job(http_request, run_async):
+        return submit_job("schedule", device.id, request.model_dump(), lambda: update_schedule(request, device))
+    return await update_schedule(request, device)
+
+
+async def update_schedule(request, device):
+    schedule = load_schedule(device)
+    schedule["enabled"] = request.enabled
+    if request.shutdown_time:
+        schedule["shutdown_time"] = request.shutdown_time
+    if request.startup_time:
+        schedule["startup_time"] = request.startup_time
+    save_schedule(schedule, device)
+    sync_schedule(device)
+    return {
+        "success": True,
+        "message": "Horario configurado exitosamente",
+        "schedule": schedule,
+    }
+
+
+@device_router.post("/schedule/override/clear")
+async def clear_schedule_override(device: Device = Depends(current_device)):
+    """
+    Quita la anulación manual: el horario vuelve a mandar y, si la ventana
+    de apagado está en curso, la carga se apaga ahora
+    """
+    cleared = state.load_scheduler.cancel("override", device.id)
+    schedule = load_schedule(device)
+    if cleared and schedule_is_active(schedule, datetime.now()):
+        state.load_scheduler.schedule(
+            "shutdown", device.id, time.time(),
+            shutdown_time=schedule["shutdown_time"], startup_time=schedule["startup_time"],
+        )
+    return {
+        "success": True,
+        "message": "Anulación manual eliminada" if cleared else "No había anulación manual",
+        "cleared": cleared,
+    }
+
+
+# ----------------------------------------------------------------------
+# Acciones
+# ----------------------------------------------------------------------
+
+@device_router.post("/actions/toggle_load")
+async def toggle_load(
+    request: ToggleLoadRequest,
+    http_request: Request,
+    run_async: bool = Query(False, alias="async"),
+    device: Device = Depends(current_device),
+):
+    total_seconds = request.hours * 3600 + request.minutes * 60 + request.seconds
+    if not 0 < total_seconds <= MAX_LOAD_OFF_SECONDS:
+        raise HTTPException(status_code=400, detail="Duración inválida (1s - 12h)")
+    if wants_job(http_request, run_async):
+        return submit_job("toggle_load", device.id, {"duration_seconds": total_seconds},
+                          lambda: toggle_load_on(device, total_seconds))
+    return await toggle_load_on(device, total_seconds)
+
+
+async def toggle_load_on(device, total_seconds, manual=True):
+    """
+    Apaga la carga `total_seconds` y programa el fin de la cuenta atrás. Un
+    apagado manual anula el horario del dispositivo hasta el próximo
+    startup_time.
+    """
+    controller = get_controller(device)
+    try:
+        response = await controller.send_command(f"CMD:TOGGLE_LOAD:{total_seconds}")
+    except ESP32NotConnected:
+        raise HTTPException(status_code=503, detail="ESP32 no conectado")
+    except ESP32Timeout:
+        raise HTTPException(status_code=500, detail="Sin respuesta del ESP32")
+    if response.startswith("OK:"):
+        now = datetime.now()
+        state.load_scheduler.schedule("load_on", device.id, now.timestamp() + total_seconds)
+        schedule = load_schedule(device)
+        if manual and schedule["enabled"]:
+            until = next_occurrence(schedule["startup_time"], now)
+            state.load_scheduler.schedule("override", device.id, until.timestamp())
+    return {
+        "success": response.startswith("OK:"),
+        "esp32_response": response,
+        "duration_seconds": total_seconds,
+    }
+
+
+# ----------------------------------------------------------------------
+# Trabajos
+# ----------------------------------------------------------------------
+
+@app.get("/jobs")
+async def list_jobs(device_id: Optional[str] = Query(None), kind: Optional[str] = Query(None)):
+    return {"jobs": [job.to_dict() for job in state.jobs.list(device_id, kind)]}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{job_id}' no encontrado")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    """Cambios de estado del trabajo por Server-Sent Events hasta que termina"""
+    job = state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{job_id}' no encontrado")
+    return StreamingResponse(
+        job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ----------------------------------------------------------------------
+# Flota
+# ----------------------------------------------------------------------
+
+@app.get("/devices")
+async def list_devices():
+    return {
+        "default_device": state.device.id,
+        "devices": [device.describe() for device in state.devices.values()],
+    }
+
+
+@app.get("/fleet/summary")
+async def fleet_summary(max_age: Optional[float] = Query(None, ge=0)):
+    """Estado de todos los cargadores en una sola respuesta (lecturas en paralelo)"""
+    summaries = await asyncio.gather(
+        *(device.summary(max_age) for device in state.devices.values())
+    )
+    socs = [s["estimatedSOC"] for s in summaries if s.get("estimatedSOC") is not None]
+    charge_states = {}
+    for summary in summaries:
+        if summary.get("chargeState"):
+            charge_states[summary["chargeState"]] = charge_states.get(summary["chargeState"], 0) + 1
+    lowest = min(
+        (s for s in summaries if s.get("estimatedSOC") is not None),
+        key=lambda s: s["estimatedSOC"], default=None,
+    )
+    return {
+        "devices": summaries,
+        "totals": {
+            "devices": len(summaries),
+            "connected": sum(1 for s in summaries if s["connected"]),
+            "reporting": len(socs),
+            "charge_states": charge_states,
+            "soc": {
+                "avg": round(sum(socs) / len(socs), 2) if socs else None,
+                "min": lowest["estimatedSOC"] if lowest else None,
+                "min_device": lowest["device_id"] if lowest else None,
+                "max": max(socs) if socs else None,
+            },
+            "panel_current_mA": sum(s.get("panelToBatteryCurrent") or 0 for s in summaries),
+            "net_current_mA": sum(s.get("netCurrent") or 0 for s in summaries),
+        },
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+@app.post("/fleet/rollouts", status_code=202)
+async def create_rollout(request: RolloutRequest):
+    """
+    Despliega una configuración guardada a varios cargadores en segundo
+    plano. Devuelve el id del trabajo; el progreso se consulta en
+    GET /fleet/rollouts/{job_id}.
+    """
+    try:
+        state.configurations.get(request.configuration)
+    except ConfigurationNotFound:
+        raise HTTPException(
+            status_code=404, detail=f"Configuración '{request.configuration}' no encontrada"
+        )
+    try:
+        validate(state.configurations.get(request.configuration))
+    except ConfigurationInvalid as e:
+        raise validation_error(e)
+    device_ids = request.devices if request.devices is not None else list(state.devices)
+    unknown = [d for d in device_ids + request.canary if d not in state.devices]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Dispositivos desconocidos: {', '.join(unknown)}")
+    if not device_ids:
+        raise HTTPException(status_code=400, detail="No hay dispositivos para desplegar")
+    outside = [d for d in request.canary if d not in device_ids]
+    if outside:
+        raise HTTPException(status_code=400, detail=f"Canarios fuera del despliegue: {', '.join(outside)}")
+
+    job = state.rollouts.create(
+        request.configuration,
+        list(dict.fromkeys(device_ids)),
+        canary=request.canary,
+        concurrency=request.concurrency,
+        retries=request.retries,
+        retry_delay=request.retry_delay,
+    )
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/fleet/rollouts/{job.id}",
+        "total_devices": len(job.device_ids),
+    }
+
+
+@app.get("/fleet/rollouts")
+async def list_rollouts():
+    return {
+        "rollouts": [
+            {"job_id": job.id, "configuration": job.configuration, "status": job.status,
+             "progress": job.progress(), "created_at": job.created_at}
+            for job in state.rollouts.list()
+        ]
+    }
+
+
+@app.get("/fleet/rollouts/{job_id}")
+async def get_rollout(job_id: str):
+    job = state.rollouts.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Rollout '{job_id}' no encontrado")
+    return job.to_dict()
+
+
+@app.post("/fleet/rollouts/{job_id}/cancel")
+async def cancel_rollout(job_id: str):
+    job = state.rollouts.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Rollout '{job_id}' no encontrado")
+    return {"job_id": job.id, "status": job.status, "cancel_requested": not job.finished}
+
+
+app.include_router(device_router)
+app.include_router(device_router, prefix="/devices/{device_id}")
+
+
+@app.exception_handler(404)
+async def frontend(request: Request, exc: HTTPException):
+    """
+    Archivos de dist/; las rutas del SPA que piden HTML reciben index.html.
+
+    Solo atiende peticiones que no casan con ninguna ruta, después de la
+    redirección de la barra final (`GET /data` → `/data/`); los 404 que
+    lanza el propio API se devuelven tal cual.
+    """
+    assets = state.assets if "route" not in request.scope and request.method in ("GET", "HEAD") else None
+    asset = assets.lookup(request.url.path, request.headers.get("accept", "")) if assets else None
+    if asset is None:
+        return await http_exception_handler(request, exc)
+    return assets.response(request, asset)
+
+
+# Fin de la carga del módulo: FastAPI, rutas y modelos listos
+state.startup["import"] = round(time.monotonic() - PROCESS_STARTED, 3)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
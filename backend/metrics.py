@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Métricas del backend en formato de texto de Prometheus
+
+Los contadores e histogramas se actualizan en el camino caliente con una
+búsqueda binaria y un par de sumas, sin bloqueos (todo corre en el bucle de
+asyncio). Los valores instantáneos (profundidad de cola, aciertos de caché,
+etc.) se leen solo cuando alguien consulta /metrics.
+"""
+
+import bisect
+import functools
+import math
+import time
+
+# Cubre desde respuestas de caché (~1ms) hasta applies lentos (~30s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por bucket (no acumulados)..., +Inf, suma]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = self.buckets + (math.inf,)
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = (("le", _format_value(float(bound))),)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_format_value(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Gauge:
+    """
+    Valor que se calcula al consultar, a partir de una función. Con
+    `labelnames` la función devuelve {(etiquetas...): valor}.
+    """
+
+    def __init__(self, name, help, func, labelnames=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = tuple(labelnames)
+        self.type = type
+
+    def render(self):
+        try:
+            values = self.func()
+        except Exception:
+            values = {} if self.labelnames else None
+        if not self.labelnames:
+            values = {(): values}
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, func, labelnames=(), type="gauge"):
+        return self.register(Gauge(name, help, func, labelnames, type))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class ApiMetrics(Registry):
+    """Métricas de la API HTTP y del motor serie"""
+
+    def __init__(self):
+        super().__init__()
+        self.http_duration = self.histogram(
+            "charger_http_request_duration_seconds",
+            "Tiempo hasta el inicio de la respuesta HTTP",
+            ("method", "route"),
+        )
+        self.http_requests = self.counter(
+            "charger_http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status")
+        )
+        self.serial_wait = self.histogram(
+            "charger_serial_queue_wait_seconds",
+            "Espera de un comando hasta obtener turno en el puerto serie",
+            ("device", "command"),
+        )
+        self.serial_round_trip = self.histogram(
+            "charger_serial_round_trip_seconds",
+            "Tiempo que un comando ocupa la ventana serie hasta su respuesta",
+            ("device", "command"),
+        )
+        self.serial_commands = self.counter(
+            "charger_serial_commands_total",
+            "Comandos serie por resultado (ok, error, timeout, disconnected)",
+            ("device", "command", "outcome"),
+        )
+        self.apply_phase = self.histogram(
+            "charger_apply_phase_seconds", "Duración de cada fase de un apply", ("phase",)
+        )
+        self._serial_observers = {}
+
+    def serial_observer(self, device_id):
+        """Observador para ESP32Controller.observers (uno por dispositivo)"""
+        if device_id not in self._serial_observers:
+            self._serial_observers[device_id] = functools.partial(self.observe_serial, device_id)
+        return self._serial_observers[device_id]
+
+    def observe_serial(self, device_id, command, queue_wait, round_trip, outcome):
+        self.serial_wait.observe(queue_wait, device_id, command)
+        self.serial_commands.inc(device_id, command, outcome)
+        if outcome != "disconnected":
+            self.serial_round_trip.observe(round_trip, device_id, command)
+
+    def observe_request(self, method, route, status, duration):
+        self.http_duration.observe(duration, method, route)
+        self.http_requests.inc(method, route, str(status))
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide cada petición hasta el inicio de su respuesta"""
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        observed = False
+
+        async def send_wrapper(message):
+            nonlocal observed
+            if message["type"] == "http.response.start" and not observed:
+                observed = True
+                route = scope.get("route")
+                # Plantilla de la ruta para no crear una serie por cada nombre
+                path = getattr(route, "path", None) or "unmatched"
+                self.metrics.observe_request(
+                    scope["method"], path, message["status"], time.perf_counter() - started
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Respuestas JSON codificadas una sola vez
+
+Con muchos paneles abiertos, el coste de /data/, /health y /schedule en la
+placa es serializar el mismo dict una y otra vez, no la red. Un
+`EncodedBody` guarda los bytes JSON de un documento (y su ETag) y la
+variante gzip se comprime la primera vez que un cliente la pide. Todas las
+peticiones hasta el siguiente cambio reciben esos mismos bytes.
+"""
+
+import gzip
+import hashlib
+import json
+
+from fastapi.responses import Response
+
+# Por debajo de este tamaño gzip no compensa
+MIN_GZIP_SIZE = 512
+GZIP_LEVEL = 6
+
+
+def accepted_encodings(request):
+    """{codificación: q} de `Accept-Encoding`; q=0 significa rechazada"""
+    encodings = {}
+    for item in request.headers.get("accept-encoding", "").lower().split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings[coding] = q
+    return encodings
+
+
+def encoding_quality(encodings, coding):
+    """q de `coding` según `accepted_encodings`; `*` cubre las no nombradas"""
+    return encodings.get(coding, encodings.get("*", 0.0))
+
+
+def accepts_gzip(request):
+    return encoding_quality(accepted_encodings(request), "gzip") > 0
+
+
+def _opaque_tag(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(request, etag):
+    """
+    `If-None-Match` coincide con `etag`: acepta `*` y listas separadas por
+    comas, con comparación débil (W/"x" equivale a "x"), como pide RFC 9110
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    target = _opaque_tag(etag)
+    return any(_opaque_tag(candidate.strip()) == target for candidate in header.split(","))
+
+
+class EncodedBody:
+    """Bytes JSON inmutables de un documento, con ETag y variante gzip bajo demanda"""
+
+    __slots__ = ("body", "etag", "_gzip")
+
+    def __init__(self, document, etag=None):
+        # Mismo formato que JSONResponse
+        self.body = json.dumps(
+            document, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+        self.etag = etag or '"%s"' % hashlib.blake2b(self.body, digest_size=8).hexdigest()
+        self._gzip = None
+
+    @property
+    def gzip_etag(self):
+        # La variante comprimida tiene el mismo contenido: ETag débil, como nginx
+        return self.etag if self.etag.startswith("W/") else "W/" + self.etag
+
+    def gzipped(self):
+        if self._gzip is None:
+            self._gzip = gzip.compress(self.body, GZIP_LEVEL, mtime=0)
+        return self._gzip
+
+    def response(self, request, headers=None):
+        """Respuesta 200 (o 304 si `If-None-Match` coincide) con estos bytes"""
+        use_gzip = len(self.body) >= MIN_GZIP_SIZE and accepts_gzip(request)
+        etag = self.gzip_etag if use_gzip else self.etag
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding", **(headers or {})}
+        if etag_matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return Response(content=self.gzipped(), media_type="application/json", headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class EncodedCache:
+    """
+    Último documento codificado por nombre. `get` solo vuelve a construir y
+    codificar el documento cuando cambia la clave.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, name, key, build):
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.builds += 1
+        encoded = EncodedBody(build())
+        self._entries[name] = (key, encoded)
+        return encoded
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Despliegue de una configuración guardada a varios cargadores
+
+Un despliegue (rollout) es un trabajo en segundo plano: la API devuelve su
+identificador al instante y el progreso se consulta aparte. Los applies se
+reparten con un límite de concurrencia, cada cargador tiene sus reintentos
+con espera exponencial y, opcionalmente, primero se aplica a un grupo
+canario; si algún canario falla el resto no se toca.
+
+Cada apply es un trabajo "apply" en la cola del cargador (jobs.py): se
+ejecuta en orden con el resto de operaciones de ese cargador, nunca a la
+vez que otra, y se une a un apply idéntico que ya esté en cola.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+from datetime import datetime
+
+import jobs
+
+logger = logging.getLogger("rollout")
+
+FINISHED = jobs.FINISHED + ("halted",)
+
+
+class RolloutJob:
+    """Estado de un despliegue y de cada cargador dentro de él"""
+
+    def __init__(self, configuration, device_ids, canary=(), concurrency=4, retries=2, retry_delay=1.0):
+        self.id = jobs.new_job_id()
+        self.configuration = configuration
+        self.device_ids = list(device_ids)
+        self.canary = [d for d in self.device_ids if d in set(canary)]
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.status = "pending"
+        self.stage = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self.devices = {
+            device_id: {"status": "pending", "attempts": 0, "error": None, "summary": None,
+                        "started_at": None, "finished_at": None, "time_total": None}
+            for device_id in self.device_ids
+        }
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def progress(self):
+        counts = collections.Counter(result["status"] for result in self.devices.values())
+        total = len(self.devices)
+        done = sum(counts[s] for s in ("succeeded", "failed", "skipped", "cancelled"))
+        return {
+            "total": total,
+            **{status: counts[status] for status in
+               ("pending", "running", "succeeded", "failed", "skipped", "cancelled")},
+            "percent": round(100 * done / total, 1) if total else 100.0,
+        }
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "configuration": self.configuration,
+            "status": self.status,
+            "stage": self.stage,
+            "options": {
+                "canary": self.canary,
+                "concurrency": self.concurrency,
+                "retries": self.retries,
+                "retry_delay": self.retry_delay,
+            },
+            "progress": self.progress(),
+            "devices": self.devices,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class RolloutManager:
+    """
+    Ejecuta despliegues con `apply_func(device_id, configuration)`, que
+    devuelve la respuesta del endpoint de apply (con "status") o lanza. Cada
+    llamada se encola como trabajo del cargador en `device_jobs` (JobManager).
+    """
+
+    def __init__(self, device_jobs, apply_func):
+        self.device_jobs = device_jobs
+        self.apply_func = apply_func
+        self.jobs = collections.OrderedDict()
+
+    def create(self, configuration, device_ids, **options):
+        job = RolloutJob(configuration, device_ids, **options)
+        self.jobs[job.id] = job
+        jobs.prune_finished(self.jobs)
+        job.task = asyncio.create_task(self._run(job), name=f"rollout-{job.id}")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        return list(reversed(self.jobs.values()))
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and not job.finished and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def shutdown(self):
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+
+    async def _run(self, job):
+        job.status = "running"
+        job.started_at = datetime.now().isoformat()
+        rest = [d for d in job.device_ids if d not in job.canary]
+        try:
+            if job.canary:
+                job.stage = "canary"
+                await self._run_stage(job, job.canary)
+                if any(job.devices[d]["status"] != "succeeded" for d in job.canary):
+                    logger.warning("Rollout %s detenido: falló el grupo canario", job.id)
+                    self._mark(job, rest, "skipped")
+                    job.status = "halted"
+                    return
+            job.stage = "rollout"
+            await self._run_stage(job, rest)
+            failed = any(result["status"] == "failed" for result in job.devices.values())
+            job.status = "failed" if failed else "succeeded"
+        except asyncio.CancelledError:
+            self._mark(job, job.device_ids, "cancelled", only=("pending", "running"))
+            job.status = "cancelled"
+        finally:
+            job.finished_at = datetime.now().isoformat()
+            logger.info("Rollout %s de '%s': %s", job.id, job.configuration, job.status)
+
+    async def _run_stage(self, job, device_ids):
+        window = asyncio.Semaphore(job.concurrency)
+
+        async def run_one(device_id):
+            async with window:
+                await self._apply_device(job, device_id)
+
+        await asyncio.gather(*(run_one(device_id) for device_id in device_ids))
+
+    async def _apply_device(self, job, device_id):
+        result = job.devices[device_id]
+        result["status"] = "running"
+        result["started_at"] = datetime.now().isoformat()
+        started = time.monotonic()
+        for attempt in range(job.retries + 1):
+            if attempt:
+                await asyncio.sleep(job.retry_delay * 2 ** (attempt - 1))
+            result["attempts"] = attempt + 1
+            apply_job = await self.device_jobs.run(
+                "apply", device_id, {"configuration": job.configuration},
+                lambda: self.apply_func(device_id, job.configuration),
+            )
+            if apply_job.status != "succeeded":
+                result["error"] = apply_job.error or apply_job.status
+                continue
+            response = apply_job.result
+            result["summary"] = response.get("summary")
+            if response.get("status") == "success":
+                result["status"] = "succeeded"
+                result["error"] = None
+                break
+            result["error"] = response.get("message")
+        else:
+            result["status"] = "failed"
+        result["finished_at"] = datetime.now().isoformat()
+        result["time_total"] = f"{time.monotonic() - started:.3f}s"
+
+    @staticmethod
+    def _mark(job, device_ids, status, only=("pending",)):
+        for device_id in device_ids:
+            if job.devices[device_id]["status"] in only:
+                job.devices[device_id]["status"] = status
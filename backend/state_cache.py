@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Último estado conocido de un cargador, persistido en disco
+
+Cada dispositivo guarda su última instantánea de /data/ y una suma de
+comprobación por parámetro configurable en un archivo JSON compacto. La
+escritura es atómica (archivo temporal + fsync + rename), así que un corte
+de luz deja el archivo anterior o el nuevo, nunca uno a medias.
+
+Al reiniciar el backend la instantánea se sirve marcada como obsoleta hasta
+la primera lectura real, y las sumas permiten saber qué parámetros cambiaron
+mientras el backend no estaba. También se guarda la suma de configuración
+del firmware: si al reconectar no cambió, no hace falta una lectura completa.
+"""
+
+import json
+import logging
+import os
+import threading
+import zlib
+
+from esp32_controller import CONFIGURABLE_PARAMETERS
+
+logger = logging.getLogger("state_cache")
+
+FORMAT_VERSION = 1
+
+
+def parameter_checksums(data):
+    """{parámetro: crc32} de los parámetros configurables presentes en `data`"""
+    return {
+        parameter: "%08x" % zlib.crc32(json.dumps(data[parameter]).encode())
+        for parameter in CONFIGURABLE_PARAMETERS if parameter in data
+    }
+
+
+def changed_parameters(previous, current):
+    """Parámetros cuya suma difiere (o que aparecen o desaparecen)"""
+    return sorted(p for p in previous.keys() | current.keys() if previous.get(p) != current.get(p))
+
+
+class StateCache:
+    """Archivo de último estado conocido de un dispositivo"""
+
+    def __init__(self, path):
+        self.path = path
+        self.saves = 0
+        # El guardado periódico corre en un hilo y puede coincidir con el
+        # final al detener el dispositivo: comparten el archivo temporal
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Devuelve {"snapshot", "checksums", "config_checksum", "saved_at"} o None si no hay uno válido"""
+        try:
+            with open(self.path, "rb") as f:
+                payload = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Estado persistido ilegible en %s: %s", self.path, e)
+            return None
+        if payload.get("format") != FORMAT_VERSION or not isinstance(payload.get("snapshot"), dict):
+            logger.warning("Estado persistido con formato desconocido en %s", self.path)
+            return None
+        return payload
+
+    def save(self, snapshot, checksums, saved_at, config_checksum=None):
+        with self._lock:
+            self._write(snapshot, checksums, saved_at, config_checksum)
+
+    def _write(self, snapshot, checksums, saved_at, config_checksum):
+        payload = {
+            "format": FORMAT_VERSION,
+            "saved_at": saved_at,
+            "checksums": checksums,
+            "config_checksum": config_checksum,
+            "snapshot": snapshot,
+        }
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if hasattr(os, "O_DIRECTORY"):
+            # El rename también debe llegar al disco
+            fd = os.open(directory, os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.saves += 1
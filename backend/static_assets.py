@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Frontend compilado (dist/) servido por el propio backend
+
+En build (`build.sh`), después de `vite build`:
+    python backend/static_assets.py dist
+comprime cada archivo de texto en .gz (y .br si está instalado el paquete
+brotli) con el nivel máximo y escribe dist/asset-manifest.json con el
+tamaño, el ETag y las variantes de cada archivo. En ejecución no se
+comprime nada.
+
+Al servir:
+- El índice de archivos se carga en memoria (del manifiesto, o recorriendo
+  dist/ si no lo hay); cada petición es una búsqueda en un dict y un stat
+  del manifiesto: si cambió (nuevo build) el índice se vuelve a cargar.
+- Los archivos de dist/assets/ llevan un hash del contenido en el nombre
+  (Vite) y se sirven con `Cache-Control: immutable` durante un año; el
+  resto (index.html, favicon) se revalida con ETag.
+- Se envía la variante br o gzip que acepte el cliente con FileResponse,
+  que usa `http.response.pathsend` (envío sin copia) si el servidor ASGI
+  lo soporta.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import sys
+
+from fastapi.responses import FileResponse, Response
+
+from response_cache import accepted_encodings, encoding_quality, etag_matches
+
+try:
+    import brotli
+except ImportError:  # opcional: sin él solo se generan variantes gzip
+    brotli = None
+
+logger = logging.getLogger("static_assets")
+
+MANIFEST_NAME = "asset-manifest.json"
+MANIFEST_VERSION = 1
+
+# Vite: assets/<nombre>-<hash>.<ext>
+HASHED_NAME = re.compile(r"^assets/.+-[A-Za-z0-9_-]{8,}\.[a-z0-9]+$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+COMPRESSIBLE_SUFFIXES = (".html", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".map", ".webmanifest", ".xml")
+MIN_COMPRESS_SIZE = 1024
+# Una variante que no ahorra al menos un 10 % no se guarda
+MIN_SAVING = 0.9
+
+# Preferencia de codificación: (Content-Encoding, extensión)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("application/javascript", ".mjs")
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("image/x-icon", ".ico")
+
+
+def _etag(data):
+    return '"%s"' % hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def _compressors():
+    yield "gzip", ".gz", lambda data: gzip.compress(data, 9, mtime=0)
+    if brotli is not None:
+        yield "br", ".br", lambda data: brotli.compress(data, quality=11)
+
+
+def _walk(root):
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, root).replace(os.sep, "/")
+            if relative == MANIFEST_NAME or relative.endswith((".gz", ".br")):
+                continue
+            yield relative, path
+
+
+def build_manifest(root):
+    """Genera las variantes comprimidas de dist/ y su manifiesto; devuelve el manifiesto"""
+    files = {}
+    for relative, path in sorted(_walk(root)):
+        with open(path, "rb") as f:
+            data = f.read()
+        encodings = {}
+        if relative.endswith(COMPRESSIBLE_SUFFIXES) and len(data) >= MIN_COMPRESS_SIZE:
+            for encoding, suffix, compress in _compressors():
+                compressed = compress(data)
+                if len(compressed) <= len(data) * MIN_SAVING:
+                    with open(path + suffix, "wb") as f:
+                        f.write(compressed)
+                    encodings[encoding] = len(compressed)
+        files[relative] = {
+            "size": len(data),
+            "etag": _etag(data),
+            "immutable": bool(HASHED_NAME.match(relative)),
+            "encodings": encodings,
+        }
+    manifest = {"version": MANIFEST_VERSION, "files": files}
+    with open(os.path.join(root, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+class Asset:
+    """Un archivo de dist/ con sus variantes; el stat se hace al indexar"""
+
+    __slots__ = ("path", "stat", "etag", "media_type", "cache_control", "variants")
+
+    def __init__(self, path, etag, immutable, encodings):
+        self.path = path
+        self.stat = os.stat(path)
+        self.etag = etag
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.cache_control = IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE
+        self.variants = []
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and os.path.exists(path + suffix):
+                self.variants.append((encoding, path + suffix, os.stat(path + suffix)))
+
+
+class StaticAssets:
+    """Índice en memoria de dist/ y respuestas para sus archivos"""
+
+    def __init__(self, root):
+        self.root = root
+        # Antes de leer: un build a mitad de carga se detecta en la siguiente petición
+        self.signature = self._signature()
+        self.files = {}
+        self.index = None
+        manifest = self._load_manifest()
+        if manifest is None:
+            logger.warning("%s sin %s: sin variantes comprimidas (ejecuta static_assets.py)",
+                           root, MANIFEST_NAME)
+            manifest = {
+                relative: {"etag": None, "immutable": bool(HASHED_NAME.match(relative)), "encodings": {}}
+                for relative, _ in _walk(root)
+            }
+        for relative, info in manifest.items():
+            path = os.path.join(root, relative)
+            try:
+                etag = info["etag"]
+                if etag is None:
+                    with open(path, "rb") as f:
+                        etag = _etag(f.read())
+                self.files["/" + relative] = Asset(path, etag, info["immutable"], info["encodings"])
+            except OSError:
+                logger.warning("Asset del manifiesto no encontrado: %s", relative)
+        self.index = self.files.get("/index.html")
+
+    def _signature(self):
+        """mtime y tamaño del manifiesto (o de dist/ si no hay manifiesto)"""
+        for path in (os.path.join(self.root, MANIFEST_NAME), self.root):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            return stat.st_mtime_ns, stat.st_size
+        return None
+
+    @property
+    def outdated(self):
+        """dist/ se volvió a generar desde que se cargó el índice"""
+        return self._signature() != self.signature
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest["files"]
+
+    def lookup(self, path, accept=""):
+        """Archivo de la ruta; las rutas del SPA que piden HTML reciben index.html"""
+        asset = self.files.get(path)
+        if asset is None and path.endswith("/"):
+            asset = self.files.get(path + "index.html")
+        if asset is None and "text/html" in accept:
+            asset = self.index
+        return asset
+
+    @staticmethod
+    def response(request, asset):
+        # La de mayor q que el cliente no rechace; a igualdad, en el orden de ENCODINGS
+        accepted = accepted_encodings(request)
+        ranked = [(encoding_quality(accepted, v[0]), -i, v) for i, v in enumerate(asset.variants)]
+        quality, _, variant = max(ranked, key=lambda r: r[:2], default=(0.0, 0, None))
+        if quality <= 0:
+            variant = None
+        # Las variantes comprimidas llevan el ETag débil, como en /data/
+        headers = {"ETag": asset.etag if variant is None else "W/" + asset.etag,
+                   "Cache-Control": asset.cache_control}
+        if asset.variants:
+            headers["Vary"] = "Accept-Encoding"
+        if etag_matches(request, asset.etag):
+            return Response(status_code=304, headers=headers)
+        if variant is None:
+            return FileResponse(asset.path, stat_result=asset.stat, media_type=asset.media_type, headers=headers)
+        encoding, path, stat = variant
+        headers["Content-Encoding"] = encoding
+        return FileResponse(path, stat_result=stat, media_type=asset.media_type, headers=headers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precomprime dist/ y genera su manifiesto")
+    parser.add_argument("dist_dir", nargs="?", default="dist")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.dist_dir):
+        print(f"❌ {args.dist_dir} no existe (ejecuta antes npm run build)", file=sys.stderr)
+        return 1
+    files = build_manifest(args.dist_dir)["files"]
+    original = sum(info["size"] for info in files.values())
+    best = sum(min([info["size"], *info["encodings"].values()]) for info in files.values())
+    print(f"✅ {len(files)} archivos, {original / 1024:.0f} KiB -> {best / 1024:.0f} KiB comprimidos"
+          + ("" if brotli is not None else " (sin brotli: pip install brotli)"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Trama binaria compacta de telemetría del ESP32
+
+En lugar de ~1 KB de JSON por lectura, el firmware puede enviar los campos
+numéricos de /data/ en una trama de layout fijo (109 bytes, 148 en base64):
+
+    cabecera  <2sBH   magia b"\\xa5\\x5a", versión de esquema, largo del cuerpo
+    cuerpo    struct  un valor por campo, en el orden de FRAME_LAYOUTS[versión]
+    cola      <I      CRC32 de cabecera + cuerpo
+
+Los decimales viajan como enteros en punto fijo (valor = crudo / escala) y
+chargeState como código. La trama se envía en una línea "FRAME:<base64>"
+para convivir con los logs de texto que el firmware escribe en el mismo UART.
+Los campos de texto (notaPersonalizada, firmware_version) no van en la
+trama; el controlador los toma de la última lectura de texto.
+
+La trama rápida (FAST_FRAME_VERSION) lleva solo los campos que cambian
+segundo a segundo y `configChecksum`, una suma que el firmware calcula sobre
+el resto (configuración, límites, textos). El backend la lee a alta
+frecuencia y solo vuelve a leer todo cuando esa suma cambia.
+"""
+
+import binascii
+import struct
+
+FRAME_MAGIC = b"\xa5\x5a"
+FRAME_PREFIX = "FRAME:"
+HEADER = struct.Struct("<2sBH")
+TRAILER = struct.Struct("<I")
+
+CHARGE_STATES = ("BULK_CHARGE", "ABSORPTION_CHARGE", "FLOAT_CHARGE", "ERROR")
+
+# Escalas especiales: None = entero tal cual, "bool" = booleano, "state" = chargeState
+_INT = None
+_BOOL = "bool"
+_STATE = "state"
+
+# versión -> [(campo, código struct, escala)]
+FRAME_LAYOUTS = {
+    1: [
+        ("panelToBatteryCurrent", "i", 10),
+        ("batteryToLoadCurrent", "i", 10),
+        ("voltagePanel", "H", 1000),
+        ("voltageBatterySensor2", "H", 1000),
+        ("currentPWM", "H", _INT),
+        ("temperature", "h", 100),
+        ("chargeState", "B", _STATE),
+        ("bulkVoltage", "H", 1000),
+        ("absorptionVoltage", "H", 1000),
+        ("floatVoltage", "H", 1000),
+        ("LVD", "H", 1000),
+        ("LVR", "H", 1000),
+        ("batteryCapacity", "I", 100),
+        ("thresholdPercentage", "H", 100),
+        ("maxAllowedCurrent", "I", 10),
+        ("isLithium", "?", _BOOL),
+        ("maxBatteryVoltageAllowed", "H", 1000),
+        ("absorptionCurrentThreshold_mA", "I", 10),
+        ("currentLimitIntoFloatStage", "I", 10),
+        ("calculatedAbsorptionHours", "I", 1000),
+        ("currentBulkHours", "I", 1000),
+        ("accumulatedAh", "i", 1000),
+        ("estimatedSOC", "H", 100),
+        ("netCurrent", "i", 10),
+        ("factorDivider", "B", _INT),
+        ("useFuenteDC", "?", _BOOL),
+        ("fuenteDC_Amps", "H", 100),
+        ("maxBulkHours", "H", 100),
+        ("panelSensorAvailable", "?", _BOOL),
+        ("maxAbsorptionHours", "H", 100),
+        ("chargedBatteryRestVoltage", "H", 1000),
+        ("reEnterBulkVoltage", "H", 1000),
+        ("pwmFrequency", "I", _INT),
+        ("tempThreshold", "H", _INT),
+        ("temporaryLoadOff", "?", _BOOL),
+        ("loadOffRemainingSeconds", "I", _INT),
+        ("loadOffDuration", "I", _INT),
+        ("loadControlState", "?", _BOOL),
+        ("ledSolarState", "?", _BOOL),
+        ("uptime", "I", _INT),
+    ],
+}
+
+# Trama completa: todos los campos numéricos de /data/
+FRAME_VERSION = 1
+
+# Trama rápida: campos de alta frecuencia + suma del resto
+FAST_FRAME_VERSION = 129
+FRAME_LAYOUTS[FAST_FRAME_VERSION] = [
+    ("panelToBatteryCurrent", "i", 10),
+    ("batteryToLoadCurrent", "i", 10),
+    ("voltagePanel", "H", 1000),
+    ("voltageBatterySensor2", "H", 1000),
+    ("currentPWM", "H", _INT),
+    ("temperature", "h", 100),
+    ("chargeState", "B", _STATE),
+    ("calculatedAbsorptionHours", "I", 1000),
+    ("currentBulkHours", "I", 1000),
+    ("accumulatedAh", "i", 1000),
+    ("estimatedSOC", "H", 100),
+    ("netCurrent", "i", 10),
+    ("panelSensorAvailable", "?", _BOOL),
+    ("temporaryLoadOff", "?", _BOOL),
+    ("loadOffRemainingSeconds", "I", _INT),
+    ("loadOffDuration", "I", _INT),
+    ("loadControlState", "?", _BOOL),
+    ("ledSolarState", "?", _BOOL),
+    ("uptime", "I", _INT),
+    ("configChecksum", "I", _INT),
+]
+
+# Campos de la trama completa que la rápida no trae (cambian solo al configurar)
+SLOW_FIELDS = tuple(
+    name for name, _, _ in FRAME_LAYOUTS[FRAME_VERSION]
+    if name not in {field for field, _, _ in FRAME_LAYOUTS[FAST_FRAME_VERSION]}
+)
+
+_RANGES = {
+    "B": (0, 0xFF), "H": (0, 0xFFFF), "h": (-0x8000, 0x7FFF),
+    "I": (0, 0xFFFFFFFF), "i": (-0x80000000, 0x7FFFFFFF), "?": (0, 1),
+}
+
+
+class FrameError(ValueError):
+    """Trama binaria inválida (CRC, largo o versión desconocida)"""
+
+
+class UnsupportedFrameVersion(FrameError):
+    """El firmware envió una versión de trama que el backend no conoce"""
+
+
+class FrameLayout:
+    """Layout precompilado de una versión: un único struct y sus escalas"""
+
+    def __init__(self, version, fields):
+        self.version = version
+        self.fields = tuple(name for name, _, _ in fields)
+        self.codes = tuple(code for _, code, _ in fields)
+        self.scales = tuple(scale for _, _, scale in fields)
+        self.body = struct.Struct("<" + "".join(self.codes))
+        self.size = HEADER.size + self.body.size + TRAILER.size
+        # Índices por tipo de conversión, para decodificar sin ramas por campo
+        self._scaled = tuple(
+            (i, float(scale)) for i, scale in enumerate(self.scales)
+            if scale not in (_INT, _BOOL, _STATE)
+        )
+        self._state = tuple(i for i, scale in enumerate(self.scales) if scale == _STATE)
+
+    def decode(self, view):
+        values = list(self.body.unpack_from(view, HEADER.size))
+        for i, scale in self._scaled:
+            values[i] = values[i] / scale
+        for i in self._state:
+            code = values[i]
+            values[i] = CHARGE_STATES[code] if code < len(CHARGE_STATES) else "ERROR"
+        return dict(zip(self.fields, values))
+
+    def encode(self, data):
+        raw = []
+        for name, code, scale in zip(self.fields, self.codes, self.scales):
+            value = data.get(name) or 0
+            if scale == _STATE:
+                value = CHARGE_STATES.index(value) if value in CHARGE_STATES else len(CHARGE_STATES) - 1
+            elif scale == _BOOL:
+                value = bool(value)
+            else:
+                value = round(float(value) * (scale or 1))
+                low, high = _RANGES[code]
+                value = min(max(value, low), high)
+            raw.append(value)
+        body = self.body.pack(*raw)
+        header = HEADER.pack(FRAME_MAGIC, self.version, len(body))
+        crc = binascii.crc32(body, binascii.crc32(header))
+        return header + body + TRAILER.pack(crc)
+
+
+LAYOUTS = {version: FrameLayout(version, fields) for version, fields in FRAME_LAYOUTS.items()}
+
+
+def encode_frame(data, version=FRAME_VERSION):
+    """Empaqueta un dict de /data/ en una trama binaria"""
+    return LAYOUTS[version].encode(data)
+
+
+def decode_frame(frame):
+    """
+    Valida y decodifica una trama. Trabaja sobre un memoryview: ni la
+    verificación del CRC ni el desempaquetado copian el buffer.
+    """
+    view = memoryview(frame)
+    if len(view) < HEADER.size + TRAILER.size:
+        raise FrameError("Trama demasiado corta")
+    magic, version, length = HEADER.unpack_from(view)
+    if magic != FRAME_MAGIC:
+        raise FrameError("Marca de trama inválida")
+    layout = LAYOUTS.get(version)
+    if layout is None:
+        raise UnsupportedFrameVersion(f"Versión de trama desconocida: {version}")
+    if length != layout.body.size or len(view) != layout.size:
+        raise FrameError("Largo de trama inválido")
+    (crc,) = TRAILER.unpack_from(view, len(view) - TRAILER.size)
+    if binascii.crc32(view[:-TRAILER.size]) != crc:
+        raise FrameError("CRC inválido")
+    return layout.decode(view)
+
+
+def encode_line(data, version=FRAME_VERSION):
+    """Línea de respuesta 'FRAME:<base64>' (sin el salto de línea)"""
+    return FRAME_PREFIX + binascii.b2a_base64(encode_frame(data, version), newline=False).decode()
+
+
+def decode_line(line):
+    try:
+        frame = binascii.a2b_base64(line[len(FRAME_PREFIX):])
+    except binascii.Error:
+        raise FrameError("Base64 inválido") from None
+    return decode_frame(frame)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Streaming de telemetría por Server-Sent Events
+
+Cada cliente recibe la instantánea completa al conectarse (`event: snapshot`)
+y después solo los campos que cambiaron (`event: delta`). El delta se calcula
+contra lo último que se le envió a ese cliente, así un consumidor lento no
+acumula frames viejos: al volver a leer recibe directamente el estado actual.
+"""
+
+import asyncio
+import json
+import time
+
+KEEPALIVE_SECONDS = 15.0
+
+# Campos que cambian en cada muestra y no justifican un frame por sí solos
+VOLATILE_FIELDS = ("last_update",)
+
+
+def compute_delta(previous, current):
+    """Campos de `current` que difieren de `previous`"""
+    return {key: value for key, value in current.items() if previous.get(key) != value}
+
+
+def format_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+async def telemetry_events(sampler, max_rate):
+    """
+    Generador SSE para un cliente.
+
+    `max_rate` limita los frames por segundo; entre dos envíos los cambios se
+    acumulan en un único delta.
+    """
+    min_interval = 1.0 / max_rate
+    sampler.subscribe()
+    try:
+        while sampler.snapshot is None:
+            if not await sampler.wait_for_update(0, KEEPALIVE_SECONDS):
+                yield b": keepalive\n\n"
+        sent = sampler.snapshot
+        version = sampler.version
+        yield format_event("snapshot", sent, version)
+        last_sent_at = time.monotonic()
+
+        while True:
+            wait = last_sent_at + min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if not await sampler.wait_for_update(version, KEEPALIVE_SECONDS):
+                yield b": keepalive\n\n"
+                continue
+
+            current = sampler.snapshot
+            version = sampler.version
+            delta = compute_delta(sent, current)
+            if all(key in VOLATILE_FIELDS for key in delta):
+                continue
+            yield format_event("delta", delta, version)
+            sent = current
+            last_sent_at = time.monotonic()
+    finally:
+        sampler.unsubscribe()
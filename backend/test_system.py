@@ -0,0 +1,920 @@
+#!/usr/bin/env python3
+"""
+Pruebas del backend contra el simulador del ESP32 (sin hardware)
+
+Ejecutar desde backend/:  python -m pytest -q test_system.py
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+# main crea la base de configuraciones al importarse: usar un directorio temporal
+os.environ.setdefault("CONFIG_DB", os.path.join(tempfile.mkdtemp(), "configuraciones.db"))
+
+import main  # noqa: E402
+from esp32_controller import (  # noqa: E402
+    ESP32Controller, ESP32NotConnected, ESP32Timeout, ReplayTransport, SamplingScheduler, _PendingCommand,
+)
+from esp32_simulator import ChargerModel, ESP32Simulator, Faults, SimulatedTransport  # noqa: E402
+from load_scheduler import LoadScheduler  # noqa: E402
+
+
+def make_controller(**simulator_options):
+    simulator_options.setdefault("latency", 0.01)
+    simulator_options.setdefault("jitter", 0.0)
+    simulator_options.setdefault("model", ChargerModel(sun=0.8, seed=1))
+    simulator = ESP32Simulator(seed=1, **simulator_options)
+    controller = ESP32Controller(
+        transport=SimulatedTransport(simulator), command_timeout=1.0, reconnect_delay=0.05
+    )
+    return controller, simulator
+
+
+async def started(controller):
+    await controller.start()
+    await controller.wait_connected(1)
+    return controller
+
+
+def api_client(tmp_path, monkeypatch, devices="", **simulator_options):
+    """Cliente HTTP de la API con un simulador por dispositivo y archivos en tmp_path"""
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "CONFIG_DB", str(tmp_path / "configuraciones.db"))
+    monkeypatch.setattr(main, "CONFIG_FILE", str(tmp_path / "configuraciones.json"))
+    monkeypatch.setattr(main, "SCHEDULE_FILE", str(tmp_path / "schedule.json"))
+    monkeypatch.setattr(main, "HISTORY_DIR", str(tmp_path / "history"))
+    monkeypatch.setattr(main, "STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setattr(main, "ESP32_DEVICES", devices)
+    app_state = main.AppState()
+    for device in app_state.devices.values():
+        device.controller, _ = make_controller(**simulator_options)
+    monkeypatch.setattr(main, "state", app_state)
+    with TestClient(main.app) as client:
+        deadline = time.monotonic() + 2
+        while not all(d.connected for d in app_state.devices.values()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        yield client
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    yield from api_client(tmp_path, monkeypatch)
+
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    yield from api_client(tmp_path, monkeypatch, devices="norte=/dev/ttyUSB0,sur=/dev/ttyUSB1")
+
+
+# ----------------------------------------------------------------------
+# Controlador serie
+# ----------------------------------------------------------------------
+
+def test_pipelined_writes_overlap_round_trips():
+    async def scenario():
+        controller, simulator = make_controller(latency=0.05)
+        await started(controller)
+        try:
+            parameters = {"bulkVoltage": 14.2, "floatVoltage": 13.4, "isLithium": True,
+                          "batteryCapacity": 150.0, "factorDivider": 2}
+            t0 = time.monotonic()
+            results = await controller.set_parameters(parameters)
+            elapsed = time.monotonic() - t0
+        finally:
+            await controller.stop()
+        return results, elapsed, simulator
+
+    results, elapsed, simulator = asyncio.run(scenario())
+    assert all(success for success, _ in results.values())
+    assert results["isLithium"][1] == "OK:isLithium updated to True"
+    assert simulator.model.state["batteryCapacity"] == 150.0
+    # El simulador procesa en serie; el backend no añade esperas entre comandos
+    assert elapsed < 0.05 * len(results) + 0.2
+
+
+def test_batch_falls_back_when_firmware_lacks_multi_set():
+    async def scenario():
+        controller, simulator = make_controller(supports_multi_set=False)
+        await started(controller)
+        try:
+            results = await controller.set_parameters_batch({"bulkVoltage": 14.1, "useFuenteDC": True})
+        finally:
+            await controller.stop()
+        return controller, results
+
+    controller, results = asyncio.run(scenario())
+    assert controller.supports_multi_set is False
+    assert results["useFuenteDC"] == (True, "OK:useFuenteDC updated to True")
+
+
+def test_dropped_reply_times_out_and_frees_the_window():
+    async def scenario():
+        controller, simulator = make_controller(faults=Faults(drop=1.0))
+        controller.max_in_flight = 1
+        controller.command_timeout = 0.2
+        await started(controller)
+        try:
+            with pytest.raises(ESP32Timeout):
+                await controller.get_data()
+            simulator.faults.drop = 0.0
+            await asyncio.sleep(0.3)
+            return await controller.get_data()
+        finally:
+            await controller.stop()
+
+    data = asyncio.run(scenario())
+    assert data["chargeState"] in ("BULK_CHARGE", "ABSORPTION_CHARGE", "FLOAT_CHARGE")
+
+
+def test_expired_command_behind_a_live_one_frees_its_slot():
+    async def scenario():
+        controller, _ = make_controller()
+        controller._window = asyncio.Semaphore(2)
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        live, expired = loop.create_future(), loop.create_future()
+        for command, future, deadline in (("CMD:GET_DATA", live, now + 60), ("CMD:SET_LVD:12.0", expired, now - 1)):
+            await controller._window.acquire()
+            controller._pending.append(_PendingCommand(command, future, deadline, now))
+        controller._expire_pending()
+        return controller, live, expired
+
+    controller, live, expired = asyncio.run(scenario())
+    assert isinstance(expired.exception(), ESP32Timeout)
+    assert not live.done()
+    assert controller.in_flight == 1 and not controller._window.locked()
+
+
+def test_command_waiting_for_the_window_fails_when_the_writer_stops():
+    async def scenario():
+        controller, simulator = make_controller(faults=Faults(drop=1.0))
+        controller.max_in_flight = 1
+        await started(controller)
+        # El primero ocupa la ventana; el segundo sale de la cola y espera turno
+        first = asyncio.ensure_future(controller.send_command("CMD:GET_DATA", timeout=5))
+        second = asyncio.ensure_future(controller.send_command("CMD:SET_LVD:12.0", timeout=5))
+        await asyncio.sleep(0.05)
+        assert controller.queue_depth == 0
+        started_stop = time.monotonic()
+        await controller.stop()
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        return results, time.monotonic() - started_stop
+
+    results, elapsed = asyncio.run(scenario())
+    assert [type(r) for r in results] == [ESP32NotConnected] * 2, results
+    assert elapsed < 1
+
+
+def test_recorded_session_replays_with_original_timing(tmp_path):
+    path = str(tmp_path / "campo.serial")
+
+    async def session(controller):
+        await started(controller)
+        try:
+            started_at = time.monotonic()
+            reads = [await controller.get_data() for _ in range(3)]
+            writes = await controller.set_parameters_batch({"floatVoltage": 13.4, "LVD": 12.0})
+            return reads, writes, time.monotonic() - started_at
+        finally:
+            await controller.stop()
+
+    def replay(speed):
+        transport = ReplayTransport(path, speed=speed, read_timeout=0.05)
+        controller = ESP32Controller(transport=transport, command_timeout=1.0, reconnect_delay=0.05)
+        return asyncio.run(session(controller)) + (transport.mismatches,)
+
+    simulator = ESP32Simulator(seed=1, latency=0.08, jitter=0.0, model=ChargerModel(sun=0.8, seed=1))
+    recorder = ESP32Controller(transport=SimulatedTransport(simulator), command_timeout=1.0,
+                               reconnect_delay=0.05, record_path=path)
+    reads, writes, recorded_seconds = asyncio.run(session(recorder))
+    # OPEN, 4 comandos con su respuesta y CLOSE
+    assert recorder.transport.records == 10
+    assert recorder.transport._file is None  # cerrado con el transporte
+
+    replayed_reads, replayed_writes, seconds, mismatches = replay(speed=1.0)
+    assert mismatches == 0
+    assert replayed_reads == reads and replayed_writes == writes
+    assert seconds == pytest.approx(recorded_seconds, rel=0.25)
+
+    *_, fast_seconds, mismatches = replay(speed=10.0)
+    assert mismatches == 0
+    assert fast_seconds < recorded_seconds / 3
+
+
+def test_pty_simulator_with_pyserial():
+    pytest.importorskip("serial")
+    from esp32_controller import SerialTransport
+    from esp32_simulator import PtySimulator
+
+    async def scenario():
+        pty = PtySimulator(ESP32Simulator(latency=0.0, jitter=0.0, seed=1))
+        port = await pty.start()
+        controller = ESP32Controller(port, transport=SerialTransport(port, read_timeout=0.05),
+                                     command_timeout=2.0)
+        await started(controller)
+        try:
+            success, response = await controller.set_parameter("floatVoltage", 13.5)
+            data = await controller.get_data()
+        finally:
+            await controller.stop()
+            await pty.stop()
+        return success, response, data
+
+    success, response, data = asyncio.run(scenario())
+    assert success and response == "OK:floatVoltage updated to 13.5"
+    assert data["floatVoltage"] == 13.5
+
+
+# ----------------------------------------------------------------------
+# API
+# ----------------------------------------------------------------------
+
+def test_data_endpoint_supports_etag(api):
+    assert_api_routes_keep_slash_redirect(api)
+    response = api.get("/data/")
+    assert response.status_code == 200
+    assert "last_update" in response.json()
+    etag = response.headers["etag"]
+    # Débil: el ETag no cubre last_update, que cambia con cada lectura
+    assert etag.startswith('W/"')
+    assert api.get("/data/", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_hot_endpoints_reuse_encoded_bytes(api):
+    sampler = main.state.device.sampler
+    plain = api.get("/data/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert sampler.encoded() is sampler.encoded()
+
+    zipped = api.get("/data/", headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert zipped.headers["etag"] == sampler.encoded().gzip_etag
+    assert api.get("/data/", headers={"If-None-Match": zipped.headers["etag"]}).status_code == 304
+    tag = sampler.encoded().etag
+    assert api.get("/data/", headers={"If-None-Match": f'"otro", {tag[2:]}'}).status_code == 304
+    assert api.get("/data/", headers={"If-None-Match": "*"}).status_code == 304
+    assert api.get("/data/", headers={"If-None-Match": '"otro", W/"viejo"'}).status_code == 200
+
+    builds = main.state.responses.builds
+    assert api.get("/schedule").json() == api.get("/schedule").json()
+    assert main.state.responses.builds - builds <= 1
+
+
+def test_telemetry_stream_sends_snapshot_then_coalesced_deltas():
+    import json
+
+    from data_sampler import DataSampler
+    from telemetry_stream import telemetry_events
+
+    async def scenario():
+        state = {"batteryVoltage": 13.2, "panelToBatteryCurrent": 4000.0, "temperature": 25.0}
+
+        async def read(full):
+            return dict(state)
+
+        sampler = DataSampler(read, stream_interval=0.1)
+        await sampler.refresh()
+        events = telemetry_events(sampler, max_rate=10)
+        frames = [await anext(events)]
+        assert sampler.subscribers == 1
+
+        # Dos lecturas entre envíos llegan como un único delta
+        state["batteryVoltage"] = 13.4
+        await sampler.refresh()
+        state["temperature"] = 26.0
+        await sampler.refresh()
+        frames.append(await anext(events))
+
+        # Una lectura sin cambios (solo last_update) no genera frame
+        pending = asyncio.ensure_future(anext(events))
+        await sampler.refresh()
+        await asyncio.sleep(0.2)
+        idle = pending.done()
+        state["panelToBatteryCurrent"] = 0.0
+        await sampler.refresh()
+        frames.append(await asyncio.wait_for(pending, 1))
+
+        await events.aclose()
+        return frames, idle, sampler.subscribers
+
+    frames, idle, subscribers = asyncio.run(scenario())
+    parsed = []
+    for frame in frames:
+        lines = frame.decode().strip().split("\n")
+        parsed.append((lines[0], json.loads(lines[-1][len("data: "):])))
+    assert parsed[0][0] == "event: snapshot" and parsed[0][1]["batteryVoltage"] == 13.2
+    assert parsed[1][0] == "event: delta"
+    assert {k: v for k, v in parsed[1][1].items() if k != "last_update"} == {
+        "batteryVoltage": 13.4, "temperature": 26.0,
+    }
+    assert idle is False
+    assert {k: v for k, v in parsed[2][1].items() if k != "last_update"} == {"panelToBatteryCurrent": 0.0}
+    assert subscribers == 0
+
+
+def test_built_frontend_is_served_precompressed_with_spa_fallback(tmp_path, monkeypatch):
+    from static_assets import build_manifest
+
+    dist = tmp_path / "dist"
+    (dist / "assets").mkdir(parents=True)
+    (dist / "index.html").write_text('<div id="app"></div><script src="/assets/index-abcdef12.js"></script>')
+    (dist / "assets" / "index-abcdef12.js").write_text("export const x = 1;\n" * 200)
+    build_manifest(str(dist))
+    monkeypatch.setattr(main, "FRONTEND_DIST", str(dist))
+    client = api_client(tmp_path, monkeypatch)
+    api = next(client)
+    try:
+        assert_frontend_responses(api)
+        # Un build nuevo se sirve sin reiniciar, con su tamaño y ETag
+        old_etag = api.get("/", headers={"Accept": "text/html"}).headers["etag"]
+        (dist / "index.html").write_text('<div id="app" data-build="2"></div>')
+        build_manifest(str(dist))
+        page = api.get("/", headers={"Accept": "text/html"})
+        assert page.text == '<div id="app" data-build="2"></div>'
+        assert page.headers["etag"] != old_etag
+    finally:
+        client.close()
+
+
+def assert_frontend_responses(api):
+    from static_assets import IMMUTABLE_CACHE
+
+    script = api.get("/assets/index-abcdef12.js", headers={"Accept-Encoding": "gzip"})
+    assert script.status_code == 200
+    assert script.headers["content-encoding"] == "gzip"
+    assert script.headers["cache-control"] == IMMUTABLE_CACHE
+    assert script.text.startswith("export const x")
+    refused = api.get("/assets/index-abcdef12.js", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "content-encoding" not in refused.headers and refused.text == script.text
+    assert api.get("/assets/index-abcdef12.js",
+                   headers={"If-None-Match": script.headers["etag"]}).status_code == 304
+
+    page = api.get("/config", headers={"Accept": "text/html"})
+    assert page.status_code == 200 and 'id="app"' in page.text
+    assert page.headers["cache-control"] == "no-cache"
+    assert api.get("/assets/missing.js").status_code == 404
+    # Las rutas del API no las tapa el fallback del SPA
+    assert "last_update" in api.get("/data/", headers={"Accept": "text/html"}).json()
+    assert_api_routes_keep_slash_redirect(api)
+
+
+def assert_api_routes_keep_slash_redirect(api):
+    redirect = api.get("/data", follow_redirects=False)
+    assert redirect.status_code == 307 and redirect.headers["location"].endswith("/data/")
+    assert "last_update" in api.get("/data").json()
+    missing = api.get("/fleet/rollouts/nada", headers={"Accept": "text/html"})
+    assert missing.status_code == 404 and "no encontrado" in missing.json()["detail"]
+
+
+def test_apply_skips_parameters_that_already_match(api):
+    config = {"batteryCapacity": 300.0, "isLithium": True, "bulkVoltage": 14.6,
+              "absorptionVoltage": 14.6, "floatVoltage": 13.8}
+    assert api.post("/config/custom/configurations/RV", json=config).status_code == 200
+
+    first = api.post("/config/custom/configurations/RV/apply").json()
+    assert first["status"] == "success"
+    assert first["summary"]["sent"] == 5
+    assert first["esp32_responses"]["isLithium"]["esp32_response"] == "OK:isLithium updated to True"
+
+    second = api.post("/config/custom/configurations/RV/apply").json()
+    assert second["summary"]["sent"] == 0
+    assert second["esp32_responses"]["bulkVoltage"]["skipped"] is True
+
+
+def test_configuration_listing_is_paginated(api):
+    configurations = {f"Sitio {i:03d}": {"batteryCapacity": 100.0 + i, "isLithium": i % 2 == 0}
+                      for i in range(25)}
+    response = api.post("/config/custom/configurations/bulk", json={"configurations": configurations})
+    assert response.json()["total_saved"] == 25
+
+    names, cursor = [], None
+    while True:
+        params = {"limit": 10, **({"cursor": cursor} if cursor else {})}
+        page = api.get("/config/custom/configurations", params=params).json()
+        names.extend(page["configurations"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert names == sorted(configurations)
+
+    lithium = api.get("/config/custom/configurations",
+                      params={"is_lithium": True, "min_capacity": 110}).json()
+    assert lithium["total_count"] == 8
+
+    deleted = api.post("/config/custom/configurations/bulk/delete", json={"keywords": ["sitio"]})
+    assert deleted.json()["total_deleted"] == 25
+
+
+def test_metrics_endpoint_reports_routes_and_serial_commands(api):
+    api.get("/data/")
+    api.get("/config/custom/configurations/Inexistente")
+    body = api.get("/metrics").text
+    assert 'charger_http_requests_total{method="GET",route="/data/",status="200"}' in body
+    assert 'route="/config/custom/configurations/{name}",status="404"' in body
+    assert 'charger_serial_commands_total{device="default",command="GET_DATA",outcome="ok"}' in body
+    assert 'charger_serial_queue_depth{device="default"} 0' in body
+    assert 'charger_startup_seconds{phase="ready"}' in body
+    assert 'charger_esp32_first_connect_seconds{device="default"}' in body
+
+
+def test_binary_frames_are_negotiated_with_text_fallback():
+    async def scenario(**options):
+        controller, simulator = make_controller(**options)
+        await started(controller)
+        try:
+            first = await controller.get_data()
+            second = await controller.get_data()
+        finally:
+            await controller.stop()
+        return controller, first, second
+
+    controller, first, second = asyncio.run(scenario())
+    assert controller.frame_version == 1
+    assert second.keys() == first.keys()
+    assert second["notaPersonalizada"] == "Simulador ESP32"
+    assert second["bulkVoltage"] == 14.4
+
+    controller, _, second = asyncio.run(scenario(supports_binary_frames=False))
+    assert controller.frame_version is None
+    assert second["firmware_version"] == "v2.1.0-sim"
+
+
+def test_fast_frames_reread_slow_fields_only_when_config_changes():
+    async def scenario():
+        controller, simulator = make_controller()
+        await started(controller)
+        try:
+            reads = [await controller.get_fast_data() for _ in range(3)]
+            simulator.model.set_parameter("floatVoltage", "13.2")
+            reads.append(await controller.get_fast_data())
+            reads.append(await controller.get_fast_data())
+        finally:
+            await controller.stop()
+        return controller, reads
+
+    controller, reads = asyncio.run(scenario())
+    assert (controller.full_reads, controller.fast_reads) == (2, 3)
+    assert all(read.keys() == reads[0].keys() for read in reads)
+    assert "configChecksum" not in reads[0]
+    assert reads[2]["floatVoltage"] == 13.6 and reads[3]["floatVoltage"] == 13.2
+
+    scheduler = SamplingScheduler(interval=2.0, stream_interval=0.5, idle_interval=10.0)
+    day = {"voltagePanel": 18.5, "voltageBatterySensor2": 13.1,
+           "panelToBatteryCurrent": 4200.0, "panelSensorAvailable": True}
+    assert scheduler.next_delay(day) == 2.0
+    assert scheduler.next_delay({**day, "voltagePanel": 0.4, "panelToBatteryCurrent": 0.0}) == 10.0
+    assert scheduler.next_delay({**day, "panelSensorAvailable": False}) == 10.0
+    assert scheduler.next_delay({**day, "panelSensorAvailable": False}, subscribers=1) == 0.5
+
+
+def test_fleet_routes_are_namespaced_per_device(fleet):
+    assert [d["device_id"] for d in fleet.get("/devices").json()["devices"]] == ["norte", "sur"]
+
+    response = fleet.post("/devices/sur/config/parameter", json={"parameter": "floatVoltage", "value": 13.2})
+    assert response.json()["success"] is True
+    assert fleet.get("/devices/sur/data/").json()["floatVoltage"] == 13.2
+    assert fleet.get("/devices/norte/data/").json()["floatVoltage"] == 13.6
+    assert fleet.get("/devices/oeste/data/").status_code == 404
+
+    summary = fleet.get("/fleet/summary").json()
+    assert summary["totals"]["devices"] == summary["totals"]["reporting"] == 2
+    assert sum(summary["totals"]["charge_states"].values()) == 2
+
+
+# ----------------------------------------------------------------------
+# Historial y reportes
+# ----------------------------------------------------------------------
+
+def test_history_endpoint_returns_raw_rows_and_picks_rollups(api):
+    store = main.state.device.history
+    start = (int(time.time()) // 3600 - 3) * 3600
+    for i in range(120):
+        store.append({"temperature": 20.0 + i % 60, "estimatedSOC": 80.0}, timestamp=start + i)
+
+    raw = api.get("/history", params={"fields": "temperature", "start": start,
+                                      "end": start + 59, "resolution": "1s"}).json()
+    assert raw["resolution"] == "1s"
+    assert len(raw["timestamps"]) == 60 and raw["timestamps"][0] == start
+    assert raw["series"]["temperature"]["value"][:3] == [20.0, 21.0, 22.0]
+
+    # Con pocos puntos se elige el agregado por minuto
+    rolled = api.get("/history", params={"fields": "temperature,estimatedSOC", "start": start,
+                                         "end": start + 119, "max_points": 5}).json()
+    assert rolled["resolution"] == "1min"
+    assert rolled["timestamps"] == [start, start + 60]
+    temperature = rolled["series"]["temperature"]
+    assert temperature["min"] == [20.0, 20.0] and temperature["max"] == [79.0, 79.0]
+    assert temperature["avg"][0] == pytest.approx(49.5)
+    assert rolled["series"]["estimatedSOC"]["avg"] == [80.0, 80.0]
+
+    assert api.get("/history", params={"fields": "noExiste"}).status_code == 400
+    assert api.get("/history", params={"resolution": "5s"}).status_code == 400
+
+
+def test_history_query_slices_columns_with_and_without_numpy(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    import history_store
+    from history_store import HistoryStore
+
+    store = HistoryStore(str(tmp_path))
+    start = (int(time.time()) // 86400 - 2) * 86400
+    try:
+        for i in range(0, 7200, 3):
+            sample = {"temperature": 20.0 + (i % 600) / 10, "chargeState": "FLOAT_CHARGE"}
+            if i % 9:
+                sample["estimatedSOC"] = 50.0 + i / 720
+            store.append(sample, timestamp=start + i)
+    finally:
+        store.close()
+
+    fields = ["temperature", "estimatedSOC", "chargeState"]
+    queries = [(start, start + 7199, "1s"), (start - 60, start + 7260, "1min"), (start, start + 7199, "1h")]
+    with_numpy = [store.query(fields, *query) for query in queries]
+    monkeypatch.setattr(history_store, "_numpy", lambda: None)
+    assert [store.query(fields, *query) for query in queries] == with_numpy
+
+    raw, minutes, hours = with_numpy
+    assert len(raw["timestamps"]) == 2400 and raw["timestamps"][1] == start + 3
+    assert raw["series"]["estimatedSOC"]["value"][:4] == [None, 50.0042, 50.0083, None]
+    assert minutes["timestamps"][0] == start and len(minutes["timestamps"]) == 120
+    assert minutes["series"]["chargeState"]["max"][0] == 2.0
+    assert hours["series"]["temperature"]["min"] == [20.0, 20.0]
+    assert hours["series"]["temperature"]["max"] == [79.7, 79.7]
+
+
+def test_daily_report_accumulates_stage_time_and_amp_hours(tmp_path):
+    pytest.importorskip("numpy")
+    from analytics import daily_report
+    from history_store import HistoryStore
+
+    store = HistoryStore(str(tmp_path))
+    day_start = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    start = day_start.timestamp()
+    try:
+        # Una hora en BULK a 10 A y media hora en ABSORPTION a 45 °C, cada 2 s
+        for i in range(0, 5400, 2):
+            store.append({
+                "chargeState": "BULK_CHARGE" if i < 3600 else "ABSORPTION_CHARGE",
+                "panelToBatteryCurrent": 10000.0 if i < 3600 else 0.0,
+                "batteryToLoadCurrent": 1000.0,
+                "temperature": 30.0 if i < 3600 else 45.0,
+                "estimatedSOC": 50.0 + i / 540,
+            }, timestamp=start + i)
+    finally:
+        store.close()
+    # El reporte abre sus propios mapeos: no depende de los segmentos del
+    # escritor (que pueden cerrarse al rotar) ni los registra
+    report = daily_report(store, start, start + 5400, temp_threshold=40,
+                          expected_absorption_hours=1.0)
+    assert store._segments == {}
+
+    day = report["days"][0]
+    assert [d["date"] for d in report["days"]] == [day_start.date().isoformat()]
+    assert day["time_in_state_hours"]["BULK_CHARGE"] == 1.0
+    assert day["absorption"]["ratio"] == 0.5
+    assert day["ah_in"] == 10.0 and day["ah_out"] == 1.5
+    assert day["temperature"]["excursions"] == 1
+    assert day["soc"]["min"] == 50.0 and day["soc"]["end"] == 59.996
+
+
+def test_fleet_rollout_runs_canary_first_and_halts_on_failure(fleet):
+    config = {"batteryCapacity": 300.0, "isLithium": True, "floatVoltage": 13.8}
+    fleet.post("/config/custom/configurations/Litio LifePO4 300Ah RV", json=config)
+
+    def run(**options):
+        response = fleet.post("/fleet/rollouts", json={
+            "configuration": "Litio LifePO4 300Ah RV", "canary": ["norte"], "retry_delay": 0, **options,
+        })
+        assert response.status_code == 202
+        url = response.json()["status_url"]
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            job = fleet.get(url).json()
+            if job["status"] not in ("pending", "running"):
+                return job
+            time.sleep(0.02)
+        raise AssertionError("el rollout no terminó")
+
+    job = run()
+    assert job["status"] == "succeeded"
+    assert job["progress"]["succeeded"] == 2
+    assert fleet.get("/devices/sur/data/").json()["batteryCapacity"] == 300.0
+    # Cada apply pasó por la cola de trabajos de su cargador
+    applies = fleet.get("/jobs", params={"kind": "apply"}).json()["jobs"]
+    assert sorted(j["device_id"] for j in applies) == ["norte", "sur"]
+
+    main.state.devices["norte"].controller.transport.simulator.faults.error = 1.0
+    fleet.post("/config/custom/configurations/Litio LifePO4 300Ah RV", json={**config, "floatVoltage": 13.7})
+    job = run(retries=1)
+    assert job["status"] == "halted"
+    assert job["devices"]["norte"]["attempts"] == 2
+    assert job["devices"]["sur"]["status"] == "skipped"
+
+
+def test_async_apply_runs_as_coalesced_job(api):
+    config = {"batteryCapacity": 150.0, "isLithium": True, "floatVoltage": 13.6}
+    api.post("/config/custom/configurations/Litio Async", json=config)
+
+    first = api.post("/config/custom/config/Litio Async/apply?async=true")
+    second = api.post("/config/custom/config/Litio Async/apply", headers={"Prefer": "respond-async"})
+    assert first.status_code == second.status_code == 202
+    assert first.headers["location"] == first.json()["status_url"]
+    assert second.json()["job_id"] == first.json()["job_id"]
+    assert second.json()["coalesced"] is True
+    assert api.post("/config/custom/config/No Existe/apply?async=true").status_code == 404
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = api.get(first.json()["status_url"]).json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.02)
+    assert job["status"] == "succeeded"
+    assert job["coalesced_requests"] == 1
+    assert "floatVoltage" in job["result"]["esp32_responses"]
+    assert api.get("/data/").json()["batteryCapacity"] == 150.0
+
+
+def test_load_scheduler_fires_due_events_in_order_and_persists_pending(tmp_path):
+    path = str(tmp_path / "load_events.json")
+
+    async def scenario():
+        fired = []
+
+        async def handler(event):
+            fired.append(event["key"])
+
+        scheduler = LoadScheduler(handler, path)
+        await scheduler.start()
+        now = time.time()
+        scheduler.schedule("load_on", "sur", now + 0.10)
+        scheduler.schedule("shutdown", "norte", now + 0.05)
+        scheduler.schedule("override", "norte", now + 0.02)
+        scheduler.cancel("override", "norte")
+        scheduler.schedule("shutdown", "sur", now + 3600)
+        await asyncio.sleep(0.3)
+        await scheduler.stop()
+        restored = LoadScheduler(handler, path)
+        restored.load()
+        return fired, restored.pending()
+
+    fired, pending = asyncio.run(scenario())
+    assert fired == ["shutdown:norte", "load_on:sur"]
+    assert [event["key"] for event in pending] == ["shutdown:sur"]
+
+
+def test_load_event_stays_persisted_until_its_handler_finishes(tmp_path):
+    path = str(tmp_path / "load_events.json")
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(event):
+            if event["kind"] == "shutdown":
+                raise RuntimeError("ESP32 sin responder")
+            await release.wait()
+
+        scheduler = LoadScheduler(handler, path)
+        await scheduler.start()
+        scheduler.schedule("shutdown", "norte", time.time())
+        scheduler.schedule("load_on", "sur", time.time())
+        await asyncio.sleep(0.05)
+        # load_on está en su manejador: una caída ahora lo volvería a disparar
+        on_disk = LoadScheduler(handler, path)
+        on_disk.load()
+        in_flight = [event["key"] for event in on_disk.pending()]
+        release.set()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        return in_flight, scheduler.pending()
+
+    in_flight, pending = asyncio.run(scenario())
+    assert "load_on:sur" in in_flight
+    # El manejador de shutdown falló: queda reprogramado, no perdido
+    assert [event["key"] for event in pending] == ["shutdown:norte"]
+
+
+def test_manual_toggle_overrides_schedule_until_cleared(api):
+    now = datetime.now()
+    window = {"enabled": True, "shutdown_time": (now + timedelta(hours=2)).strftime("%H:%M"),
+              "startup_time": (now + timedelta(hours=3)).strftime("%H:%M")}
+    assert api.post("/schedule/set", json=window).json()["success"] is True
+    assert api.post("/actions/toggle_load", json={"minutes": 5}).json()["success"] is True
+
+    schedule = api.get("/schedule").json()
+    assert schedule["manual_override_active"] is True
+    assert schedule["load_off_until"] is not None
+    kinds = {event["kind"] for event in main.state.load_scheduler.pending("default")}
+    assert kinds == {"shutdown", "override", "load_on"}
+
+    assert api.post("/schedule/override/clear").json()["cleared"] is True
+    assert api.get("/schedule").json()["manual_override_active"] is False
+
+
+def test_long_schedule_window_is_split_into_max_length_toggles(api):
+    # Ventana de casi 24 h, ya en curso: más que un TOGGLE_LOAD (12 h)
+    now = datetime.now()
+    window = {"enabled": True, "shutdown_time": (now - timedelta(minutes=1)).strftime("%H:%M"),
+              "startup_time": (now - timedelta(minutes=2)).strftime("%H:%M")}
+    assert api.post("/schedule/set", json=window).json()["success"] is True
+    scheduler = main.state.load_scheduler
+    deadline = time.monotonic() + 2
+    # El manejador programa load_on (TOGGLE_LOAD) y después el siguiente shutdown
+    while time.monotonic() < deadline:
+        shutdown = scheduler.get("shutdown", "default")
+        if scheduler.get("load_on", "default") and shutdown and shutdown["due_at"] > time.time() + 60:
+            break
+        time.sleep(0.01)
+
+    load_on = scheduler.get("load_on", "default")["due_at"]
+    assert load_on - time.time() == pytest.approx(main.MAX_LOAD_OFF_SECONDS, abs=5)
+    # El siguiente tramo se pide cuando vence este, no al día siguiente
+    assert scheduler.get("shutdown", "default")["due_at"] == pytest.approx(load_on, abs=5)
+
+
+def test_batch_validation_and_apply_use_chemistry_rules(api):
+    lithium = {"batteryCapacity": 200.0, "isLithium": True, "maxAllowedCurrent": 15000.0,
+               "bulkVoltage": 14.6, "absorptionVoltage": 14.6, "floatVoltage": 13.8}
+    gel = {"batteryCapacity": 100.0, "isLithium": False, "maxAllowedCurrent": 5000.0,
+           "bulkVoltage": 14.4, "absorptionVoltage": 14.4, "floatVoltage": 13.6}
+    report = api.post("/config/custom/configurations/validate/batch", json={"configurations": {
+        "litio": lithium,
+        "gel": gel,
+        # Perfil "Litio 400Ah Sistema Grande" de test_scroll_configurations.py
+        "litio 400": {**lithium, "bulkVoltage": 14.8, "absorptionVoltage": 14.8, "floatVoltage": 14.0},
+        "litio alto": {**lithium, "bulkVoltage": 15.0},
+        "gel invertido": {**gel, "floatVoltage": 14.4, "maxAllowedCurrent": 50000.0},
+        "texto": {"batteryCapacity": "mucho"},
+    }}).json()
+    assert (report["valid"], report["invalid"]) == (3, 3)
+    results = report["results"]
+    assert results["litio"]["chemistry"] == "lifepo4" and results["gel"]["valid"]
+    assert [e["type"] for e in results["litio alto"]["errors"]] == ["chemistry_range"]
+    assert {e["type"] for e in results["gel invertido"]["errors"]} == {"chemistry_range", "voltage_order", "current_limit"}
+    assert results["texto"]["errors"][0]["type"] == "type_error"
+
+    assert api.post("/config/custom/configurations/Litio Alto", json={**lithium, "bulkVoltage": 15.0}).status_code == 422
+    # Guardada sin pasar por la API (p. ej. versión anterior): el apply la rechaza sin escribir
+    main.state.configurations.save("Litio Alto", {**lithium, "bulkVoltage": 15.0})
+    response = api.post("/config/custom/config/Litio Alto/apply")
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["bulkVoltage"]
+    assert api.get("/data/").json()["bulkVoltage"] == 14.4
+
+    # Un parámetro suelto se valida contra el estado del cargador (GEL, absorción 14.4 V)
+    response = api.post("/config/parameter", json={"parameter": "floatVoltage", "value": 14.5})
+    assert response.status_code == 422
+    assert {e["type"] for e in response.json()["detail"]} == {"chemistry_range", "voltage_order"}
+    assert api.post("/config/parameter", json={"parameter": "bulkVoltage", "value": 14.8}).status_code == 422
+    assert api.get("/data/").json()["floatVoltage"] == 13.6
+
+
+def test_integer_parameters_reject_fractions_and_limits_have_one_source(api):
+    from validation import FIELD_LIMITS
+
+    for value in (3.7, "2.5"):
+        response = api.post("/config/parameter", json={"parameter": "factorDivider", "value": value})
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["factorDivider"]
+        assert response.json()["detail"][0]["type"] == "int_type"
+    response = api.post("/config/parameter", json={"parameter": "bulkVoltage", "value": "nan"})
+    assert response.status_code == 422 and response.json()["detail"][0]["loc"] == ["bulkVoltage"]
+    assert api.post("/config/parameter", json={"parameter": "factorDivider", "value": "3"}).status_code == 200
+    assert api.get("/data/").json()["factorDivider"] == 3
+
+    # El modelo de la API toma los rangos de validation.FIELD_LIMITS
+    properties = main.CustomConfiguration.model_json_schema()["properties"]
+    for field, (low, high, low_inclusive) in FIELD_LIMITS.items():
+        schema = next(option for option in properties[field]["anyOf"] if option["type"] != "null")
+        assert schema["maximum"] == high
+        assert schema["minimum" if low_inclusive else "exclusiveMinimum"] == low
+
+
+def test_restart_serves_persisted_state_as_stale_until_first_read(tmp_path, monkeypatch):
+    first = api_client(tmp_path, monkeypatch)
+    client = next(first)
+    client.post("/config/parameter", json={"parameter": "floatVoltage", "value": 13.4})
+    assert client.get("/data/").json()["stale"] is False
+    first.close()  # el apagado guarda el último estado
+    assert (tmp_path / "state" / "default.json").exists()
+
+    # El ESP32 no responde tras el reinicio: se sirve lo persistido, no un 503
+    second = api_client(tmp_path, monkeypatch, faults=Faults(error=1.0))
+    client = next(second)
+    try:
+        response = client.get("/data/")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["stale"] is True and data["connected"] is False
+        assert data["floatVoltage"] == 13.4
+        assert response.headers["etag"].endswith('-stale"')
+
+        main.state.device.controller.transport.simulator.faults.error = 0.0
+        deadline = time.monotonic() + 5
+        while client.get("/data/").json()["stale"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        data = client.get("/data/").json()
+        assert data["stale"] is False and data["floatVoltage"] == 13.6
+        while main.state.device.resync is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        resync = client.get("/devices").json()["devices"][0]["resync"]
+        assert resync["changed_parameters"] == ["floatVoltage"] and resync["full_read"] is True
+    finally:
+        second.close()
+
+
+def test_restart_skips_full_read_when_firmware_config_is_unchanged(tmp_path, monkeypatch):
+    first = api_client(tmp_path, monkeypatch)
+    client = next(first)
+    deadline = time.monotonic() + 5
+    while main.state.controller.config_checksum is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.get("/data/").json()["stale"] is False
+    first.close()
+
+    second = api_client(tmp_path, monkeypatch)
+    client = next(second)
+    try:
+        device = main.state.device
+        deadline = time.monotonic() + 5
+        while device.resync is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # Misma suma de configuración: basta la trama rápida sobre lo guardado
+        assert device.resync["changed_parameters"] == [] and device.resync["full_read"] is False
+        assert device.controller.full_reads == 0 and device.controller.fast_reads >= 1
+        data = client.get("/data/").json()
+        assert data["stale"] is False and data["floatVoltage"] == 13.6
+        assert data["firmware_version"] == "v2.1.0-sim"
+    finally:
+        second.close()
+
+
+def test_startup_does_not_wait_for_esp32_and_opens_history_on_first_use(tmp_path, monkeypatch):
+    # El ESP32 responde ERROR a todo: la API arranca igual y no hay muestras
+    client_gen = api_client(tmp_path, monkeypatch, faults=Faults(error=1.0))
+    client = next(client_gen)
+    try:
+        health = client.get("/health")
+        assert health.status_code == 200
+        assert health.json()["startup_seconds"] is not None
+        assert health.json()["startup_seconds"] == main.state.startup["ready"]
+
+        device = main.state.device
+        assert device._history is None
+        assert not (tmp_path / "history").exists()
+
+        response = client.get("/history", params={"fields": "temperature"})
+        assert response.status_code == 200
+        assert response.json()["timestamps"] == []
+        assert device._history is not None and (tmp_path / "history").is_dir()
+    finally:
+        client_gen.close()
+    assert main.state.device._history is None
+
+
+def test_ndjson_sync_exports_changes_since_revision_and_skips_identical(api):
+    import json
+
+    def export(since=None):
+        params = {} if since is None else {"since": since}
+        response = api.get("/config/custom/configurations/export/stream", params=params)
+        assert response.headers["content-type"] == "application/x-ndjson"
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    def import_lines(lines, overwrite=False):
+        body = "".join(json.dumps(line) + "\n" for line in lines)
+        return api.post("/config/custom/configurations/import/stream", params={"overwrite": overwrite},
+                        content=body, headers={"Content-Type": "application/x-ndjson"}).json()
+
+    api.post("/config/custom/configurations/GEL 100Ah", json={"batteryCapacity": 100.0, "isLithium": False})
+    api.post("/config/custom/configurations/Litio 200Ah", json={"batteryCapacity": 200.0, "isLithium": True})
+    full = export()
+    assert [line["type"] for line in full] == ["header", "configuration", "configuration", "end"]
+    revision = full[-1]["revision"]
+
+    result = import_lines(full)
+    assert result["total_unchanged"] == 2 and result["complete"]
+    assert result["revision"] == revision  # nada reescrito
+
+    api.post("/config/custom/configurations/Litio 200Ah", json={"batteryCapacity": 280.0, "isLithium": True})
+    api.delete("/config/custom/configurations/GEL 100Ah")
+    delta = export(since=revision)[1:-1]
+    assert [(line["type"], line["name"]) for line in delta] == [
+        ("configuration", "Litio 200Ah"), ("deleted", "GEL 100Ah")]
+
+    result = import_lines(full, overwrite=True)
+    assert sorted(result["imported"]) == ["GEL 100Ah", "Litio 200Ah"]
+    result = import_lines(delta, overwrite=True)
+    assert (result["imported"], result["deleted"]) == (["Litio 200Ah"], ["GEL 100Ah"])
+    assert api.get("/config/custom/configurations/Litio 200Ah").json()["batteryCapacity"] == 280.0
+
+    tampered = {**delta[0], "configuration": {**delta[0]["configuration"], "batteryCapacity": 1.0}}
+    result = import_lines([tampered], overwrite=True)
+    assert result["status"] == "partial" and not result["complete"]
+    assert "hash" in result["errors"][0]["error"]
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Reglas de validación de configuraciones por tipo de batería
+
+Las restricciones de la sección 8 de la documentación (ventanas de voltaje
+de LiFePO4 y de plomo-ácido GEL/AGM sacadas de los perfiles documentados, floatVoltage < absorptionVoltage,
+corriente máxima según la capacidad) se compilan al importar el módulo en
+una tabla por química: tuplas de (parámetro, mínimo, máximo) ya resueltas,
+de modo que validar una configuración es recorrer unas pocas comparaciones
+sin construir modelos. La misma tabla valida un lote de cientos de perfiles
+en una sola llamada y se ejecuta antes de cada apply, así una configuración
+incorrecta nunca llega al puerto serie.
+"""
+
+import math
+
+from esp32_controller import CONFIGURABLE_PARAMETERS
+
+# Rangos absolutos del firmware: (mínimo, máximo, mínimo incluido). Los
+# límites del modelo CustomConfiguration de main.py se derivan de aquí
+FIELD_LIMITS = {
+    "batteryCapacity": (0.0, 10000.0, False),
+    "thresholdPercentage": (0.1, 50.0, True),
+    "maxAllowedCurrent": (100.0, 100000.0, True),
+    "bulkVoltage": (10.0, 16.0, True),
+    "absorptionVoltage": (10.0, 16.0, True),
+    "floatVoltage": (10.0, 16.0, True),
+    "fuenteDC_Amps": (0.0, 100.0, True),
+    "factorDivider": (1, 10, True),
+}
+
+# Ventanas por química (batería de 12 V) y corriente máxima de carga en C.
+# Los voltajes abarcan los perfiles documentados del proyecto (sección 8 de
+# FRONTEND_API_DOCUMENTATION.md, FRONTEND_EXAMPLES.md y los perfiles de
+# test_scroll_configurations.py), no una tabla de fabricante
+CHEMISTRY_RULES = {
+    "lifepo4": {
+        "label": "LiFePO4",
+        "voltages": {
+            "bulkVoltage": (14.4, 14.8),
+            "absorptionVoltage": (14.4, 14.8),
+            "floatVoltage": (13.6, 14.0),
+        },
+        "max_c_rate": 1.0,
+    },
+    "lead_acid": {
+        "label": "GEL/AGM",
+        "voltages": {
+            "bulkVoltage": (14.0, 14.7),
+            "absorptionVoltage": (14.0, 14.7),
+            "floatVoltage": (13.2, 13.7),
+        },
+        "max_c_rate": 0.3,
+    },
+}
+
+TRUE_STRINGS = ("true", "1", "yes", "si", "sí")
+
+
+class ConfigurationInvalid(ValueError):
+    """La configuración no cumple las reglas; `errors()` devuelve el detalle por campo"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(error["msg"] for error in errors))
+        self._errors = errors
+
+    def errors(self):
+        return self._errors
+
+
+class RuleTable:
+    """Reglas compiladas de una química (o solo los rangos absolutos si es None)"""
+
+    def __init__(self, chemistry=None):
+        rules = CHEMISTRY_RULES.get(chemistry, {})
+        self.chemistry = chemistry
+        self.label = rules.get("label")
+        self.max_c_rate = rules.get("max_c_rate")
+        windows = rules.get("voltages", {})
+        ranges = []
+        for field, (low, high, low_inclusive) in FIELD_LIMITS.items():
+            kind, message = "range", "absoluto"
+            if field in windows:
+                low, high = windows[field]
+                low_inclusive, kind, message = True, "chemistry_range", f"para {self.label}"
+            ranges.append((field, low, high, low_inclusive, kind, message))
+        self.ranges = tuple(ranges)
+
+
+TABLES = {chemistry: RuleTable(chemistry) for chemistry in CHEMISTRY_RULES}
+GENERIC_TABLE = RuleTable()
+
+
+def chemistry_of(is_lithium):
+    if is_lithium is None:
+        return None
+    return "lifepo4" if is_lithium else "lead_acid"
+
+
+def _error(field, msg, kind):
+    return {"loc": [field], "msg": msg, "type": kind}
+
+
+def coerce_parameter(parameter, value):
+    """
+    Convierte el valor al tipo que espera el firmware. Lanza
+    ConfigurationInvalid (con `loc` en el parámetro) si no es convertible,
+    no es finito o, para un entero, tiene parte decimal.
+    """
+    expected = CONFIGURABLE_PARAMETERS[parameter]
+    if expected is bool:
+        if isinstance(value, str):
+            return value.strip().lower() in TRUE_STRINGS
+        return bool(value)
+    invalid = ConfigurationInvalid([_error(parameter, f"{parameter}: valor inválido '{value}'", "type_error")])
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise invalid from None
+    if isinstance(value, bool) or not math.isfinite(number):
+        raise invalid
+    if expected is int:
+        # int() truncaría 3.7 a 3 sin avisar
+        if not number.is_integer():
+            raise ConfigurationInvalid([_error(
+                parameter, f"{parameter}: se esperaba un entero, no '{value}'", "int_type")])
+        return int(number)
+    return number
+
+
+def check(config, context=None):
+    """
+    Valida los parámetros de `config` y devuelve (parámetros convertidos,
+    errores). `context` es el estado actual del cargador: completa la
+    química y los campos de las reglas cruzadas que `config` no trae. Solo
+    se informan errores en los que interviene algún campo de `config`.
+    """
+    values, errors = {}, []
+    for field, value in config.items():
+        if field not in CONFIGURABLE_PARAMETERS or value is None:
+            continue
+        try:
+            values[field] = coerce_parameter(field, value)
+        except ConfigurationInvalid as e:
+            errors.extend(e.errors())
+
+    effective = {**(context or {}), **values}
+    table = TABLES.get(chemistry_of(effective.get("isLithium")), GENERIC_TABLE)
+
+    for field, low, high, low_inclusive, kind, scope in table.ranges:
+        value = values.get(field)
+        if value is None:
+            continue
+        if value > high or value < low or (value == low and not low_inclusive):
+            errors.append(_error(field, f"{field}={value} fuera del rango {scope} [{low}, {high}]", kind))
+
+    float_voltage = effective.get("floatVoltage")
+    absorption_voltage = effective.get("absorptionVoltage")
+    if (("floatVoltage" in values or "absorptionVoltage" in values)
+            and float_voltage is not None and absorption_voltage is not None
+            and float_voltage >= absorption_voltage):
+        field = "floatVoltage" if "floatVoltage" in values else "absorptionVoltage"
+        errors.append(_error(
+            field,
+            f"floatVoltage ({float_voltage}) debe ser menor que absorptionVoltage ({absorption_voltage})",
+            "voltage_order",
+        ))
+
+    capacity = effective.get("batteryCapacity")
+    current = effective.get("maxAllowedCurrent")
+    if (table.max_c_rate is not None
+            and ("maxAllowedCurrent" in values or "batteryCapacity" in values or "isLithium" in values)
+            and capacity and current is not None):
+        # maxAllowedCurrent está en mA y la capacidad en Ah
+        limit = capacity * table.max_c_rate * 1000
+        if current > limit:
+            field = "maxAllowedCurrent" if "maxAllowedCurrent" in values else "batteryCapacity"
+            errors.append(_error(
+                field,
+                f"maxAllowedCurrent ({current:g} mA) supera {table.max_c_rate:g}C de "
+                f"{capacity:g} Ah para {table.label} ({limit:g} mA)",
+                "current_limit",
+            ))
+    return values, errors
+
+
+def validate(config, context=None):
+    """Como `check`, pero lanza ConfigurationInvalid si hay errores"""
+    values, errors = check(config, context)
+    if errors:
+        raise ConfigurationInvalid(errors)
+    return values
+
+
+def validate_batch(configurations, context=None):
+    """Valida {nombre: configuración} en una pasada; nunca lanza"""
+    results = {}
+    for name, config in configurations.items():
+        if not isinstance(config, dict):
+            results[name] = {"valid": False, "chemistry": None, "errors": [
+                _error("configuration", "La configuración debe ser un objeto", "type_error")]}
+            continue
+        values, errors = check(config, context)
+        results[name] = {
+            "valid": not errors,
+            "chemistry": chemistry_of({**(context or {}), **values}.get("isLithium")),
+            "errors": errors,
+        }
+    return results
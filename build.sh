@@ -1,9 +1,13 @@
 #!/bin/bash
 # Script para compilar la aplicación
+set -e
 
 echo "🔨 Compilando ESP32 Solar Vue..."
+python3 backend/icons.py public
 npm run build
+# Variantes .gz/.br y manifiesto para que el backend sirva dist/
+python3 backend/static_assets.py dist
 
 echo ""
 echo "✅ Compilación completada"
-echo "📁 Los archivos están en: ./dist"
+echo "📁 Los archivos están en: ./dist (los sirve el backend en producción)"
@@ -113,6 +113,20 @@ else
 fi
 echo
 
+# Test 8: Métricas del backend
+echo "📏 Test 8: Métricas del Backend"
+echo "-------------------------------"
+metrics=$(curl -s "$API_BASE/metrics" 2>/dev/null)
+if [ -n "$metrics" ]; then
+    echo "✅ Cola serie y fases de apply:"
+    echo "$metrics" | grep -E "^charger_(serial_queue_depth|serial_in_flight|esp32_connected|data_cache_hit_ratio)[ {]"
+    echo "$metrics" | grep -E "^charger_(apply_phase_seconds|serial_round_trip_seconds)_(sum|count)"
+    echo "$metrics" | grep -E '^charger_serial_commands_total.*outcome="(error|timeout|disconnected)"'
+else
+    echo "⚠️ /metrics no disponible"
+fi
+echo
+
 echo "🎯 RESUMEN DE DIAGNÓSTICO:"
 echo "========================="
 echo "1. Verificar que el backend esté corriendo en $API_BASE"
@@ -1,7 +1,9 @@
 import axios from 'axios'
 
 // Configuración desde variables de entorno
-const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000'
+// En producción el backend sirve también el frontend: mismo origen
+const API_BASE_URL = import.meta.env.VITE_API_BASE_URL ||
+  (import.meta.env.PROD ? window.location.origin : 'http://localhost:8000')
 const API_TIMEOUT = parseInt(import.meta.env.VITE_API_TIMEOUT) || 10000
 const DEBUG_MODE = import.meta.env.VITE_DEBUG_MODE === 'true'
 
@@ -83,6 +85,33 @@ apiClient.interceptors.response.use(
   }
 )
 
+// Operaciones largas (apply, toggle_load) se piden como trabajo en el backend:
+// responde 202 y se consulta /jobs/{id} hasta que termina, así un timeout del
+// navegador no deja la operación a medias. Un backend antiguo responde 200.
+const ASYNC_HEADERS = { Prefer: 'respond-async' }
+const JOB_POLL_INTERVAL = 500
+const JOB_TIMEOUT = 120000
+
+async function jobResult(response) {
+  if (response.status !== 202 || !response.data?.job_id) {
+    return response.data
+  }
+  const deadline = Date.now() + JOB_TIMEOUT
+  while (Date.now() < deadline) {
+    const { data: job } = await apiClient.get(`/jobs/${response.data.job_id}`)
+    if (job.status === 'succeeded') {
+      return job.result
+    }
+    if (job.status === 'failed' || job.status === 'cancelled') {
+      const error = new Error(job.error || `Trabajo ${job.status}`)
+      error.job = job
+      throw error
+    }
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL))
+  }
+  throw new Error(`El trabajo ${response.data.job_id} no terminó a tiempo`)
+}
+
 // Servicios de la API
 export const api = {
   // Datos
@@ -91,6 +120,11 @@ export const api = {
     return response.data
   },
 
+  // URL del stream SSE de telemetría (instantánea + deltas)
+  getDataStreamUrl(maxRate = 1) {
+    return `${API_BASE_URL}/data/stream?max_rate=${maxRate}`
+  },
+
   async getParameter(parameter) {
     const response = await apiClient.get(`/data/`)
     // Extraer el parámetro específico de la respuesta completa
@@ -127,8 +161,8 @@ export const api = {
         hours,
         minutes,
         seconds
-      })
-      return response.data
+      }, { headers: ASYNC_HEADERS })
+      return await jobResult(response)
     } catch (error) {
       console.warn('Endpoint /actions/toggle_load no disponible en la nueva API')
       throw error
@@ -187,9 +221,7 @@ export const api = {
   },
 
   async clearScheduleOverride() {
-    const response = await apiClient.post('/schedule/set', {
-      enabled: false
-    })
+    const response = await apiClient.post('/schedule/override/clear')
     return response.data
   },
 
@@ -215,8 +247,8 @@ export const api = {
   },
 
   async applyConfiguration(name) {
-    const response = await apiClient.post(`/config/custom/config/${name}/apply`)
-    return response.data
+    const response = await apiClient.post(`/config/custom/config/${name}/apply`, null, { headers: ASYNC_HEADERS })
+    return await jobResult(response)
   },
 
   async getConfiguration(name) {
@@ -239,6 +271,12 @@ export const api = {
     return response.data
   },
 
+  // Valida muchas configuraciones ({nombre: config}) en una sola llamada
+  async validateConfigurations(configurations) {
+    const response = await apiClient.post('/config/custom/configurations/validate/batch', { configurations })
+    return response.data
+  },
+
   // Nuevos métodos según la documentación actualizada
   async searchConfigurations(searchTerm) {
     const params = searchTerm ? { search: searchTerm } : {}
@@ -14,6 +14,11 @@ export const useDataStore = defineStore('data', () => {
   let pollingInterval = null
   const POLLING_INTERVAL = parseInt(import.meta.env.VITE_POLLING_INTERVAL) || 3000
 
+  // Stream SSE (si está disponible reemplaza al polling)
+  let eventSource = null
+  const USE_STREAM = import.meta.env.VITE_USE_STREAM !== 'false' && typeof EventSource !== 'undefined'
+  const STREAM_MAX_RATE = parseFloat(import.meta.env.VITE_STREAM_MAX_RATE) || 1
+
   // Getters computados
   const batteryPercentage = computed(() => {
     if (!data.value) return 0
@@ -48,7 +53,47 @@ export const useDataStore = defineStore('data', () => {
     }
   }
 
+  function applyStreamUpdate(update, isSnapshot) {
+    data.value = isSnapshot ? update : { ...data.value, ...update }
+    connected.value = data.value.connected !== false
+    lastUpdate.value = new Date()
+    error.value = null
+  }
+
+  function startStream() {
+    eventSource = new EventSource(api.getDataStreamUrl(STREAM_MAX_RATE))
+
+    eventSource.addEventListener('snapshot', event => {
+      applyStreamUpdate(JSON.parse(event.data), true)
+    })
+    eventSource.addEventListener('delta', event => {
+      applyStreamUpdate(JSON.parse(event.data), false)
+    })
+    eventSource.onerror = () => {
+      // Si el stream falla, volver al polling clásico
+      console.warn('Stream /data/stream no disponible, usando polling')
+      stopStream()
+      startIntervalPolling()
+    }
+  }
+
+  function stopStream() {
+    if (eventSource) {
+      eventSource.close()
+      eventSource = null
+    }
+  }
+
   function startPolling() {
+    stopPolling()
+    if (USE_STREAM) {
+      startStream()
+    } else {
+      startIntervalPolling()
+    }
+  }
+
+  function startIntervalPolling() {
     // Obtener datos inmediatamente
     fetchData()
     
@@ -63,6 +108,7 @@ export const useDataStore = defineStore('data', () => {
   }
 
   function stopPolling() {
+    stopStream()
     if (pollingInterval) {
       clearInterval(pollingInterval)
       pollingInterval = null
@@ -170,10 +170,10 @@ def apply_configuration(config_name):
     print_separator(f"TEST 6: Aplicar Configuración '{config_name}'")
     
     try:
-        print(f"Aplicando configuración '{config_name}'... (puede tomar hasta 30s)")
+        print(f"Aplicando configuración '{config_name}'...")
         response = requests.post(
             f"{API_BASE}/config/custom/configurations/{config_name}/apply",
-            timeout=35
+            timeout=10
         )
         
         if response.status_code == 200:
@@ -181,6 +181,9 @@ def apply_configuration(config_name):
             print(f"✅ Configuración '{config_name}' aplicada exitosamente")
             if 'applied_parameters' in result:
                 print(f"   Parámetros aplicados: {len(result['applied_parameters'])}")
+            if 'summary' in result:
+                print(f"   Enviados: {result['summary'].get('sent')}, sin cambios: {result['summary'].get('skipped')}")
+                print(f"   Tiempo: {result.get('time_total')}")
             return True
         else:
             print(f"❌ Error al aplicar: HTTP {response.status_code}")
@@ -188,7 +191,7 @@ def apply_configuration(config_name):
             return False
             
     except requests.exceptions.Timeout:
-        print("⏰ Timeout al aplicar configuración (>35s)")
+        print("⏰ Timeout al aplicar configuración (>10s)")
         return False
     except Exception as e:
         print(f"❌ Error: {e}")
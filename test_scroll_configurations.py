@@ -1,258 +1,345 @@
 #!/usr/bin/env python3
 """
 Script para crear configuraciones de prueba y validar el comportamiento del scroll
+
+Usa un cliente HTTP asíncrono con conexiones reutilizadas y concurrencia
+limitada. Las altas y bajas van por los endpoints bulk (una sola petición
+transaccional); si la API no los tiene, se envían en paralelo una a una.
+
+Uso:
+    python test_scroll_configurations.py                  # crea las configuraciones de prueba
+    python test_scroll_configurations.py --sites perfiles.json   # además carga perfiles de sitio
+    python test_scroll_configurations.py --cleanup        # elimina las configuraciones de prueba
 """
 
-import requests
+import asyncio
 import json
+import sys
 from datetime import datetime
 
+import httpx
+
 API_BASE = "http://localhost:8000"
+MAX_CONCURRENCY = 8
+PAGE_SIZE = 200
 
-def create_test_configurations():
-    """Crea múltiples configuraciones de prueba para probar el scroll"""
-    
-    # Configuraciones de prueba con diferentes tipos
-    test_configs = [
-        {
-            "name": "Batería Litio 100Ah Casa",
-            "config": {
-                "batteryCapacity": 100.0,
-                "isLithium": True,
-                "thresholdPercentage": 5.0,
-                "maxAllowedCurrent": 10000.0,
-                "bulkVoltage": 14.4,
-                "absorptionVoltage": 14.4,
-                "floatVoltage": 13.6,
-                "useFuenteDC": False,
-                "fuenteDC_Amps": 0.0,
-                "factorDivider": 1
-            }
-        },
-        {
-            "name": "Batería GEL 150Ah Oficina",
-            "config": {
-                "batteryCapacity": 150.0,
-                "isLithium": False,
-                "thresholdPercentage": 10.0,
-                "maxAllowedCurrent": 12000.0,
-                "bulkVoltage": 14.1,
-                "absorptionVoltage": 14.1,
-                "floatVoltage": 13.3,
-                "useFuenteDC": True,
-                "fuenteDC_Amps": 5.0,
-                "factorDivider": 1
-            }
-        },
-        {
-            "name": "Batería AGM 200Ah Industrial",
-            "config": {
-                "batteryCapacity": 200.0,
-                "isLithium": False,
-                "thresholdPercentage": 8.0,
-                "maxAllowedCurrent": 20000.0,
-                "bulkVoltage": 14.2,
-                "absorptionVoltage": 14.2,
-                "floatVoltage": 13.4,
-                "useFuenteDC": False,
-                "fuenteDC_Amps": 0.0,
-                "factorDivider": 1
-            }
-        },
-        {
-            "name": "Litio LifePO4 300Ah RV",
-            "config": {
-                "batteryCapacity": 300.0,
-                "isLithium": True,
-                "thresholdPercentage": 3.0,
-                "maxAllowedCurrent": 30000.0,
-                "bulkVoltage": 14.6,
-                "absorptionVoltage": 14.6,
-                "floatVoltage": 13.8,
-                "useFuenteDC": True,
-                "fuenteDC_Amps": 10.0,
-                "factorDivider": 1
-            }
-        },
-        {
-            "name": "Batería Gel 80Ah Cabina",
-            "config": {
-                "batteryCapacity": 80.0,
-                "isLithium": False,
-                "thresholdPercentage": 12.0,
-                "maxAllowedCurrent": 8000.0,
-                "bulkVoltage": 14.0,
-                "absorptionVoltage": 14.0,
-                "floatVoltage": 13.2,
-                "useFuenteDC": False,
-                "fuenteDC_Amps": 0.0,
-                "factorDivider": 1
-            }
-        },
-        {
-            "name": "Litio 400Ah Sistema Grande",
-            "config": {
-                "batteryCapacity": 400.0,
-                "isLithium": True,
-                "thresholdPercentage": 2.0,
-                "maxAllowedCurrent": 40000.0,
-                "bulkVoltage": 14.8,
-                "absorptionVoltage": 14.8,
-                "floatVoltage": 14.0,
-                "useFuenteDC": True,
-                "fuenteDC_Amps": 15.0,
-                "factorDivider": 1
-            }
-        },
-        {
-            "name": "AGM 120Ah Respaldo UPS",
-            "config": {
-                "batteryCapacity": 120.0,
-                "isLithium": False,
-                "thresholdPercentage": 15.0,
-                "maxAllowedCurrent": 10000.0,
-                "bulkVoltage": 14.3,
-                "absorptionVoltage": 14.3,
-                "floatVoltage": 13.5,
-                "useFuenteDC": False,
-                "fuenteDC_Amps": 0.0,
-                "factorDivider": 1
-            }
+# Configuraciones de prueba con diferentes tipos
+TEST_CONFIGS = [
+    {
+        "name": "Batería Litio 100Ah Casa",
+        "config": {
+            "batteryCapacity": 100.0,
+            "isLithium": True,
+            "thresholdPercentage": 5.0,
+            "maxAllowedCurrent": 10000.0,
+            "bulkVoltage": 14.4,
+            "absorptionVoltage": 14.4,
+            "floatVoltage": 13.6,
+            "useFuenteDC": False,
+            "fuenteDC_Amps": 0.0,
+            "factorDivider": 1
         }
-    ]
-    
-    print("🧪 Creando configuraciones de prueba para validar scroll...")
-    created_configs = []
-    
-    for test_config in test_configs:
-        name = test_config["name"]
-        config = test_config["config"]
-        
-        # Agregar metadatos
-        config["createdAt"] = datetime.now().isoformat()
-        config["updatedAt"] = datetime.now().isoformat()
-        
-        try:
-            response = requests.post(
-                f"{API_BASE}/config/custom/configurations/{name}",
-                json=config,
-                timeout=10
-            )
-            
-            if response.status_code in [200, 201]:
-                print(f"✅ Configuración '{name}' creada")
-                created_configs.append(name)
-            else:
-                print(f"❌ Error creando '{name}': HTTP {response.status_code}")
-                
-        except Exception as e:
-            print(f"❌ Error creando '{name}': {e}")
-    
-    return created_configs
-
-def list_all_configurations():
-    """Lista todas las configuraciones para verificar"""
+    },
+    {
+        "name": "Batería GEL 150Ah Oficina",
+        "config": {
+            "batteryCapacity": 150.0,
+            "isLithium": False,
+            "thresholdPercentage": 10.0,
+            "maxAllowedCurrent": 12000.0,
+            "bulkVoltage": 14.1,
+            "absorptionVoltage": 14.1,
+            "floatVoltage": 13.3,
+            "useFuenteDC": True,
+            "fuenteDC_Amps": 5.0,
+            "factorDivider": 1
+        }
+    },
+    {
+        "name": "Batería AGM 200Ah Industrial",
+        "config": {
+            "batteryCapacity": 200.0,
+            "isLithium": False,
+            "thresholdPercentage": 8.0,
+            "maxAllowedCurrent": 20000.0,
+            "bulkVoltage": 14.2,
+            "absorptionVoltage": 14.2,
+            "floatVoltage": 13.4,
+            "useFuenteDC": False,
+            "fuenteDC_Amps": 0.0,
+            "factorDivider": 1
+        }
+    },
+    {
+        "name": "Litio LifePO4 300Ah RV",
+        "config": {
+            "batteryCapacity": 300.0,
+            "isLithium": True,
+            "thresholdPercentage": 3.0,
+            "maxAllowedCurrent": 30000.0,
+            "bulkVoltage": 14.6,
+            "absorptionVoltage": 14.6,
+            "floatVoltage": 13.8,
+            "useFuenteDC": True,
+            "fuenteDC_Amps": 10.0,
+            "factorDivider": 1
+        }
+    },
+    {
+        "name": "Batería Gel 80Ah Cabina",
+        "config": {
+            "batteryCapacity": 80.0,
+            "isLithium": False,
+            "thresholdPercentage": 12.0,
+            "maxAllowedCurrent": 8000.0,
+            "bulkVoltage": 14.0,
+            "absorptionVoltage": 14.0,
+            "floatVoltage": 13.2,
+            "useFuenteDC": False,
+            "fuenteDC_Amps": 0.0,
+            "factorDivider": 1
+        }
+    },
+    {
+        "name": "Litio 400Ah Sistema Grande",
+        "config": {
+            "batteryCapacity": 400.0,
+            "isLithium": True,
+            "thresholdPercentage": 2.0,
+            "maxAllowedCurrent": 40000.0,
+            "bulkVoltage": 14.8,
+            "absorptionVoltage": 14.8,
+            "floatVoltage": 14.0,
+            "useFuenteDC": True,
+            "fuenteDC_Amps": 15.0,
+            "factorDivider": 1
+        }
+    },
+    {
+        "name": "AGM 120Ah Respaldo UPS",
+        "config": {
+            "batteryCapacity": 120.0,
+            "isLithium": False,
+            "thresholdPercentage": 15.0,
+            "maxAllowedCurrent": 10000.0,
+            "bulkVoltage": 14.3,
+            "absorptionVoltage": 14.3,
+            "floatVoltage": 13.5,
+            "useFuenteDC": False,
+            "fuenteDC_Amps": 0.0,
+            "factorDivider": 1
+        }
+    }
+]
+
+# Configuraciones que probablemente son de prueba
+TEST_KEYWORDS = ['prueba', 'test', 'casa', 'oficina', 'industrial', 'rv', 'cabina', 'respaldo', 'ups']
+
+
+def make_client():
+    """Cliente con pool de conexiones keep-alive compartido por todas las peticiones"""
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)
+    return httpx.AsyncClient(base_url=API_BASE, timeout=10, limits=limits)
+
+
+async def gather_limited(coroutines, limit=MAX_CONCURRENCY):
+    """Ejecuta las corrutinas en paralelo con como máximo `limit` a la vez"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(c) for c in coroutines), return_exceptions=True)
+
+
+def bulk_unavailable(response):
+    return response.status_code in (404, 405)
+
+
+async def create_test_configurations(client, extra_configs=None):
+    """Crea múltiples configuraciones de prueba para probar el scroll"""
+    now = datetime.now().isoformat()
+    configurations = {
+        test_config["name"]: {**test_config["config"], "createdAt": now, "updatedAt": now}
+        for test_config in TEST_CONFIGS
+    }
+    configurations.update(extra_configs or {})
+
+    print(f"🧪 Creando {len(configurations)} configuraciones...")
     try:
-        response = requests.get(f"{API_BASE}/config/custom/configurations")
-        if response.status_code == 200:
+        response = await client.post(
+            "/config/custom/configurations/bulk",
+            json={"configurations": configurations, "overwrite": True},
+        )
+    except httpx.HTTPError as e:
+        print(f"❌ Error creando configuraciones: {e}")
+        return []
+
+    if response.status_code == 200:
+        created_configs = response.json().get("saved", [])
+        for name in created_configs:
+            print(f"✅ Configuración '{name}' creada")
+        return created_configs
+    if not bulk_unavailable(response):
+        print(f"❌ Error creando configuraciones: HTTP {response.status_code}: {response.text}")
+        return []
+
+    # API sin endpoint bulk: una petición por configuración, en paralelo
+    async def create_one(name, config):
+        response = await client.post(f"/config/custom/configurations/{name}", json=config)
+        if response.status_code in [200, 201]:
+            print(f"✅ Configuración '{name}' creada")
+            return name
+        print(f"❌ Error creando '{name}': HTTP {response.status_code}")
+        return None
+
+    results = await gather_limited(create_one(n, c) for n, c in configurations.items())
+    for name, result in zip(configurations, results):
+        if isinstance(result, Exception):
+            print(f"❌ Error creando '{name}': {result}")
+    return [r for r in results if isinstance(r, str)]
+
+
+async def list_all_configurations(client, search=None, quiet=False):
+    """Lista todas las configuraciones (paginando) para verificar"""
+    names, configurations = [], {}
+    params = {"limit": PAGE_SIZE}
+    if search:
+        params["search"] = search
+    try:
+        while True:
+            response = await client.get("/config/custom/configurations", params=params)
+            if response.status_code != 200:
+                print(f"❌ Error listando configuraciones: HTTP {response.status_code}")
+                return []
             data = response.json()
-            configurations = data.get('configurations', {})
-            
-            print(f"\n📋 Configuraciones totales: {len(configurations)}")
-            for i, (name, config) in enumerate(configurations.items(), 1):
-                capacity = config.get('batteryCapacity', 'N/A')
-                lithium = config.get('isLithium', False)
-                battery_type = 'Litio' if lithium else 'GEL/AGM'
-                print(f"   {i:2d}. {name} ({capacity}Ah, {battery_type})")
-            
-            return list(configurations.keys())
-        else:
-            print(f"❌ Error listando configuraciones: HTTP {response.status_code}")
-            return []
-    except Exception as e:
+            configurations.update(data.get('configurations', {}))
+            cursor = data.get('next_cursor')
+            if not cursor:
+                break
+            params["cursor"] = cursor
+    except httpx.HTTPError as e:
         print(f"❌ Error: {e}")
         return []
 
-def cleanup_test_configurations(config_names):
+    names = list(configurations)
+    if not quiet:
+        print(f"\n📋 Configuraciones totales: {len(configurations)}")
+        for i, (name, config) in enumerate(configurations.items(), 1):
+            capacity = config.get('batteryCapacity', 'N/A')
+            lithium = config.get('isLithium', False)
+            battery_type = 'Litio' if lithium else 'GEL/AGM'
+            print(f"   {i:2d}. {name} ({capacity}Ah, {battery_type})")
+    return names
+
+
+async def cleanup_test_configurations(client, config_names):
     """Limpia las configuraciones de prueba creadas"""
     print(f"\n🧹 Limpiando {len(config_names)} configuraciones de prueba...")
-    
-    for name in config_names:
-        try:
-            response = requests.delete(f"{API_BASE}/config/custom/configurations/{name}")
-            if response.status_code == 200:
-                print(f"✅ Eliminada '{name}'")
-            else:
-                print(f"❌ Error eliminando '{name}': HTTP {response.status_code}")
-        except Exception as e:
-            print(f"❌ Error eliminando '{name}': {e}")
 
-def main():
+    response = await client.post(
+        "/config/custom/configurations/bulk/delete", json={"names": list(config_names)}
+    )
+    if response.status_code == 200:
+        for name in response.json().get("deleted", []):
+            print(f"✅ Eliminada '{name}'")
+        return
+    if not bulk_unavailable(response):
+        print(f"❌ Error eliminando configuraciones: HTTP {response.status_code}")
+        return
+
+    async def delete_one(name):
+        response = await client.delete(f"/config/custom/configurations/{name}")
+        if response.status_code == 200:
+            print(f"✅ Eliminada '{name}'")
+        else:
+            print(f"❌ Error eliminando '{name}': HTTP {response.status_code}")
+
+    results = await gather_limited(delete_one(name) for name in config_names)
+    for name, result in zip(config_names, results):
+        if isinstance(result, Exception):
+            print(f"❌ Error eliminando '{name}': {result}")
+
+
+def load_site_profiles(path):
+    """Lee perfiles de sitio desde un JSON {nombre: configuración}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("configurations", data)
+
+
+async def main(sites_file=None):
     print("🧪 PRUEBA DE SCROLL EN CONFIGURACIONES")
     print("="*50)
-    
-    # Listar configuraciones actuales
-    print("📊 Estado inicial:")
-    initial_configs = list_all_configurations()
-    
-    # Crear configuraciones de prueba
-    print(f"\n🔧 Creando configuraciones de prueba...")
-    created_configs = create_test_configurations()
-    
-    if created_configs:
-        print(f"\n✅ {len(created_configs)} configuraciones de prueba creadas")
-        
-        # Listar todas las configuraciones
-        all_configs = list_all_configurations()
-        
-        print(f"\n🎯 INSTRUCCIONES PARA PRUEBA:")
-        print("1. Ve al frontend: http://localhost:5173")
-        print("2. Busca la sección 'Configuraciones Guardadas'")
-        print("3. Debería estar COLAPSADA por defecto")
-        print("4. Haz clic para expandir")
-        print("5. Con más de 5 configuraciones, debería aparecer scroll")
-        print("6. Verifica que el scroll funcione correctamente")
-        print("7. Prueba colapsar y expandir varias veces")
-        
-        # Preguntar si limpiar
-        print(f"\n⚠️  NOTA: Después de probar, ejecuta este script con --cleanup")
-        print("   o elimina manualmente las configuraciones de prueba")
-        
-    else:
-        print("❌ No se pudieron crear configuraciones de prueba")
 
-def cleanup():
+    extra_configs = load_site_profiles(sites_file) if sites_file else {}
+
+    async with make_client() as client:
+        # Listar configuraciones actuales
+        print("📊 Estado inicial:")
+        await list_all_configurations(client)
+
+        # Crear configuraciones de prueba
+        print(f"\n🔧 Creando configuraciones de prueba...")
+        started = asyncio.get_running_loop().time()
+        created_configs = await create_test_configurations(client, extra_configs)
+        elapsed = asyncio.get_running_loop().time() - started
+
+        if created_configs:
+            print(f"\n✅ {len(created_configs)} configuraciones de prueba creadas en {elapsed:.2f}s")
+
+            # Listar todas las configuraciones
+            await list_all_configurations(client)
+
+            print(f"\n🎯 INSTRUCCIONES PARA PRUEBA:")
+            print("1. Ve al frontend: http://localhost:5173")
+            print("2. Busca la sección 'Configuraciones Guardadas'")
+            print("3. Debería estar COLAPSADA por defecto")
+            print("4. Haz clic para expandir")
+            print("5. Con más de 5 configuraciones, debería aparecer scroll")
+            print("6. Verifica que el scroll funcione correctamente")
+            print("7. Prueba colapsar y expandir varias veces")
+
+            # Preguntar si limpiar
+            print(f"\n⚠️  NOTA: Después de probar, ejecuta este script con --cleanup")
+            print("   o elimina manualmente las configuraciones de prueba")
+
+        else:
+            print("❌ No se pudieron crear configuraciones de prueba")
+
+
+async def cleanup():
     """Función para limpiar configuraciones de prueba"""
     print("🧹 LIMPIEZA DE CONFIGURACIONES DE PRUEBA")
     print("="*50)
-    
-    all_configs = list_all_configurations()
-    
-    # Configuraciones que probablemente son de prueba
-    test_keywords = ['prueba', 'test', 'casa', 'oficina', 'industrial', 'rv', 'cabina', 'respaldo', 'ups']
-    test_configs = []
-    
-    for config_name in all_configs:
-        if any(keyword in config_name.lower() for keyword in test_keywords):
-            test_configs.append(config_name)
-    
-    if test_configs:
-        print(f"📋 Configuraciones que parecen de prueba ({len(test_configs)}):")
-        for i, name in enumerate(test_configs, 1):
-            print(f"   {i}. {name}")
-        
-        confirm = input(f"\n¿Eliminar estas {len(test_configs)} configuraciones? (s/N): ")
-        if confirm.lower() in ['s', 'si', 'sí', 'y', 'yes']:
-            cleanup_test_configurations(test_configs)
+
+    async with make_client() as client:
+        # Búsqueda en el servidor, una consulta por palabra clave en paralelo
+        results = await gather_limited(
+            list_all_configurations(client, search=keyword, quiet=True) for keyword in TEST_KEYWORDS
+        )
+        test_configs = sorted({
+            name for result in results if isinstance(result, list) for name in result
+        })
+
+        if test_configs:
+            print(f"📋 Configuraciones que parecen de prueba ({len(test_configs)}):")
+            for i, name in enumerate(test_configs, 1):
+                print(f"   {i}. {name}")
+
+            confirm = input(f"\n¿Eliminar estas {len(test_configs)} configuraciones? (s/N): ")
+            if confirm.lower() in ['s', 'si', 'sí', 'y', 'yes']:
+                await cleanup_test_configurations(client, test_configs)
+            else:
+                print("❌ Limpieza cancelada")
         else:
-            print("❌ Limpieza cancelada")
-    else:
-        print("✅ No se encontraron configuraciones de prueba para eliminar")
+            print("✅ No se encontraron configuraciones de prueba para eliminar")
 
 if __name__ == "__main__":
-    import sys
-    
     if len(sys.argv) > 1 and sys.argv[1] == '--cleanup':
-        cleanup()
+        asyncio.run(cleanup())
+    elif len(sys.argv) > 2 and sys.argv[1] == '--sites':
+        asyncio.run(main(sys.argv[2]))
     else:
-        main()
+        asyncio.run(main())